@@ -0,0 +1,490 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from aiohttp import web
+
+# Benchmark offline: riproduce eventi del gateway (sintetici o registrati) negli handler di bot.py
+# e consegna i log a un finto backend REST locale che simula i bucket di rate limit di Discord.
+# Nessun token reale richiesto: python bench.py --guilds 20 --events 20000
+
+BENCH_TOKEN = "bench.token"
+BOT_USER_ID = 1000
+DISCORD_EPOCH = 1420070400000
+
+# ========== EVENTI SINTETICI ==========
+
+EVENT_WEIGHTS = {
+    "MESSAGE_CREATE": 60,
+    "MESSAGE_UPDATE": 10,
+    "MESSAGE_DELETE": 10,
+    "GUILD_MEMBER_ADD": 8,
+    "GUILD_ROLE_UPDATE": 4,
+    "CHANNEL_UPDATE": 4,
+    "GUILD_MEMBER_UPDATE": 4
+}
+
+class Snowflakes:
+    def __init__(self):
+        self.counter = 0
+
+    def next(self):
+        self.counter += 1
+        return str(((int(time.time() * 1000) - DISCORD_EPOCH) << 22) + (self.counter & 0x3FFFFF))
+
+def iso_now():
+    return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime())
+
+def user_payload(user_id, name, bot=False):
+    return {"id": str(user_id), "username": name, "discriminator": "0", "global_name": None, "avatar": None, "bot": bot}
+
+def member_payload(user):
+    return {"user": user, "roles": [], "joined_at": iso_now(), "deaf": False, "mute": False, "nick": None, "flags": 0}
+
+def role_payload(role_id, name, position):
+    return {
+        "id": role_id, "name": name, "color": 0, "hoist": False, "position": position,
+        "permissions": "0", "managed": False, "mentionable": False, "flags": 0
+    }
+
+def channel_payload(channel_id, guild_id, name, position):
+    return {
+        "id": channel_id, "guild_id": guild_id, "type": 0, "name": name,
+        "position": position, "permission_overwrites": [], "topic": None, "nsfw": False
+    }
+
+def message_payload(message_id, channel_id, guild_id, author, content):
+    payload = {
+        "id": message_id, "channel_id": channel_id, "author": author, "content": content,
+        "timestamp": iso_now(), "edited_timestamp": None, "tts": False, "mention_everyone": False,
+        "mentions": [], "mention_roles": [], "attachments": [], "embeds": [], "pinned": False,
+        "type": 0, "flags": 0
+    }
+    if guild_id is not None:
+        payload["guild_id"] = guild_id
+        payload["member"] = {"roles": [], "joined_at": iso_now(), "deaf": False, "mute": False}
+    return payload
+
+class SyntheticGuild:
+    def __init__(self, snowflakes, index, log_types, users):
+        self.id = snowflakes.next()
+        self.name = f"bench-{index}"
+        self.users = users
+        self.log_channels = {log_type: snowflakes.next() for log_type in log_types}
+        self.chat_channels = [snowflakes.next() for _ in range(5)]
+        self.roles = [role_payload(self.id, "@everyone", 0)] + [
+            role_payload(snowflakes.next(), f"ruolo-{i}", i + 1) for i in range(10)
+        ]
+        self.channels = [
+            channel_payload(channel_id, self.id, f"log-{log_type}", position)
+            for position, (log_type, channel_id) in enumerate(self.log_channels.items())
+        ] + [
+            channel_payload(channel_id, self.id, f"chat-{i}", 100 + i)
+            for i, channel_id in enumerate(self.chat_channels)
+        ]
+        self.recent_messages = []
+
+    def create_event(self):
+        return {
+            "id": self.id, "name": self.name, "icon": None, "owner_id": self.users[0]["id"],
+            "roles": self.roles, "channels": self.channels, "threads": [], "emojis": [], "stickers": [],
+            "members": [member_payload(user) for user in self.users], "member_count": len(self.users),
+            "features": [], "large": False, "afk_timeout": 300, "verification_level": 0,
+            "default_message_notifications": 0, "explicit_content_filter": 0, "mfa_level": 0,
+            "premium_tier": 0, "premium_subscription_count": 0, "preferred_locale": "it",
+            "nsfw_level": 0, "system_channel_flags": 0, "voice_states": [], "presences": []
+        }
+
+def synthetic_events(rng, guilds, count, snowflakes):
+    # Genera eventi nel formato del gateway: {"t": nome, "d": payload}
+    kinds = list(EVENT_WEIGHTS)
+    weights = list(EVENT_WEIGHTS.values())
+    for _ in range(count):
+        guild = rng.choice(guilds)
+        kind = rng.choices(kinds, weights)[0]
+        if kind in ("MESSAGE_UPDATE", "MESSAGE_DELETE") and not guild.recent_messages:
+            kind = "MESSAGE_CREATE"
+        if kind == "MESSAGE_CREATE":
+            author = rng.choice(guild.users)
+            message = message_payload(snowflakes.next(), rng.choice(guild.chat_channels), guild.id, author, f"messaggio {rng.random():.6f}")
+            guild.recent_messages.append(message)
+            del guild.recent_messages[:-200]
+            yield {"t": kind, "d": message}
+        elif kind == "MESSAGE_UPDATE":
+            message = dict(rng.choice(guild.recent_messages))
+            message["content"] += " (modificato)"
+            message["edited_timestamp"] = iso_now()
+            yield {"t": kind, "d": message}
+        elif kind == "MESSAGE_DELETE":
+            message = guild.recent_messages.pop(rng.randrange(len(guild.recent_messages)))
+            yield {"t": kind, "d": {"id": message["id"], "channel_id": message["channel_id"], "guild_id": guild.id}}
+        elif kind == "GUILD_MEMBER_ADD":
+            user = user_payload(snowflakes.next(), f"nuovo-{rng.randrange(10 ** 6)}")
+            yield {"t": kind, "d": dict(member_payload(user), guild_id=guild.id)}
+        elif kind == "GUILD_ROLE_UPDATE":
+            role = dict(rng.choice(guild.roles[1:]))
+            role["color"] = rng.randrange(0xFFFFFF)
+            role["name"] = f"ruolo-{rng.randrange(1000)}"
+            yield {"t": kind, "d": {"guild_id": guild.id, "role": role}}
+        elif kind == "CHANNEL_UPDATE":
+            channel = dict(rng.choice(guild.channels[-len(guild.chat_channels):]))
+            channel["topic"] = f"argomento {rng.randrange(1000)}"
+            channel["name"] = f"chat-{rng.randrange(1000)}"
+            yield {"t": kind, "d": channel}
+        else:
+            # Cambio username: discord.py lo rileva dal member update e genera on_user_update
+            user = rng.choice(guild.users)
+            user["username"] = f"utente-{rng.randrange(10 ** 6)}"
+            yield {"t": kind, "d": dict(member_payload(dict(user)), guild_id=guild.id)}
+
+def read_replay(path):
+    # Accetta sia {"t", "d"} sia i frame grezzi del gateway ({"op": 0, "t", "d"})
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            frame = json.loads(line)
+            if frame.get("op", 0) == 0 and frame.get("t"):
+                yield {"t": frame["t"], "d": frame["d"]}
+
+# ========== FINTO BACKEND REST ==========
+
+def json_response(body, status, headers):
+    # discord.py decodifica solo se il content-type è esattamente application/json
+    headers["Content-Type"] = "application/json"
+    return web.Response(body=json.dumps(body).encode(), status=status, headers=headers)
+
+class FakeDiscord:
+    # Bucket per rotta e canale come Discord: limite fisso per finestra, 429 con retry_after
+    def __init__(self, bucket_limit, bucket_window, global_limit):
+        self.bucket_limit = bucket_limit
+        self.bucket_window = bucket_window
+        self.global_limit = global_limit
+        self.buckets = {}   # chiave bucket -> (inizio finestra, richieste)
+        self.global_window = (0.0, 0)
+        self.calls = 0
+        self.rate_limited = 0
+        self.routes = {}
+        self.snowflakes = Snowflakes()
+        self.runner = None
+        self.port = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/api/v10/{path:.*}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}/api/v10"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def reset_counters(self):
+        self.calls = 0
+        self.rate_limited = 0
+        self.routes.clear()
+
+    def _bucket_key(self, request, parts):
+        # Il parametro principale (canale o webhook) separa i bucket, come sull'API reale
+        major = parts[1] if len(parts) > 1 and parts[0] in ("channels", "webhooks", "guilds") else ""
+        return f"{request.method} {parts[0] if parts else ''}/{major}/{'/'.join(parts[2:3])}"
+
+    def _take(self, key, now):
+        start, used = self.global_window
+        if now - start >= 1.0:
+            start, used = now, 0
+        if used >= self.global_limit:
+            return 1.0 - (now - start), True, 0, 0.0
+        start_bucket, used_bucket = self.buckets.get(key, (now, 0))
+        if now - start_bucket >= self.bucket_window:
+            start_bucket, used_bucket = now, 0
+        reset_after = self.bucket_window - (now - start_bucket)
+        if used_bucket >= self.bucket_limit:
+            return reset_after, False, 0, reset_after
+        self.global_window = (start, used + 1)
+        self.buckets[key] = (start_bucket, used_bucket + 1)
+        return None, False, self.bucket_limit - used_bucket - 1, reset_after
+
+    async def handle(self, request):
+        parts = request.match_info["path"].split("/")
+        key = self._bucket_key(request, parts)
+        now = time.monotonic()
+        self.calls += 1
+        route = f"{request.method} /{parts[0]}" + ("/{id}" if len(parts) > 1 else "") + ("/" + "/".join(parts[2:3]) if len(parts) > 2 and parts[0] != "webhooks" else "")
+        self.routes[route] = self.routes.get(route, 0) + 1
+        retry_after, is_global, remaining, reset_after = self._take(key, now)
+        if retry_after is not None:
+            self.rate_limited += 1
+            # Senza l'header Via discord.py tratta il 429 come un blocco di Cloudflare
+            headers = {"X-RateLimit-Scope": "global" if is_global else "user", "Via": "1.1 google"}
+            if is_global:
+                headers["X-RateLimit-Global"] = "true"
+            else:
+                headers.update({
+                    "X-RateLimit-Limit": str(self.bucket_limit), "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset-After": f"{retry_after:.3f}", "X-RateLimit-Bucket": key
+                })
+            body = {"message": "You are being rate limited.", "retry_after": round(retry_after, 3), "global": is_global}
+            return json_response(body, 429, headers)
+        headers = {
+            "X-RateLimit-Limit": str(self.bucket_limit), "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}", "X-RateLimit-Bucket": key
+        }
+        return json_response(await self.response(request, parts), 200, headers)
+
+    async def response(self, request, parts):
+        if parts[:2] == ["users", "@me"]:
+            return user_payload(BOT_USER_ID, "LogBench", bot=True)
+        if parts[:3] == ["oauth2", "applications", "@me"]:
+            return {
+                "id": str(BOT_USER_ID), "name": "LogBench", "description": "", "icon": None,
+                "bot_public": False, "bot_require_code_grant": False, "verify_key": "",
+                "owner": user_payload(1, "owner"), "flags": 0
+            }
+        if request.method == "POST" and parts[0] == "channels" and parts[2:3] == ["messages"]:
+            if request.content_type == "application/json":
+                body = await request.json()
+            else:
+                body = {}
+                async for part in (await request.multipart()):
+                    if part.name == "payload_json":
+                        body = json.loads(await part.text())
+                    else:
+                        await part.read()
+            message = message_payload(self.snowflakes.next(), parts[1], None, user_payload(BOT_USER_ID, "LogBench", bot=True), body.get("content") or "")
+            message["embeds"] = body.get("embeds", [])
+            return message
+        await request.read()
+        return {}
+
+# ========== ESECUZIONE ==========
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux restituisce KiB, macOS byte
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+async def run_bench(args):
+    fake = FakeDiscord(args.bucket_limit, args.bucket_window, args.global_limit)
+    base_url = await fake.start()
+
+    import discord
+    discord.http.Route.BASE = base_url
+    import bot as logbot
+
+    client = logbot.bot
+    state = client._connection
+    # Nessun gateway: i membri arrivano già nel GUILD_CREATE sintetico
+    state._chunk_guilds = False
+    await client.login(BENCH_TOKEN)
+    # setup_hook avvia la sincronizzazione dei comandi in background: va completata prima di azzerare i contatori
+    await client.command_sync_task
+
+    rng = random.Random(args.seed)
+    snowflakes = Snowflakes()
+    if args.replay:
+        frames = list(read_replay(args.replay))
+    else:
+        log_types = [log_type for log_type in logbot.DEFAULT_LOG_CHANNELS if log_type in logbot.ENABLED_LOG_TYPES]
+        users = [user_payload(snowflakes.next(), f"utente-{i}") for i in range(args.users)]
+        guilds = []
+        for index in range(args.guilds):
+            # Ogni utente è in più server, così on_user_update fa fan-out reale
+            members = rng.sample(users, min(len(users), args.members))
+            guilds.append(SyntheticGuild(snowflakes, index, log_types, members))
+        frames = [{"t": "GUILD_CREATE", "d": guild.create_event()} for guild in guilds]
+        frames.extend(synthetic_events(rng, guilds, args.events, snowflakes))
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            for frame in frames:
+                f.write(json.dumps(frame) + "\n")
+
+    # Latenza di ogni handler: avvolge _run_event, già cronometrato da LogBot per le metriche
+    latencies = []
+    running = 0
+    idle = asyncio.Event()
+    idle.set()
+    class_run_event = type(client)._run_event
+
+    async def timed_run_event(coro, event_name, *a, **kw):
+        nonlocal running
+        running += 1
+        idle.clear()
+        start = time.perf_counter()
+        try:
+            await class_run_event(client, coro, event_name, *a, **kw)
+        finally:
+            latencies.append(time.perf_counter() - start)
+            running -= 1
+            if not running:
+                idle.set()
+
+    client._run_event = timed_run_event
+
+    parsers = state.parsers
+    guild_frames = [frame for frame in frames if frame["t"] == "GUILD_CREATE"]
+    event_frames = [frame for frame in frames if frame["t"] != "GUILD_CREATE"]
+    for frame in guild_frames:
+        parsers["GUILD_CREATE"](frame["d"])
+        if not args.replay:
+            continue
+        # Nei replay registrati i canali di log si associano per nome, altrimenti al primo canale testuale
+        guild = client.get_guild(int(frame["d"]["id"]))
+        if guild is None or str(guild.id) in logbot.logs_channels or not guild.text_channels:
+            continue
+        by_name = {channel.name: channel.id for channel in guild.text_channels}
+        logs_channels = logbot.logs_channels[str(guild.id)] = {}
+        for log_type, name in logbot.DEFAULT_LOG_CHANNELS.items():
+            logs_channels[log_type] = by_name.get(name, guild.text_channels[0].id)
+    if not args.replay:
+        for guild in guilds:
+            logbot.logs_channels[guild.id] = {log_type: int(channel_id) for log_type, channel_id in guild.log_channels.items()}
+            if logbot.LOG_WEBHOOK_MODE:
+                logbot.logs_webhooks[str(guild.id)] = {
+                    log_type: {"id": channel_id, "token": f"token-{channel_id}"}
+                    for log_type, channel_id in guild.log_channels.items()
+                }
+    for guild in client.guilds:
+        logbot.build_guild_routes(guild)
+    await idle.wait()
+    latencies.clear()
+    fake.reset_counters()
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    print(f"▶️ {len(event_frames)} eventi su {len(client.guilds)} server")
+    start = time.perf_counter()
+    unknown = set()
+    for i, frame in enumerate(event_frames, 1):
+        parser = parsers.get(frame["t"])
+        if parser is None:
+            unknown.add(frame["t"])
+            continue
+        parser(frame["d"])
+        if i % args.yield_every == 0:
+            await asyncio.sleep(0)
+    await idle.wait()
+    handled = time.perf_counter() - start
+
+    # Attende lo svuotamento delle code di invio verso il finto backend
+    drain_start = time.perf_counter()
+    deadline = drain_start + args.drain_timeout
+    while logbot.log_batcher.tasks and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    # Stesso percorso di chiusura del bot: correlatore, code, outbox, archivio e sessioni HTTP
+    await client.close()
+    drained = time.perf_counter() - drain_start
+    queued_left = sum(len(queue) for queues in logbot.log_batcher.queues.values() for queue in queues)
+
+    traced_peak = None
+    if args.tracemalloc:
+        traced_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+
+    latencies.sort()
+    events = len(event_frames) - sum(1 for frame in event_frames if frame["t"] in unknown)
+    report = {
+        "eventi": events,
+        "server": len(client.guilds),
+        "handler": len(latencies),
+        "eventi_al_secondo": round(events / handled, 1) if handled else 0.0,
+        "handler_p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "handler_p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "handler_max_ms": round((latencies[-1] if latencies else 0.0) * 1000, 3),
+        "chiamate_rest": fake.calls,
+        "chiamate_rest_per_evento": round(fake.calls / events, 4) if events else 0.0,
+        "risposte_429": fake.rate_limited,
+        "rotte": dict(sorted(fake.routes.items())),
+        "svuotamento_s": round(drained, 3),
+        "log_non_consegnati": queued_left,
+        "log_scartati": dict(logbot.log_batcher.shed),
+        "picco_rss_mb": round(peak_rss_mb(), 1) if resource is not None else None,
+        "picco_tracemalloc_mb": round(traced_peak, 1) if traced_peak is not None else None
+    }
+    if unknown:
+        report["eventi_ignorati"] = sorted(unknown)
+
+    await fake.stop()
+    return report
+
+def print_report(report):
+    print("📊 Risultati benchmark")
+    print(f"  Eventi: {report['eventi']} ({report['handler']} handler) su {report['server']} server")
+    print(f"  Throughput: {report['eventi_al_secondo']} eventi/s")
+    print(f"  Latenza handler: p50 {report['handler_p50_ms']} ms, p99 {report['handler_p99_ms']} ms, max {report['handler_max_ms']} ms")
+    print(f"  REST: {report['chiamate_rest']} chiamate ({report['chiamate_rest_per_evento']} per evento), {report['risposte_429']} risposte 429")
+    for route, count in report["rotte"].items():
+        print(f"    {route}: {count}")
+    print(f"  Svuotamento code: {report['svuotamento_s']} s, log non consegnati: {report['log_non_consegnati']}")
+    if report["log_scartati"]:
+        print(f"  Log scartati: {report['log_scartati']}")
+    if report["picco_rss_mb"] is not None:
+        print(f"  Picco memoria (RSS): {report['picco_rss_mb']} MB")
+    if report["picco_tracemalloc_mb"] is not None:
+        print(f"  Picco memoria Python (tracemalloc): {report['picco_tracemalloc_mb']} MB")
+    if report.get("eventi_ignorati"):
+        print(f"  ⚠️ Eventi senza parser: {', '.join(report['eventi_ignorati'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline della pipeline di logging")
+    parser.add_argument("--guilds", type=int, default=20, help="server sintetici")
+    parser.add_argument("--users", type=int, default=2000, help="utenti sintetici totali")
+    parser.add_argument("--members", type=int, default=200, help="membri per server")
+    parser.add_argument("--events", type=int, default=20000, help="eventi sintetici da generare")
+    parser.add_argument("--seed", type=int, default=2025)
+    parser.add_argument("--replay", help="file JSONL di eventi del gateway registrati")
+    parser.add_argument("--record", help="salva gli eventi generati in JSONL per riprodurli")
+    parser.add_argument("--bucket-limit", type=int, default=5, help="richieste per bucket e finestra")
+    parser.add_argument("--bucket-window", type=float, default=1.0, help="durata della finestra del bucket (s)")
+    parser.add_argument("--global-limit", type=int, default=50, help="richieste globali al secondo")
+    parser.add_argument("--yield-every", type=int, default=1, help="eventi tra un passaggio all'event loop e l'altro")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="attesa massima per lo svuotamento delle code (s)")
+    parser.add_argument("--tracemalloc", action="store_true", help="misura il picco di memoria Python (rallenta)")
+    parser.add_argument("--json", action="store_true", help="stampa il report in JSON")
+    args = parser.parse_args()
+
+    if args.replay:
+        args.replay = os.path.abspath(args.replay)
+    if args.record:
+        args.record = os.path.abspath(args.record)
+    # Configurazione, database e archivio del bot restano in una cartella temporanea
+    workdir = tempfile.mkdtemp(prefix="logbench-")
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ.setdefault("LOG_METRICS_PORT", "0")
+
+    try:
+        report = asyncio.run(run_bench(args))
+    finally:
+        os.chdir(os.path.dirname(workdir))
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
@@ -1,745 +1,4645 @@
-import logging
-import os
-import json
-from datetime import datetime
-import discord
-from discord.ext import commands
-from discord import app_commands, Embed, Color, Interaction
-
-LOGS_CONFIG_FILE = "logs_channels.json"
-LOGS_CATEGORY_NAME = "📑・LOGS SERVER"
-DEFAULT_LOG_CHANNELS = {
-    "messaggi": "💬・messaggi",
-    "messaggi_modificati": "✏️・messaggi-modificati",
-    "messaggi_cancellati": "🗑️・messaggi-cancellati",
-    "join_leave": "👋・join-leave",
-    "ban_unban": "🔨・ban-unban",
-    "ruoli": "🎭・ruoli",
-    "canali": "📁・canali",
-    "nickname": "📝・nickname",
-    "avatar": "🖼️・avatar",
-    "voice": "🔊・voice",
-    "inviti": "🔗・inviti",
-    "emoji": "😃・emoji",
-    "webhook": "🌐・webhook",
-    "integrazioni": "🔌・integrazioni",
-    "audit": "🕵️・audit-log",
-    "moderazione": "🛡️・moderazione",
-    "boost": "🚀・boost",
-    "permessi": "🔑・permessi",
-    "thread": "🧵・thread",
-    "stage": "🎤・stage",
-    "stickers": "🏷️・stickers",
-    "scheduled_events": "📅・eventi-programmati",
-    "guild_update": "🏛️・server-update",
-    "member_update": "👤・member-update",
-    "role_update": "🛠️・ruoli-update",
-    "channel_update": "🔄・canali-update"
-}
-
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-# ========== GESTIONE FILE LOGS ==========
-
-def load_logs_channels():
-    if not os.path.exists(LOGS_CONFIG_FILE):
-        return {}
-    try:
-        with open(LOGS_CONFIG_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            # Controllo integrità dati
-            if not isinstance(data, dict):
-                print("❌ logs_channels.json corrotto: non è un dizionario.")
-                return {}
-            # Rimuovi guild_id non validi
-            valid_data = {}
-            for gid, channels in data.items():
-                if not gid.isdigit() or not isinstance(channels, dict):
-                    continue
-                valid_channels = {}
-                for log_type, channel_id in channels.items():
-                    if log_type in DEFAULT_LOG_CHANNELS and isinstance(channel_id, int):
-                        valid_channels[log_type] = channel_id
-                if valid_channels:
-                    valid_data[gid] = valid_channels
-            return valid_data
-    except Exception as e:
-        print(f"❌ Errore caricamento logs_channels.json: {e}")
-        return {}
-
-def save_logs_channels(data):
-    try:
-        # Salva solo guild_id e log_type validi
-        safe_data = {}
-        for gid, channels in data.items():
-            if not str(gid).isdigit():
-                continue
-            safe_channels = {}
-            for log_type, channel_id in channels.items():
-                if log_type in DEFAULT_LOG_CHANNELS and isinstance(channel_id, int):
-                    safe_channels[log_type] = channel_id
-            if safe_channels:
-                safe_data[str(gid)] = safe_channels
-        with open(LOGS_CONFIG_FILE, "w", encoding="utf-8") as f:
-            json.dump(safe_data, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        print(f"❌ Errore salvataggio logs_channels.json: {e}")
-
-logs_channels = load_logs_channels()
-
-async def get_log_channel(guild, log_type):
-    guild_id = str(guild.id)
-    if guild_id in logs_channels and log_type in logs_channels[guild_id]:
-        channel_id = logs_channels[guild_id][log_type]
-        channel = guild.get_channel(channel_id)
-        # Controllo sicurezza: il canale esiste ancora?
-        if channel and isinstance(channel, discord.TextChannel):
-            return channel
-        else:
-            # Se il canale non esiste più, rimuovilo dal json
-            logs_channels[guild_id].pop(log_type, None)
-            save_logs_channels(logs_channels)
-    return None
-
-# ========== COMANDO SETUP LOGS ==========
-
-@bot.tree.command(name="setup_logs", description="Configura automaticamente tutti i canali di log.")
-@app_commands.checks.has_permissions(administrator=True)
-async def setup_logs(interaction: Interaction):
-    guild = interaction.guild
-    if guild is None:
-        await interaction.response.send_message("> ❌ **Questo comando può essere usato solo in un server.**", ephemeral=True)
-        return
-
-    await interaction.response.defer(ephemeral=True, thinking=True)
-    overwrites = {
-        guild.default_role: discord.PermissionOverwrite(read_messages=False),
-        guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True, manage_channels=True)
-    }
-
-    # Crea o trova la categoria
-    category = discord.utils.get(guild.categories, name=LOGS_CATEGORY_NAME)
-    if not category:
-        try:
-            category = await guild.create_category(LOGS_CATEGORY_NAME, overwrites=overwrites)
-        except Exception as e:
-            await interaction.followup.send(f"❌ Errore creazione categoria: {e}", ephemeral=True)
-            return
-    
-    created_channels = {}
-    for log_key, log_name in DEFAULT_LOG_CHANNELS.items():
-        channel = discord.utils.get(category.channels, name=log_name.lower())
-        if not channel:
-            try:
-                channel = await guild.create_text_channel(
-                    log_name,
-                    category=category,
-                    overwrites=overwrites,
-                    topic=f"🔔 Log automatico: {log_name}"
-                )
-            except Exception as e:
-                await interaction.followup.send(f"❌ Errore creazione canale {log_name}: {e}", ephemeral=True)
-                continue
-        created_channels[log_key] = channel.id
-
-    # Salva nel file json
-    logs_channels[str(guild.id)] = created_channels
-    save_logs_channels(logs_channels)
-
-    embed = Embed(
-        title="🟢 Log configurati con successo!",
-        description="> Tutti i canali di log sono stati **creati** e **configurati** correttamente.\n\n"
-                    "Puoi personalizzare i permessi o la posizione dei canali a tuo piacimento.",
-        color=Color.green()
-    )
-    embed.set_footer(text="Log System • 2025", icon_url=bot.user.display_avatar.url)
-    await interaction.followup.send(embed=embed)
-
-# ========== EVENTI DI LOGGING ==========
-
-def log_embed(
-    title: str,
-    description: str,
-    color=Color.blurple(),
-    fields=None,
-    author=None,
-    thumbnail=None,
-    footer=None,
-    timestamp=True
-):
-    embed = Embed(
-        title=title,
-        description=description,
-        color=color
-    )
-    if fields:
-        for name, value, inline in fields:
-            embed.add_field(name=name, value=value, inline=inline)
-    if author:
-        embed.set_author(name=author[0], icon_url=author[1] if len(author) > 1 else discord.Embed.Empty)
-    if thumbnail:
-        embed.set_thumbnail(url=thumbnail)
-    if footer:
-        embed.set_footer(text=footer)
-    else:
-        embed.set_footer(text="Log System • 2025")
-    if timestamp:
-        embed.timestamp = datetime.utcnow()
-    return embed
-
-async def send_log(guild, log_type, embed):
-    channel = await get_log_channel(guild, log_type)
-    if channel:
-        try:
-            await channel.send(embed=embed)
-        except Exception as e:
-            print(f"❌ Errore invio log ({log_type}): {e}")
-
-# ========== AVVIO DEL BOT ==========
-
-if __name__ == "__main__":
-    TOKEN = os.getenv("DISCORD_TOKEN") or "INSERISCI_IL_TUO_TOKEN"
-    if TOKEN == "INSERISCI_IL_TUO_TOKEN":
-        print("❌ Inserisci il token del bot in una variabile d'ambiente DISCORD_TOKEN o direttamente nel codice!")
-    else:
-        # --- Sincronizzazione dei comandi slash ---
-        @bot.event
-        async def on_ready():
-            print(f"✅ Bot connesso come {bot.user}")
-            try:
-                synced = await bot.tree.sync()
-                print(f"🔄 Comandi slash sincronizzati: {len(synced)}")
-            except Exception as e:
-                print(f"❌ Errore sincronizzazione comandi slash: {e}")
-
-        # ========== EVENTI DI LOGGING AVANZATI ==========
-
-        # Log messaggi inviati
-        @bot.event
-        async def on_message(message):
-            if message.author.bot or not message.guild:
-                return
-            embed = log_embed(
-                title="💬 Nuovo messaggio",
-                description=f"**{message.author.mention}** ha inviato un messaggio in {message.channel.mention}",
-                color=Color.blue(),
-                fields=[
-                    ("Contenuto", message.content[:1024] if message.content else "*Nessun testo*", False),
-                    ("ID Utente", str(message.author.id), True),
-                    ("ID Messaggio", str(message.id), True)
-                ],
-                author=(str(message.author), message.author.display_avatar.url),
-                timestamp=True
-            )
-            await send_log(message.guild, "messaggi", embed)
-            await bot.process_commands(message)
-
-        # Log messaggi modificati
-        @bot.event
-        async def on_message_edit(before, after):
-            if before.author.bot or not before.guild:
-                return
-            if before.content == after.content:
-                return
-            embed = log_embed(
-                title="✏️ Messaggio modificato",
-                description=f"**{before.author.mention}** ha modificato un messaggio in {before.channel.mention}",
-                color=Color.orange(),
-                fields=[
-                    ("Prima", before.content[:1024] if before.content else "*Vuoto*", False),
-                    ("Dopo", after.content[:1024] if after.content else "*Vuoto*", False),
-                    ("ID Messaggio", str(before.id), True)
-                ],
-                author=(str(before.author), before.author.display_avatar.url),
-                timestamp=True
-            )
-            await send_log(before.guild, "messaggi_modificati", embed)
-
-        # Log messaggi cancellati
-        @bot.event
-        async def on_message_delete(message):
-            if message.author.bot or not message.guild:
-                return
-            embed = log_embed(
-                title="🗑️ Messaggio eliminato",
-                description=f"**{message.author.mention}** ha eliminato un messaggio in {message.channel.mention}",
-                color=Color.red(),
-                fields=[
-                    ("Contenuto", message.content[:1024] if message.content else "*Nessun testo*", False),
-                    ("ID Messaggio", str(message.id), True)
-                ],
-                author=(str(message.author), message.author.display_avatar.url),
-                timestamp=True
-            )
-            await send_log(message.guild, "messaggi_cancellati", embed)
-
-        # Log join/leave
-        @bot.event
-        async def on_member_join(member):
-            if not member.guild:
-                return
-            embed = log_embed(
-                title="👋 Utente entrato",
-                description=f"{member.mention} è entrato nel server.",
-                color=Color.green(),
-                fields=[
-                    ("ID Utente", str(member.id), True),
-                    ("Account creato", member.created_at.strftime('%d/%m/%Y %H:%M'), True)
-                ],
-                author=(str(member), member.display_avatar.url),
-                timestamp=True
-            )
-            await send_log(member.guild, "join_leave", embed)
-
-        @bot.event
-        async def on_member_remove(member):
-            if not member.guild:
-                return
-            embed = log_embed(
-                title="👋 Utente uscito",
-                description=f"{member.mention} ha lasciato il server.",
-                color=Color.red(),
-                fields=[
-                    ("ID Utente", str(member.id), True),
-                    ("Account creato", member.created_at.strftime('%d/%m/%Y %H:%M'), True)
-                ],
-                author=(str(member), member.display_avatar.url),
-                timestamp=True
-            )
-            await send_log(member.guild, "join_leave", embed)
-
-        # Log ban/unban
-        @bot.event
-        async def on_member_ban(guild, user):
-            embed = log_embed(
-                title="🔨 Utente bannato",
-                description=f"{user.mention if hasattr(user, 'mention') else user} è stato **bannato**.",
-                color=Color.red(),
-                fields=[
-                    ("ID Utente", str(user.id), True)
-                ],
-                author=(str(user), user.display_avatar.url if hasattr(user, "display_avatar") else None),
-                timestamp=True
-            )
-            await send_log(guild, "ban_unban", embed)
-
-        @bot.event
-        async def on_member_unban(guild, user):
-            embed = log_embed(
-                title="🔨 Utente sbannato",
-                description=f"{user.mention if hasattr(user, 'mention') else user} è stato **sbannato**.",
-                color=Color.green(),
-                fields=[
-                    ("ID Utente", str(user.id), True)
-                ],
-                author=(str(user), user.display_avatar.url if hasattr(user, "display_avatar") else None),
-                timestamp=True
-            )
-            await send_log(guild, "ban_unban", embed)
-
-        # Log ruoli creati/eliminati/modificati
-        @bot.event
-        async def on_guild_role_create(role):
-            embed = log_embed(
-                title="🎭 Ruolo creato",
-                description=f"Ruolo `{role.name}` creato.",
-                color=Color.green(),
-                fields=[
-                    ("ID Ruolo", str(role.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(role.guild, "ruoli", embed)
-
-        @bot.event
-        async def on_guild_role_delete(role):
-            embed = log_embed(
-                title="🎭 Ruolo eliminato",
-                description=f"Ruolo `{role.name}` eliminato.",
-                color=Color.red(),
-                fields=[
-                    ("ID Ruolo", str(role.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(role.guild, "ruoli", embed)
-
-        @bot.event
-        async def on_guild_role_update(before, after):
-            changes = []
-            if before.name != after.name:
-                changes.append(f"Nome: `{before.name}` → `{after.name}`")
-            if before.permissions != after.permissions:
-                changes.append("Permessi modificati")
-            if before.color != after.color:
-                changes.append(f"Colore: `{before.color}` → `{after.color}`")
-            if not changes:
-                return
-            embed = log_embed(
-                title="🛠️ Ruolo modificato",
-                description=f"Ruolo `{before.name}` modificato.\n" + "\n".join(changes),
-                color=Color.orange(),
-                fields=[
-                    ("ID Ruolo", str(before.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(after.guild, "role_update", embed)
-
-        # Log canali creati/eliminati/modificati
-        @bot.event
-        async def on_guild_channel_create(channel):
-            embed = log_embed(
-                title="📁 Canale creato",
-                description=f"Canale `{channel.name}` creato ({str(channel.type)})",
-                color=Color.green(),
-                fields=[
-                    ("ID Canale", str(channel.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(channel.guild, "canali", embed)
-
-        @bot.event
-        async def on_guild_channel_delete(channel):
-            embed = log_embed(
-                title="📁 Canale eliminato",
-                description=f"Canale `{channel.name}` eliminato ({str(channel.type)})",
-                color=Color.red(),
-                fields=[
-                    ("ID Canale", str(channel.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(channel.guild, "canali", embed)
-
-        @bot.event
-        async def on_guild_channel_update(before, after):
-            changes = []
-            if before.name != after.name:
-                changes.append(f"Nome: `{before.name}` → `{after.name}`")
-            if before.topic != after.topic:
-                changes.append("Topic modificato")
-            if before.category != after.category:
-                changes.append("Categoria modificata")
-            if not changes:
-                return
-            embed = log_embed(
-                title="🔄 Canale modificato",
-                description=f"Canale `{before.name}` modificato.\n" + "\n".join(changes),
-                color=Color.orange(),
-                fields=[
-                    ("ID Canale", str(before.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(after.guild, "channel_update", embed)
-
-        # Log nickname e avatar
-        @bot.event
-        async def on_user_update(before, after):
-            if before.avatar != after.avatar:
-                embed = log_embed(
-                    title="🖼️ Avatar cambiato",
-                    description=f"{after.mention if hasattr(after, 'mention') else after} ha cambiato avatar.",
-                    color=Color.blurple(),
-                    fields=[
-                        ("ID Utente", str(after.id), True)
-                    ],
-                    thumbnail=after.display_avatar.url if hasattr(after, "display_avatar") else None,
-                    timestamp=True
-                )
-                # Non c'è guild, quindi logga su tutte le guild dove è presente
-                for guild in bot.guilds:
-                    member = guild.get_member(after.id)
-                    if member:
-                        await send_log(guild, "avatar", embed)
-            if hasattr(before, "display_name") and hasattr(after, "display_name") and before.display_name != after.display_name:
-                embed = log_embed(
-                    title="📝 Nickname cambiato",
-                    description=f"{after.mention if hasattr(after, 'mention') else after} ha cambiato nickname.",
-                    color=Color.blurple(),
-                    fields=[
-                        ("Prima", before.display_name, True),
-                        ("Dopo", after.display_name, True),
-                        ("ID Utente", str(after.id), True)
-                    ],
-                    timestamp=True
-                )
-                for guild in bot.guilds:
-                    member = guild.get_member(after.id)
-                    if member:
-                        await send_log(guild, "nickname", embed)
-
-        # Log boost
-        @bot.event
-        async def on_member_update(before, after):
-            if before.premium_since != after.premium_since:
-                if after.premium_since:
-                    embed = log_embed(
-                        title="🚀 Boost ricevuto",
-                        description=f"{after.mention} ha boostato il server!",
-                        color=Color.purple(),
-                        fields=[
-                            ("ID Utente", str(after.id), True)
-                        ],
-                        timestamp=True
-                    )
-                else:
-                    embed = log_embed(
-                        title="🚀 Boost rimosso",
-                        description=f"{after.mention} ha rimosso il boost dal server.",
-                        color=Color.red(),
-                        fields=[
-                            ("ID Utente", str(after.id), True)
-                        ],
-                        timestamp=True
-                    )
-                await send_log(after.guild, "boost", embed)
-
-        # Log inviti
-        @bot.event
-        async def on_invite_create(invite):
-            embed = log_embed(
-                title="🔗 Invito creato",
-                description=f"Invito creato da {invite.inviter.mention if invite.inviter else 'N/A'} per {invite.channel.mention}",
-                color=Color.green(),
-                fields=[
-                    ("Codice", invite.code, True),
-                    ("Scadenza", str(invite.max_age) if invite.max_age else "Mai", True)
-                ],
-                timestamp=True
-            )
-            await send_log(invite.guild, "inviti", embed)
-
-        @bot.event
-        async def on_invite_delete(invite):
-            embed = log_embed(
-                title="🔗 Invito eliminato",
-                description=f"Invito eliminato per {invite.channel.mention}",
-                color=Color.red(),
-                fields=[
-                    ("Codice", invite.code, True)
-                ],
-                timestamp=True
-            )
-            await send_log(invite.guild, "inviti", embed)
-
-        # Log emoji
-        @bot.event
-        async def on_guild_emojis_update(guild, before, after):
-            before_set = set(e.id for e in before)
-            after_set = set(e.id for e in after)
-            added = [e for e in after if e.id not in before_set]
-            removed = [e for e in before if e.id not in after_set]
-            for emoji in added:
-                embed = log_embed(
-                    title="😃 Emoji aggiunta",
-                    description=f"Emoji `{emoji.name}` aggiunta.",
-                    color=Color.green(),
-                    fields=[
-                        ("ID Emoji", str(emoji.id), True)
-                    ],
-                    thumbnail=emoji.url,
-                    timestamp=True
-                )
-                await send_log(guild, "emoji", embed)
-            for emoji in removed:
-                embed = log_embed(
-                    title="😃 Emoji rimossa",
-                    description=f"Emoji `{emoji.name}` rimossa.",
-                    color=Color.red(),
-                    fields=[
-                        ("ID Emoji", str(emoji.id), True)
-                    ],
-                    thumbnail=emoji.url,
-                    timestamp=True
-                )
-                await send_log(guild, "emoji", embed)
-
-        # Log webhook
-        @bot.event
-        async def on_webhooks_update(channel):
-            embed = log_embed(
-                title="🌐 Webhook aggiornato",
-                description=f"Webhook aggiornato nel canale {channel.mention}",
-                color=Color.blurple(),
-                fields=[
-                    ("ID Canale", str(channel.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(channel.guild, "webhook", embed)
-
-        # Log integrazioni
-        @bot.event
-        async def on_guild_integrations_update(guild):
-            embed = log_embed(
-                title="🔌 Integrazioni aggiornate",
-                description=f"Le integrazioni del server sono state aggiornate.",
-                color=Color.blurple(),
-                timestamp=True
-            )
-            await send_log(guild, "integrazioni", embed)
-
-        # Log audit
-        @bot.event
-        async def on_audit_log_entry_create(entry):
-            embed = log_embed(
-                title="🕵️ Audit Log",
-                description=f"Nuova voce nell'audit log: {entry.action}",
-                color=Color.blurple(),
-                fields=[
-                    ("Utente", str(entry.user) if entry.user else "N/A", True),
-                    ("Target", str(entry.target) if entry.target else "N/A", True)
-                ],
-                timestamp=True
-            )
-            await send_log(entry.guild, "audit", embed)
-
-        # Log moderazione (kick)
-        @bot.event
-        async def on_member_kick(member):
-            embed = log_embed(
-                title="🛡️ Utente kickato",
-                description=f"{member.mention} è stato kickato dal server.",
-                color=Color.red(),
-                fields=[
-                    ("ID Utente", str(member.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(member.guild, "moderazione", embed)
-
-        # Log permessi
-        @bot.event
-        async def on_guild_update(before, after):
-            if before.verification_level != after.verification_level:
-                embed = log_embed(
-                    title="🔑 Livello verifica cambiato",
-                    description=f"Livello verifica: `{before.verification_level}` → `{after.verification_level}`",
-                    color=Color.orange(),
-                    timestamp=True
-                )
-                await send_log(after, "permessi", embed)
-            if before.name != after.name:
-                embed = log_embed(
-                    title="🏛️ Nome server cambiato",
-                    description=f"Nome: `{before.name}` → `{after.name}`",
-                    color=Color.orange(),
-                    timestamp=True
-                )
-                await send_log(after, "guild_update", embed)
-
-        # Log thread
-        @bot.event
-        async def on_thread_create(thread):
-            embed = log_embed(
-                title="🧵 Thread creato",
-                description=f"Thread `{thread.name}` creato in {thread.parent.mention if thread.parent else 'N/A'}",
-                color=Color.green(),
-                fields=[
-                    ("ID Thread", str(thread.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(thread.guild, "thread", embed)
-
-        @bot.event
-        async def on_thread_delete(thread):
-            embed = log_embed(
-                title="🧵 Thread eliminato",
-                description=f"Thread `{thread.name}` eliminato.",
-                color=Color.red(),
-                fields=[
-                    ("ID Thread", str(thread.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(thread.guild, "thread", embed)
-
-        # Log stage
-        @bot.event
-        async def on_stage_instance_create(stage_instance):
-            embed = log_embed(
-                title="🎤 Stage creato",
-                description=f"Stage `{stage_instance.topic}` creato in {stage_instance.channel.mention}",
-                color=Color.green(),
-                timestamp=True
-            )
-            await send_log(stage_instance.guild, "stage", embed)
-
-        @bot.event
-        async def on_stage_instance_delete(stage_instance):
-            embed = log_embed(
-                title="🎤 Stage eliminato",
-                description=f"Stage `{stage_instance.topic}` eliminato in {stage_instance.channel.mention}",
-                color=Color.red(),
-                timestamp=True
-            )
-            await send_log(stage_instance.guild, "stage", embed)
-
-        # Log stickers
-        @bot.event
-        async def on_guild_stickers_update(guild, before, after):
-            before_set = set(s.id for s in before)
-            after_set = set(s.id for s in after)
-            added = [s for s in after if s.id not in before_set]
-            removed = [s for s in before if s.id not in after_set]
-            for sticker in added:
-                embed = log_embed(
-                    title="🏷️ Sticker aggiunto",
-                    description=f"Sticker `{sticker.name}` aggiunto.",
-                    color=Color.green(),
-                    fields=[
-                        ("ID Sticker", str(sticker.id), True)
-                    ],
-                    timestamp=True
-                )
-                await send_log(guild, "stickers", embed)
-            for sticker in removed:
-                embed = log_embed(
-                    title="🏷️ Sticker rimosso",
-                    description=f"Sticker `{sticker.name}` rimosso.",
-                    color=Color.red(),
-                    fields=[
-                        ("ID Sticker", str(sticker.id), True)
-                    ],
-                    timestamp=True
-                )
-                await send_log(guild, "stickers", embed)
-
-        # Log eventi programmati
-        @bot.event
-        async def on_scheduled_event_create(event):
-            embed = log_embed(
-                title="📅 Evento programmato creato",
-                description=f"Evento `{event.name}` creato.",
-                color=Color.green(),
-                fields=[
-                    ("ID Evento", str(event.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(event.guild, "scheduled_events", embed)
-
-        @bot.event
-        async def on_scheduled_event_delete(event):
-            embed = log_embed(
-                title="📅 Evento programmato eliminato",
-                description=f"Evento `{event.name}` eliminato.",
-                color=Color.red(),
-                fields=[
-                    ("ID Evento", str(event.id), True)
-                ],
-                timestamp=True
-            )
-            await send_log(event.guild, "scheduled_events", embed)
-
-        # Sicurezza: catch errori globali
-        @bot.event
-        async def on_error(event, *args, **kwargs):
-            logging.exception(f"Errore nell'evento {event}")
-
-        bot.run(TOKEN)
+import asyncio
+import atexit
+import contextvars
+import enum
+import gzip
+import hashlib
+import io
+import logging
+import os
+import json
+import queue
+import re
+import shutil
+import signal
+import sqlite3
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque, namedtuple
+from operator import attrgetter
+import aiohttp
+from aiohttp import web
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import zstandard
+except ImportError:  # facoltativo: senza, i segmenti del file sink usano gzip
+    zstandard = None
+import discord
+from discord.ext import commands
+from discord import app_commands, Embed, Color, Interaction
+
+# Riferimento per i tempi delle fasi di avvio (vedi report_startup)
+STARTUP_STARTED = time.perf_counter()
+
+LOGS_CONFIG_FILE = "logs_channels.json"
+LOGS_WEBHOOKS_FILE = "logs_webhooks.json"
+LOGS_DB_FILE = "logs.db"
+LOGS_DB_SAVE_DELAY = 2.0  # secondi di attesa per accorpare le scritture della configurazione
+LOGS_CATEGORY_NAME = "📑・LOGS SERVER"
+DEFAULT_LOG_CHANNELS = {
+    "messaggi": "💬・messaggi",
+    "messaggi_modificati": "✏️・messaggi-modificati",
+    "messaggi_cancellati": "🗑️・messaggi-cancellati",
+    "join_leave": "👋・join-leave",
+    "ban_unban": "🔨・ban-unban",
+    "ruoli": "🎭・ruoli",
+    "canali": "📁・canali",
+    "nickname": "📝・nickname",
+    "avatar": "🖼️・avatar",
+    "voice": "🔊・voice",
+    "inviti": "🔗・inviti",
+    "emoji": "😃・emoji",
+    "webhook": "🌐・webhook",
+    "integrazioni": "🔌・integrazioni",
+    "audit": "🕵️・audit-log",
+    "moderazione": "🛡️・moderazione",
+    "boost": "🚀・boost",
+    "permessi": "🔑・permessi",
+    "thread": "🧵・thread",
+    "stage": "🎤・stage",
+    "stickers": "🏷️・stickers",
+    "scheduled_events": "📅・eventi-programmati",
+    "guild_update": "🏛️・server-update",
+    "member_update": "👤・member-update",
+    "role_update": "🛠️・ruoli-update",
+    "channel_update": "🔄・canali-update"
+}
+
+# Invio raggruppato: fino a 10 embed per messaggio (limite Discord) e max 6000 caratteri totali
+LOG_BATCH_MAX_EMBEDS = 10
+LOG_BATCH_MAX_CHARS = 6000
+LOG_BATCH_DELAY = 1.5  # secondi di attesa prima di inviare un batch non pieno
+
+# Backpressure: code limitate per server, con priorità per tipo di log e invii equi tra i server
+LOG_PRIORITY_HIGH, LOG_PRIORITY_NORMAL, LOG_PRIORITY_LOW = 0, 1, 2
+LOG_PRIORITIES = {
+    "ban_unban": LOG_PRIORITY_HIGH,
+    "moderazione": LOG_PRIORITY_HIGH,
+    "audit": LOG_PRIORITY_HIGH,
+    "ruoli": LOG_PRIORITY_HIGH,
+    "role_update": LOG_PRIORITY_HIGH,
+    "permessi": LOG_PRIORITY_HIGH,
+    "canali": LOG_PRIORITY_HIGH,
+    "channel_update": LOG_PRIORITY_HIGH,
+    "webhook": LOG_PRIORITY_HIGH,
+    "integrazioni": LOG_PRIORITY_HIGH,
+    "guild_update": LOG_PRIORITY_HIGH,
+    "messaggi": LOG_PRIORITY_LOW
+}
+LOG_QUEUE_MAX_PER_GUILD = 1000
+LOG_OVERFLOW_POLICY = os.getenv("LOG_OVERFLOW_POLICY", "summarize")  # "drop", "sample" o "summarize"
+LOG_SAMPLE_THRESHOLD = 0.5  # con "sample", frazione della coda oltre cui si inizia a campionare
+LOG_SAMPLE_RATE = 10        # con "sample", passa un evento ogni 10
+LOG_DELIVERY_CONCURRENCY = 8
+
+# Digest dei picchi: oltre la soglia (eventi, secondi) i log singoli diventano riepiloghi periodici
+BURST_DEFAULTS = {"messaggi": (200, 30), "join_leave": (500, 60)}
+BURST_EXIT_RATIO = 0.5           # si torna ai log singoli sotto metà soglia
+BURST_DIGEST_INTERVAL = 30       # secondi tra due digest
+BURST_DIGEST_MAX_RECORDS = 20000 # righe massime nel file di dettaglio di un digest
+
+# Sessioni vocali: un record per sessione (ingresso, spostamenti, uscita) inviato a blocchi,
+# più un riepilogo periodico per canale vocale
+VOICE_FLUSH_INTERVAL = 60        # secondi tra due invii delle sessioni concluse
+VOICE_SUMMARY_INTERVAL = 3600    # secondi tra due riepiloghi per canale
+VOICE_RECORDS_PER_EMBED = 30     # sessioni elencate nell'embed, le altre solo nel file allegato
+
+# Statistiche di attività per server (ultima ora, giorno, 30 giorni) mostrate da /log_stats
+STATS_ENABLED = os.getenv("ACTIVITY_STATS", "1") == "1"
+STATS_FILE = "activity_stats.db"
+STATS_SAMPLE_INTERVAL = 60   # secondi tra due campionamenti dei membri in voce
+STATS_SAVE_INTERVAL = 300    # secondi tra due salvataggi su disco
+
+# Modalità webhook: i log passano da un webhook per canale, con una sessione HTTP separata dal bot
+LOG_WEBHOOK_MODE = os.getenv("LOG_WEBHOOK_MODE", "0") == "1"
+LOG_WEBHOOK_NAME = "Log System"
+LOG_WEBHOOK_MAX_RETRIES = 5
+
+# Outbox su disco: ogni log viene scritto in un registro a segmenti prima dell'invio e confermato
+# dopo; al riavvio i log non confermati vengono reinviati in ordine
+LOG_OUTBOX_ENABLED = os.getenv("LOG_OUTBOX", "1") == "1"
+LOG_OUTBOX_DIR = "log_outbox"
+LOG_OUTBOX_FSYNC_INTERVAL = 0.2         # secondi tra due fsync: le scritture vengono accorpate
+LOG_OUTBOX_SEGMENT_BYTES = 4 * 1024 * 1024
+LOG_OUTBOX_COMPACT_AGE = 30             # secondi prima di compattare un segmento chiuso
+LOG_OUTBOX_MAX_AGE = 7 * 86400          # log non confermati più vecchi di così vengono scartati all'avvio
+LOG_RETRY_BASE_DELAY = 1.0              # backoff esponenziale per gli invii falliti
+LOG_RETRY_MAX_DELAY = 300.0
+
+# Indice di ricerca locale (SQLite FTS5) di tutti i log inviati, interrogabile con /search_logs
+LOG_INDEX_ENABLED = os.getenv("LOG_SEARCH_INDEX", "1") == "1"
+LOG_INDEX_FILE = "logs_index.db"
+LOG_INDEX_FLUSH_DELAY = 2.0
+LOG_INDEX_FLUSH_SIZE = 500
+LOG_INDEX_RETENTION_DAYS = 90
+SEARCH_PAGE_SIZE = 10
+
+# Log su file: un record JSON per evento in segmenti ruotati e compressi (LOG_FILE_SINK=1).
+# I tipi in LOG_FILE_ONLY_TYPES (separati da virgola) vengono scritti solo su file e non inviati su Discord:
+# sono attivi in tutti i server anche senza un canale configurato
+LOG_FILE_SINK_ENABLED = os.getenv("LOG_FILE_SINK", "0") == "1"
+LOG_FILE_SINK_DIR = "log_files"
+LOG_FILE_SEGMENT_BYTES = int(os.getenv("LOG_FILE_SEGMENT_MB", "64")) * 1024 * 1024
+LOG_FILE_ROTATE_SECONDS = int(os.getenv("LOG_FILE_ROTATE_HOURS", "24")) * 3600
+LOG_FILE_COMPRESSION = os.getenv("LOG_FILE_COMPRESSION", "gzip")  # gzip o zstd
+LOG_FILE_FLUSH_INTERVAL = 1.0
+LOG_FILE_ONLY_TYPES = {
+    log_type.strip() for log_type in os.getenv("LOG_FILE_ONLY_TYPES", "").split(",")
+    if log_type.strip() in DEFAULT_LOG_CHANNELS
+} if LOG_FILE_SINK_ENABLED else set()
+
+# Archivio locale dei messaggi: permette di loggare modifiche/eliminazioni senza la cache in memoria
+MESSAGE_ARCHIVE_ENABLED = os.getenv("MESSAGE_ARCHIVE", "1") == "1"
+ARCHIVE_DIR = "message_archive"
+ARCHIVE_SEGMENT_SECONDS = 3600         # un segmento per ora
+ARCHIVE_RETENTION_DAYS = 7
+ARCHIVE_FLUSH_DELAY = 2.0              # secondi di attesa per accorpare le scritture
+ARCHIVE_FLUSH_SIZE = 500               # oppure scrivi subito quando il buffer è pieno
+ARCHIVE_MAX_MESSAGES = 100             # cache dei messaggi di discord.py quando l'archivio è attivo
+
+# Copia locale degli allegati (per hash del contenuto): reinviati insieme al log del messaggio eliminato
+ATTACHMENT_CACHE_ENABLED = os.getenv("ATTACHMENT_CACHE", "1") == "1"
+ATTACHMENT_CACHE_DIR = "attachment_cache"
+ATTACHMENT_CACHE_MAX_BYTES = int(os.getenv("ATTACHMENT_CACHE_MB", "1024")) * 1024 * 1024
+ATTACHMENT_MAX_FILE_BYTES = 10 * 1024 * 1024   # limite di upload di Discord: file più grandi non servono
+ATTACHMENT_DOWNLOAD_CONCURRENCY = 4
+ATTACHMENT_MAX_PENDING = 200                   # download in attesa oltre cui i nuovi allegati vengono saltati
+ATTACHMENT_CHUNK_BYTES = 64 * 1024
+ATTACHMENT_WAIT_SECONDS = 10                   # attesa massima di un download in corso quando il messaggio viene eliminato
+
+# Sharding: LOG_SHARDED=1 usa AutoShardedBot in un solo processo.
+# LOG_CLUSTERS=N (N>1) avvia un supervisore che divide gli shard tra N processi figli
+LOG_CLUSTERS = int(os.getenv("LOG_CLUSTERS", "1"))
+LOG_CLUSTER_ID = int(os.getenv("LOG_CLUSTER_ID")) if os.getenv("LOG_CLUSTER_ID") else None
+LOG_SHARD_COUNT = int(os.getenv("LOG_SHARD_COUNT", "0")) or None
+LOG_SHARD_IDS = [int(shard_id) for shard_id in os.getenv("LOG_SHARD_IDS", "").split(",") if shard_id] or None
+LOG_SHARDED = os.getenv("LOG_SHARDED", "0") == "1" or LOG_CLUSTER_ID is not None
+IS_CLUSTER_SUPERVISOR = LOG_CLUSTERS > 1 and LOG_CLUSTER_ID is None
+CLUSTER_RESTART_MAX_DELAY = 60
+CLUSTER_IDENTIFY_DELAY = 5  # secondi tra un identify e l'altro (max_concurrency = 1)
+
+if LOG_CLUSTER_ID is not None:
+    # Ogni cluster ha il proprio archivio: i segmenti sono scritti da un solo processo
+    ARCHIVE_DIR = os.path.join(ARCHIVE_DIR, f"cluster-{LOG_CLUSTER_ID}")
+
+# Profilo di avvio: "full" tiene tutti gli intent e le cache, "lean" abilita solo ciò che serve
+# ai tipi di log attivi (LOG_ENABLED_TYPES, separati da virgola; vuoto = tutti)
+LOG_PROFILE = os.getenv("LOG_PROFILE", "full")
+ENABLED_LOG_TYPES = {
+    log_type.strip() for log_type in os.getenv("LOG_ENABLED_TYPES", "").split(",")
+    if log_type.strip() in DEFAULT_LOG_CHANNELS
+} or set(DEFAULT_LOG_CHANNELS)
+LOG_TYPE_INTENTS = {
+    "messaggi": ("guild_messages", "message_content"),
+    "messaggi_modificati": ("guild_messages", "message_content"),
+    "messaggi_cancellati": ("guild_messages", "message_content"),
+    "join_leave": ("members",),
+    "ban_unban": ("moderation",),
+    "nickname": ("members",),
+    "avatar": ("members",),
+    "voice": ("voice_states",),
+    "inviti": ("invites",),
+    "emoji": ("emojis_and_stickers",),
+    "webhook": ("webhooks",),
+    "integrazioni": ("integrations",),
+    "audit": ("moderation",),
+    "moderazione": ("members", "moderation"),
+    "boost": ("members",),
+    "stickers": ("emojis_and_stickers",),
+    "scheduled_events": ("guild_scheduled_events",),
+    "member_update": ("members",)
+}
+MESSAGE_LOG_TYPES = {"messaggi", "messaggi_modificati", "messaggi_cancellati"}
+# Stime indicative per il report di memoria (byte per oggetto in cache)
+MEMORY_BYTES_PER_MEMBER = 1500
+MEMORY_BYTES_PER_MESSAGE = 3000
+
+def build_client_options():
+    if LOG_PROFILE != "lean":
+        return discord.Intents.all(), {
+            "max_messages": ARCHIVE_MAX_MESSAGES if MESSAGE_ARCHIVE_ENABLED else 1000
+        }
+    intents = discord.Intents.none()
+    intents.guilds = True
+    for log_type in ENABLED_LOG_TYPES:
+        for flag in LOG_TYPE_INTENTS.get(log_type, ()):
+            setattr(intents, flag, True)
+    if ENABLED_LOG_TYPES & MESSAGE_LOG_TYPES:
+        max_messages = ARCHIVE_MAX_MESSAGES if MESSAGE_ARCHIVE_ENABLED else 1000
+    else:
+        max_messages = None
+    # Niente presenze e niente chunking: i membri entrano in cache solo quando compaiono negli eventi
+    return intents, {
+        "max_messages": max_messages,
+        "chunk_guilds_at_startup": False,
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents)
+    }
+
+def report_memory_profile():
+    # Confronta la stima della cache con la memoria effettivamente usata dal processo
+    total_members = sum(guild.member_count or 0 for guild in bot.guilds)
+    cached_members = sum(len(guild.members) for guild in bot.guilds)
+    max_messages = bot._connection.max_messages or 0
+    chunking = bot._connection._chunk_guilds
+    expected_members = total_members if chunking and bot.intents.members else cached_members
+    estimate = expected_members * MEMORY_BYTES_PER_MEMBER + max_messages * MEMORY_BYTES_PER_MESSAGE
+    enabled_intents = ", ".join(name for name, value in bot.intents if value)
+    ops_log(f"📊 Profilo {LOG_PROFILE}: intent [{enabled_intents}]")
+    ops_log(f"📊 Cache: {cached_members}/{total_members} membri, max {max_messages} messaggi, chunking {'attivo' if chunking else 'disattivo'}")
+    ops_log(f"📊 Memoria stimata per la cache: {estimate / 1024 / 1024:.1f} MB")
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        ops_log(f"📊 Memoria massima del processo: {peak:.1f} MB")
+
+def owns_guild(guild_id):
+    # Un server appartiene allo shard (guild_id >> 22) % shard_count
+    if LOG_SHARD_IDS is None or LOG_SHARD_COUNT is None:
+        return True
+    return (int(guild_id) >> 22) % LOG_SHARD_COUNT in LOG_SHARD_IDS
+
+# Avvio: hash dei comandi slash dell'ultima sincronizzazione (cancellando il file si forza la sincronizzazione)
+COMMAND_HASH_FILE = "command_tree.sha256"
+
+startup_phases = []  # (fase, secondi da STARTUP_STARTED)
+
+def mark_startup(phase):
+    startup_phases.append((phase, time.perf_counter() - STARTUP_STARTED))
+
+# Correlazione audit log: per quanti secondi un evento attende la sua voce di audit (e viceversa)
+AUDIT_CORRELATION_WINDOW = float(os.getenv("AUDIT_CORRELATION_WINDOW", "2.0"))
+
+# Metriche: endpoint HTTP locale in formato Prometheus (LOG_METRICS_PORT, 0 = disattivato).
+# In modalità cluster ogni processo usa la porta base + id del cluster
+LOG_METRICS_HOST = os.getenv("LOG_METRICS_HOST", "127.0.0.1")
+LOG_METRICS_PORT = int(os.getenv("LOG_METRICS_PORT", "0"))
+METRICS_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class LogBot(commands.AutoShardedBot if LOG_SHARDED else commands.Bot):
+    async def setup_hook(self):
+        mark_startup("login")
+        instrument_http(self.http)
+        # Rotte provvisorie dai canali salvati: si logga prima che Discord dichiari i server disponibili
+        warm_guild_routes()
+        mark_startup("warm_routes")
+        self.command_sync_task = asyncio.create_task(sync_command_tree())
+        activity_stats.start()
+        if LOG_METRICS_PORT:
+            await metrics_server.start(LOG_METRICS_HOST, LOG_METRICS_PORT + (LOG_CLUSTER_ID or 0))
+        if hasattr(signal, "SIGHUP"):
+            # kill -HUP ricarica i filtri dei log dal database senza riavviare il bot
+            asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(reload_guild_filters()))
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        # Ogni handler (eventi e listener) viene cronometrato per tipo di evento
+        start = time.perf_counter()
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            metrics.observe("logbot_event_handler_seconds", (("event", event_name),), time.perf_counter() - start)
+
+    async def close(self):
+        # Svuota le code dei log prima di chiudere la connessione
+        await metrics_server.stop()
+        await message_archive.close()
+        await attachment_cache.close()
+        await voice_tracker.close()
+        await activity_stats.close()
+        audit_correlator.flush()
+        await log_batcher.close()
+        await log_outbox.close()
+        await log_index.close()
+        await log_file_sink.close()
+        await webhook_sender.close()
+        await config_store.close()
+        await super().close()
+
+intents, client_options = build_client_options()
+shard_options = {}
+if LOG_SHARDED and LOG_SHARD_COUNT:
+    shard_options = {"shard_count": LOG_SHARD_COUNT, "shard_ids": LOG_SHARD_IDS}
+bot = LogBot(
+    command_prefix="!",
+    intents=intents,
+    **client_options,
+    **shard_options
+)
+
+# ========== MESSAGGI OPERATIVI ==========
+
+class OpsLogger:
+    # I messaggi operativi passano da una coda: un thread li scrive su stdout e, se attivo, nel file sink
+    # come record "sistema". Chi scrive non resta mai bloccato sulla console
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.sink = None  # LogFileSink aperto, se attivo
+
+    def write(self, message):
+        self.queue.put((time.time(), message))
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="ops-log", daemon=True)
+                    self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            created_at, message = item
+            try:
+                sys.stdout.write(message + "\n")
+                if self.queue.empty():
+                    sys.stdout.flush()
+            except (OSError, ValueError):
+                pass
+            sink = self.sink
+            if sink is not None:
+                sink.add_record({
+                    "ts": created_at,
+                    "log_type": "sistema",
+                    "level": "error" if message.startswith("❌") else "info",
+                    "message": message
+                })
+
+    def close(self):
+        # Svuota la coda prima dell'uscita del processo
+        thread = self.thread
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join(timeout=5)
+
+ops_logger = OpsLogger()
+atexit.register(ops_logger.close)
+
+def ops_log(message):
+    ops_logger.write(str(message))
+
+# ========== GESTIONE FILE LOGS ==========
+
+def read_logs_channels_json():
+    # Usato solo per la migrazione una tantum da logs_channels.json
+    if not os.path.exists(LOGS_CONFIG_FILE):
+        return {}
+    try:
+        with open(LOGS_CONFIG_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            # Controllo integrità dati
+            if not isinstance(data, dict):
+                ops_log("❌ logs_channels.json corrotto: non è un dizionario.")
+                return {}
+            # Rimuovi guild_id non validi
+            valid_data = {}
+            for gid, channels in data.items():
+                if not gid.isdigit() or not isinstance(channels, dict):
+                    continue
+                valid_channels = {}
+                for log_type, channel_id in channels.items():
+                    if log_type in DEFAULT_LOG_CHANNELS and isinstance(channel_id, int):
+                        valid_channels[log_type] = channel_id
+                if valid_channels:
+                    valid_data[gid] = valid_channels
+            return valid_data
+    except Exception as e:
+        ops_log(f"❌ Errore caricamento logs_channels.json: {e}")
+        return {}
+
+def read_logs_webhooks_json():
+    # Usato solo per la migrazione una tantum da logs_webhooks.json
+    if not os.path.exists(LOGS_WEBHOOKS_FILE):
+        return {}
+    try:
+        with open(LOGS_WEBHOOKS_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            if not isinstance(data, dict):
+                ops_log("❌ logs_webhooks.json corrotto: non è un dizionario.")
+                return {}
+            valid_data = {}
+            for gid, hooks in data.items():
+                if not gid.isdigit() or not isinstance(hooks, dict):
+                    continue
+                valid_hooks = {}
+                for log_type, hook in hooks.items():
+                    if (log_type in DEFAULT_LOG_CHANNELS and isinstance(hook, dict)
+                            and isinstance(hook.get("id"), int) and isinstance(hook.get("token"), str)):
+                        valid_hooks[log_type] = {"id": hook["id"], "token": hook["token"]}
+                if valid_hooks:
+                    valid_data[gid] = valid_hooks
+            return valid_data
+    except Exception as e:
+        ops_log(f"❌ Errore caricamento logs_webhooks.json: {e}")
+        return {}
+
+class LogsConfigStore:
+    def __init__(self, path=LOGS_DB_FILE, delay=LOGS_DB_SAVE_DELAY):
+        self.path = path
+        self.delay = delay
+        self.conn = None
+        self.dirty = set()       # guild_id (str) con modifiche non ancora salvate
+        self.flush_task = None
+        self.write_lock = asyncio.Lock()
+
+    def open(self):
+        # Connessione unica: le scritture avvengono un batch alla volta in un thread separato
+        # Il timeout serve in modalità cluster, quando più processi scrivono sullo stesso file
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS log_channels ("
+            "guild_id INTEGER NOT NULL, log_type TEXT NOT NULL, channel_id INTEGER NOT NULL, "
+            "PRIMARY KEY (guild_id, log_type)) WITHOUT ROWID"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS log_webhooks ("
+            "guild_id INTEGER NOT NULL, log_type TEXT NOT NULL, webhook_id INTEGER NOT NULL, token TEXT NOT NULL, "
+            "PRIMARY KEY (guild_id, log_type)) WITHOUT ROWID"
+        )
+        # Impostazioni varie per server (es. soglie del digest), valori in json
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS guild_settings ("
+            "guild_id INTEGER NOT NULL, name TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (guild_id, name)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def load(self):
+        # In modalità cluster ogni processo carica solo i server dei propri shard
+        channels = {}
+        for gid, log_type, channel_id in self.conn.execute("SELECT guild_id, log_type, channel_id FROM log_channels"):
+            if log_type in DEFAULT_LOG_CHANNELS and owns_guild(gid):
+                channels.setdefault(str(gid), {})[log_type] = channel_id
+        webhooks = {}
+        for gid, log_type, webhook_id, token in self.conn.execute("SELECT guild_id, log_type, webhook_id, token FROM log_webhooks"):
+            if log_type in DEFAULT_LOG_CHANNELS and owns_guild(gid):
+                webhooks.setdefault(str(gid), {})[log_type] = {"id": webhook_id, "token": token}
+        settings = {}
+        for gid, name, value in self.conn.execute("SELECT guild_id, name, value FROM guild_settings"):
+            if owns_guild(gid):
+                settings.setdefault(str(gid), {})[name] = json.loads(value)
+        return channels, webhooks, settings
+
+    def migrate_json(self):
+        # Importa i vecchi file json una sola volta, poi li rinomina
+        for path, reader, table in (
+            (LOGS_CONFIG_FILE, read_logs_channels_json, "log_channels"),
+            (LOGS_WEBHOOKS_FILE, read_logs_webhooks_json, "log_webhooks"),
+        ):
+            if not os.path.exists(path):
+                continue
+            if self.conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                continue
+            data = reader()
+            if table == "log_channels":
+                self._write({gid: (channels, {}, {}) for gid, channels in data.items()}, tables=("log_channels",))
+            else:
+                self._write({gid: ({}, hooks, {}) for gid, hooks in data.items()}, tables=("log_webhooks",))
+            os.replace(path, path + ".migrated")
+            ops_log(f"🔄 {path} migrato in {self.path} ({len(data)} server)")
+
+    def _write(self, snapshot, tables=("log_channels", "log_webhooks", "guild_settings")):
+        # snapshot: guild_id -> (canali, webhook, impostazioni). Riscrive solo le righe dei server modificati
+        with self.conn:
+            for gid, (channels, hooks, settings) in snapshot.items():
+                guild_id = int(gid)
+                if "log_channels" in tables:
+                    self.conn.execute("DELETE FROM log_channels WHERE guild_id = ?", (guild_id,))
+                    self.conn.executemany(
+                        "INSERT INTO log_channels (guild_id, log_type, channel_id) VALUES (?, ?, ?)",
+                        [(guild_id, log_type, channel_id) for log_type, channel_id in channels.items()
+                         if log_type in DEFAULT_LOG_CHANNELS and isinstance(channel_id, int)]
+                    )
+                if "log_webhooks" in tables:
+                    self.conn.execute("DELETE FROM log_webhooks WHERE guild_id = ?", (guild_id,))
+                    self.conn.executemany(
+                        "INSERT INTO log_webhooks (guild_id, log_type, webhook_id, token) VALUES (?, ?, ?, ?)",
+                        [(guild_id, log_type, hook["id"], hook["token"]) for log_type, hook in hooks.items()
+                         if log_type in DEFAULT_LOG_CHANNELS]
+                    )
+                if "guild_settings" in tables:
+                    self.conn.execute("DELETE FROM guild_settings WHERE guild_id = ?", (guild_id,))
+                    self.conn.executemany(
+                        "INSERT INTO guild_settings (guild_id, name, value) VALUES (?, ?, ?)",
+                        [(guild_id, name, json.dumps(value)) for name, value in settings.items()]
+                    )
+
+    def schedule_save(self, guild_id):
+        # Le modifiche ravvicinate dello stesso server vengono accorpate in un'unica scrittura
+        self.dirty.add(str(guild_id))
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            while self.dirty:
+                await asyncio.sleep(self.delay)
+                await self.flush()
+        finally:
+            self.flush_task = None
+
+    async def flush(self):
+        async with self.write_lock:
+            if not self.dirty:
+                return
+            snapshot = {
+                gid: (
+                    dict(logs_channels.get(gid, {})),
+                    dict(logs_webhooks.get(gid, {})),
+                    json.loads(json.dumps(logs_settings.get(gid, {})))
+                )
+                for gid in self.dirty
+            }
+            self.dirty.clear()
+            try:
+                await asyncio.to_thread(self._write, snapshot)
+            except Exception as e:
+                self.dirty.update(snapshot)
+                ops_log(f"❌ Errore salvataggio {self.path}: {e}")
+
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.flush()
+        self.conn.close()
+
+config_store = LogsConfigStore()
+
+def load_logs_channels():
+    try:
+        config_store.open()
+        config_store.migrate_json()
+        return config_store.load()
+    except Exception as e:
+        ops_log(f"❌ Errore caricamento {LOGS_DB_FILE}: {e}")
+        return {}, {}, {}
+
+logs_channels, logs_webhooks, logs_settings = load_logs_channels()
+mark_startup("config")
+
+# ========== TABELLA DI ROUTING ==========
+
+# Ogni tipo di log ha un indice fisso: le rotte di un server sono una lista di canali risolti
+LogType = enum.IntEnum("LogType", [(log_type.upper(), i) for i, log_type in enumerate(DEFAULT_LOG_CHANNELS)])
+LOG_TYPE_INDEX = {log_type: LogType[log_type.upper()] for log_type in DEFAULT_LOG_CHANNELS}
+
+log_routes = {}  # guild_id (int) -> [canale o None] * len(LogType)
+
+# Rotta dei tipi scritti solo su file: non corrisponde a nessun canale (id 0) e non passa dalla coda di invio
+FILE_ONLY_ROUTE = discord.Object(id=0)
+
+def log_type_disabled(guild_id, log_type):
+    rules = guild_filters.get(guild_id)
+    return log_type not in ENABLED_LOG_TYPES or (
+        rules is not None and rules.disabled >> LOG_TYPE_INDEX[log_type] & 1
+    )
+
+def routed_log_types(guild_id):
+    # I tipi disattivati dai filtri del server restano senza rotta: gli handler li scartano al primo controllo
+    for log_type, channel_id in list(logs_channels.get(str(guild_id), {}).items()):
+        if log_type not in LOG_FILE_ONLY_TYPES and not log_type_disabled(guild_id, log_type):
+            yield log_type, channel_id
+
+def add_file_only_routes(guild_id, routes):
+    for log_type in LOG_FILE_ONLY_TYPES:
+        if not log_type_disabled(guild_id, log_type):
+            routes[LOG_TYPE_INDEX[log_type]] = FILE_ONLY_ROUTE
+
+def build_guild_routes(guild, resolved=None):
+    # Risolve i canali configurati una sola volta, invece che a ogni invio.
+    # resolved (log_type -> canale) serve a /setup_logs: i canali appena creati possono non essere ancora in cache
+    routes = [None] * len(LogType)
+    guild_id = str(guild.id)
+    stale = False
+    for log_type, channel_id in routed_log_types(guild.id):
+        channel = resolved.get(log_type) if resolved else None
+        if channel is None:
+            channel = guild.get_channel(channel_id)
+        if channel and isinstance(channel, discord.TextChannel):
+            routes[LOG_TYPE_INDEX[log_type]] = channel
+        else:
+            # Se il canale non esiste più, rimuovilo dalla configurazione
+            logs_channels[guild_id].pop(log_type, None)
+            stale = True
+    if stale:
+        config_store.schedule_save(guild_id)
+    add_file_only_routes(guild.id, routes)
+    set_guild_routes(guild.id, routes)
+    refresh_user_index(guild)
+
+def warm_guild_routes():
+    # Avvio a caldo: durante il READY Discord dichiara i server disponibili solo alla fine, ma gli eventi
+    # arrivano già prima. Le rotte provvisorie usano canali parziali (bastano id e send) e vengono
+    # sostituite da quelle verificate in build_guild_routes appena il server è disponibile
+    for gid in logs_channels:
+        guild_id = int(gid)
+        if guild_id in log_routes:
+            continue
+        routes = [None] * len(LogType)
+        for log_type, channel_id in routed_log_types(guild_id):
+            routes[LOG_TYPE_INDEX[log_type]] = bot.get_partial_messageable(
+                channel_id, guild_id=guild_id, type=discord.ChannelType.text
+            )
+        add_file_only_routes(guild_id, routes)
+        set_guild_routes(guild_id, routes)
+
+def set_guild_routes(guild_id, routes):
+    if any(routes):
+        log_routes[guild_id] = routes
+    else:
+        log_routes.pop(guild_id, None)
+
+def has_log(guild, log_type):
+    # Controllo rapido da fare prima di costruire l'embed
+    if guild is None:
+        return False
+    routes = log_routes.get(guild.id)
+    return routes is not None and routes[LOG_TYPE_INDEX[log_type]] is not None
+
+def get_log_channel(guild, log_type):
+    routes = log_routes.get(guild.id)
+    if routes is None:
+        return None
+    return routes[LOG_TYPE_INDEX[log_type]]
+
+async def routes_on_guild_available(guild):
+    build_guild_routes(guild)
+
+async def routes_on_guild_remove(guild):
+    log_routes.pop(guild.id, None)
+
+async def routes_on_channel_delete(channel):
+    routes = log_routes.get(channel.guild.id)
+    if routes is None:
+        return
+    guild_id = str(channel.guild.id)
+    for index, routed in enumerate(routes):
+        if routed is not None and routed.id == channel.id:
+            routes[index] = None
+            logs_channels.get(guild_id, {}).pop(LogType(index).name.lower(), None)
+            config_store.schedule_save(guild_id)
+    set_guild_routes(channel.guild.id, routes)
+
+async def routes_on_channel_update(before, after):
+    routes = log_routes.get(after.guild.id)
+    if routes is None:
+        return
+    for index, routed in enumerate(routes):
+        if routed is not None and routed.id == after.id:
+            routes[index] = after
+    if not isinstance(after, discord.TextChannel):
+        await routes_on_channel_delete(after)
+
+bot.add_listener(routes_on_guild_available, "on_guild_available")
+bot.add_listener(routes_on_guild_available, "on_guild_join")
+bot.add_listener(routes_on_guild_remove, "on_guild_remove")
+bot.add_listener(routes_on_guild_remove, "on_guild_unavailable")
+bot.add_listener(routes_on_channel_delete, "on_guild_channel_delete")
+bot.add_listener(routes_on_channel_update, "on_guild_channel_update")
+
+# ========== INDICE UTENTI → SERVER ==========
+
+# Solo i server con log avatar/nickname vengono indicizzati: sono gli unici che servono a on_user_update
+USER_LOG_TYPES = ("avatar", "nickname")
+
+user_guilds = {}        # user_id -> set di guild_id
+indexed_guilds = set()
+
+def refresh_user_index(guild):
+    if any(has_log(guild, log_type) for log_type in USER_LOG_TYPES):
+        indexed_guilds.add(guild.id)
+        for member in guild.members:
+            user_guilds.setdefault(member.id, set()).add(guild.id)
+    elif guild.id in indexed_guilds:
+        drop_guild_from_user_index(guild.id)
+
+def drop_guild_from_user_index(guild_id):
+    indexed_guilds.discard(guild_id)
+    for user_id, guild_ids in list(user_guilds.items()):
+        guild_ids.discard(guild_id)
+        if not guild_ids:
+            del user_guilds[user_id]
+
+def index_user(guild_id, user_id):
+    if guild_id in indexed_guilds:
+        user_guilds.setdefault(user_id, set()).add(guild_id)
+
+def unindex_user(guild_id, user_id):
+    guild_ids = user_guilds.get(user_id)
+    if guild_ids is not None:
+        guild_ids.discard(guild_id)
+        if not guild_ids:
+            del user_guilds[user_id]
+
+def user_log_targets(user_id, log_type):
+    # Server in comune con l'utente che hanno quel tipo di log configurato
+    targets = []
+    for guild_id in user_guilds.get(user_id, ()):
+        guild = bot.get_guild(guild_id)
+        if has_log(guild, log_type):
+            rules = guild_filters.get(guild_id)
+            if rules is not None and rules.rejects(guild.get_member(user_id) or discord.Object(user_id), None, None):
+                continue
+            targets.append(guild)
+    return targets
+
+def fan_out_log(guilds, log_type, embed):
+    # enqueue_log non attende la rete: l'invio e il rate limit sono gestiti dalla coda per canale
+    for guild in guilds:
+        enqueue_log(guild, log_type, embed)
+
+async def user_index_on_member_join(member):
+    index_user(member.guild.id, member.id)
+
+async def user_index_on_member_remove(payload):
+    unindex_user(payload.guild_id, payload.user.id)
+
+async def user_index_on_message(message):
+    # Con il profilo lean i membri non sono tutti in cache: gli autori dei messaggi completano l'indice
+    if message.guild is not None and not message.author.bot:
+        index_user(message.guild.id, message.author.id)
+
+async def user_index_on_guild_remove(guild):
+    if guild.id in indexed_guilds:
+        drop_guild_from_user_index(guild.id)
+
+bot.add_listener(user_index_on_member_join, "on_member_join")
+bot.add_listener(user_index_on_member_remove, "on_raw_member_remove")
+bot.add_listener(user_index_on_message, "on_message")
+bot.add_listener(user_index_on_guild_remove, "on_guild_remove")
+
+# ========== METRICHE ==========
+
+class Metrics:
+    # Contatori e istogrammi in memoria: una lookup nel dizionario e un bisect per osservazione
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}    # (nome, etichette) -> valore
+        self.histograms = {}  # (nome, etichette) -> [conteggi per bucket..., +Inf, somma]
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+        histogram[bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+
+    def render(self):
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            cumulative += histogram[len(self.buckets)]
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram[-1]:.6f}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        for name, labels, value in collect_gauges():
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+def collect_gauges():
+    # Valori letti al momento della richiesta: nessun costo sul percorso degli eventi
+    gauges = []
+    for priority, name in enumerate(("high", "normal", "low")):
+        depth = sum(len(queues[priority]) for queues in log_batcher.queues.values())
+        gauges.append(("logbot_queue_depth", (("priority", name),), depth))
+    for log_type, count in sorted(log_batcher.shed.items()):
+        gauges.append(("logbot_logs_shed_total", (("log_type", log_type),), count))
+    if LOG_SHARDED:
+        for shard_id, latency in bot.latencies:
+            gauges.append(("logbot_gateway_latency_seconds", (("shard", shard_id),), f"{latency:.6f}"))
+    elif bot.latency == bot.latency:  # NaN prima della connessione
+        gauges.append(("logbot_gateway_latency_seconds", (("shard", 0),), f"{bot.latency:.6f}"))
+    gauges.extend([
+        ("logbot_cache_size", (("cache", "guilds"),), len(bot.guilds)),
+        ("logbot_cache_size", (("cache", "users"),), len(bot.users)),
+        ("logbot_cache_size", (("cache", "members"),), sum(len(guild.members) for guild in bot.guilds)),
+        ("logbot_cache_size", (("cache", "messages"),), len(bot.cached_messages)),
+        ("logbot_cache_size", (("cache", "routed_guilds"),), len(log_routes)),
+        ("logbot_cache_size", (("cache", "user_index"),), len(user_guilds)),
+        ("logbot_cache_size", (("cache", "archive_pending"),), len(message_archive.pending)),
+        ("logbot_cache_size", (("cache", "archive_segments"),), len(message_archive.segments)),
+        ("logbot_cache_size", (("cache", "file_sink_pending"),), log_file_sink.queue.qsize()),
+        ("logbot_file_sink_records_total", (), log_file_sink.written)
+    ])
+    for phase, seconds in startup_phases:
+        gauges.append(("logbot_startup_seconds", (("phase", phase),), f"{seconds:.6f}"))
+    return gauges
+
+# Rotta REST in corso nel task corrente: serve a contare i 429 registrati da discord.http
+current_route = contextvars.ContextVar("current_route", default="unknown")
+
+def instrument_http(http):
+    original_request = http.request
+
+    async def request(route, **kwargs):
+        key = f"{route.method} {route.path}"
+        token = current_route.set(key)
+        start = time.perf_counter()
+        try:
+            return await original_request(route, **kwargs)
+        except Exception:
+            metrics.inc("logbot_rest_errors_total", (("route", key),))
+            raise
+        finally:
+            metrics.observe("logbot_rest_request_seconds", (("route", key),), time.perf_counter() - start)
+            current_route.reset(token)
+
+    http.request = request
+
+class RateLimitLogHandler(logging.Handler):
+    # discord.py gestisce i 429 internamente e li segnala solo nei log: li contiamo da qui
+    def emit(self, record):
+        if not isinstance(record.msg, str):
+            return
+        if record.msg.startswith("We are being rate limited"):
+            metrics.inc("logbot_rest_ratelimited_total", (("route", current_route.get()),))
+        elif record.msg.startswith("Global rate limit"):
+            metrics.inc("logbot_rest_global_ratelimited_total")
+
+class MetricsServer:
+    def __init__(self):
+        self.runner = None
+
+    async def start(self, host, port):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        ops_log(f"📈 Metriche disponibili su http://{host}:{port}/metrics")
+
+    async def handle(self, request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+metrics = Metrics()
+metrics_server = MetricsServer()
+logging.getLogger("discord.http").addHandler(RateLimitLogHandler(logging.WARNING))
+
+# ========== OUTBOX SU DISCO ==========
+
+# Record: tipo, numero di sequenza, lunghezza del payload. Un log ha come payload il JSON
+# {g, c, t, e}; una conferma ha come payload l'elenco dei numeri di sequenza confermati
+OUTBOX_RECORD = struct.Struct("<BQI")
+OUTBOX_LOG, OUTBOX_ACK = 0, 1
+
+class LogOutbox:
+    def __init__(self, path=LOG_OUTBOX_DIR, interval=LOG_OUTBOX_FSYNC_INTERVAL,
+                 segment_bytes=LOG_OUTBOX_SEGMENT_BYTES, compact_age=LOG_OUTBOX_COMPACT_AGE):
+        self.path = path
+        self.interval = interval
+        self.segment_bytes = segment_bytes
+        self.compact_age = compact_age
+        self.enabled = False
+        self.next_seq = 1
+        self.buffer = []           # record non ancora scritti: bytes o log da serializzare
+        self.buffered = []         # sequenze dei log nel buffer
+        self.segment_of = {}       # sequenza non confermata -> segmento (None se ancora nel buffer)
+        self.live = {}             # segmento -> log non confermati
+        self.sealed_at = {}        # segmento chiuso -> istante di chiusura
+        self.current = 0
+        self.current_size = 0
+        self.file = None
+        self.replay = {}           # guild_id -> [(sequenza, record)] da reinviare
+        self.flush_task = None
+        self.write_lock = asyncio.Lock()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f"{segment:08d}.log")
+
+    def open(self):
+        # Rilegge tutti i segmenti: i log senza conferma vengono preparati per il reinvio
+        os.makedirs(self.path, exist_ok=True)
+        segments = sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith(".log"))
+        logs = {}
+        acked = set()
+        for segment in segments:
+            for kind, seq, payload in self._read_records(segment):
+                self.next_seq = max(self.next_seq, seq + 1)
+                if kind == OUTBOX_LOG:
+                    logs[seq] = (segment, payload)
+                else:
+                    acked.update(array("Q", payload))
+        for seq in sorted(logs):
+            if seq in acked:
+                continue
+            segment, payload = logs[seq]
+            try:
+                record = json.loads(payload)
+            except ValueError:
+                continue
+            self.segment_of[seq] = segment
+            self.live[segment] = self.live.get(segment, 0) + 1
+            self.replay.setdefault(record["g"], []).append((seq, record))
+        # I segmenti precedenti sono chiusi e compattabili subito
+        now = time.monotonic()
+        for segment in segments:
+            self.live.setdefault(segment, 0)
+            self.sealed_at[segment] = now - self.compact_age
+        self.current = segments[-1] + 1 if segments else 0
+        self.live[self.current] = 0
+        self.enabled = True
+        pending = sum(map(len, self.replay.values()))
+        if pending:
+            ops_log(f"📦 Outbox: {pending} log non confermati da reinviare")
+
+    def _read_records(self, segment):
+        # Un record troncato in coda (crash durante la scrittura) viene ignorato
+        with open(self._segment_path(segment), "rb") as f:
+            data = f.read()
+        position = 0
+        while position + OUTBOX_RECORD.size <= len(data):
+            kind, seq, length = OUTBOX_RECORD.unpack_from(data, position)
+            start = position + OUTBOX_RECORD.size
+            if start + length > len(data):
+                break
+            yield kind, seq, data[start:start + length]
+            position = start + length
+
+    def append(self, guild_id, channel_id, log_type, embed):
+        # La serializzazione avviene nel thread di scrittura, fuori dall'event loop
+        seq = self.next_seq
+        self.next_seq += 1
+        self.buffer.append((seq, guild_id, channel_id, log_type, embed, time.time()))
+        self.buffered.append(seq)
+        self.segment_of[seq] = None
+        self._schedule_flush()
+        return seq
+
+    def ack(self, seqs):
+        acked = array("Q")
+        for seq in seqs:
+            if seq is None or seq not in self.segment_of:
+                continue
+            segment = self.segment_of.pop(seq)
+            if segment is not None:
+                self.live[segment] -= 1
+            acked.append(seq)
+        if acked:
+            self.buffer.append(OUTBOX_RECORD.pack(OUTBOX_ACK, 0, len(acked) * acked.itemsize) + acked.tobytes())
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+        finally:
+            self.flush_task = None
+            if self.buffer:
+                self._schedule_flush()
+
+    async def flush(self):
+        # Una sola write e un solo fsync per tutti i record accumulati nell'intervallo
+        async with self.write_lock:
+            deletions = await self._compact()
+            if not self.buffer and not deletions:
+                return
+            data = self.buffer
+            seqs = self.buffered
+            self.buffer = []
+            self.buffered = []
+            roll = self.current_size >= self.segment_bytes
+            if roll:
+                self.sealed_at[self.current] = time.monotonic()
+                self.current += 1
+                self.current_size = 0
+                self.live[self.current] = 0
+            try:
+                written = await asyncio.to_thread(self._write, self.current, roll, data, deletions)
+            except Exception as e:
+                ops_log(f"❌ Errore scrittura outbox: {e}")
+                self.buffer[:0] = data
+                self.buffered[:0] = seqs
+                return
+            self.current_size += written
+            for seq in seqs:
+                if seq in self.segment_of:
+                    self.segment_of[seq] = self.current
+                    self.live[self.current] += 1
+
+    async def _compact(self):
+        # Dal segmento chiuso più vecchio: quelli confermati vengono eliminati, i log ancora in attesa
+        # vengono riscritti nel segmento corrente. Procedere in ordine evita di perdere conferme
+        # che riguardano segmenti più vecchi
+        deletions = []
+        now = time.monotonic()
+        for segment in sorted(self.sealed_at):
+            if now - self.sealed_at[segment] < self.compact_age:
+                break
+            if self.live.get(segment):
+                waiting = {seq for seq, owner in self.segment_of.items() if owner == segment}
+                records = await asyncio.to_thread(self._read_live, segment, waiting)
+                for seq, raw in records:
+                    if self.segment_of.get(seq) == segment:
+                        self.segment_of[seq] = None
+                        self.buffer.append(raw)
+                        self.buffered.append(seq)
+            del self.sealed_at[segment]
+            self.live.pop(segment, None)
+            deletions.append(segment)
+        return deletions
+
+    def _read_live(self, segment, seqs):
+        records = []
+        for kind, seq, payload in self._read_records(segment):
+            if kind == OUTBOX_LOG and seq in seqs:
+                records.append((seq, OUTBOX_RECORD.pack(kind, seq, len(payload)) + payload))
+        return records
+
+    def _write(self, segment, roll, records, deletions):
+        data = bytearray()
+        for record in records:
+            if isinstance(record, tuple):
+                seq, guild_id, channel_id, log_type, embed, created_at = record
+                payload = json.dumps(
+                    {"g": guild_id, "c": channel_id, "t": log_type, "e": embed.to_dict(), "ts": created_at},
+                    ensure_ascii=False, separators=(",", ":")
+                ).encode("utf-8")
+                data += OUTBOX_RECORD.pack(OUTBOX_LOG, seq, len(payload))
+                data += payload
+            else:
+                data += record
+        if roll and self.file is not None:
+            self.file.close()
+            self.file = None
+        if data:
+            if self.file is None:
+                self.file = open(self._segment_path(segment), "ab")
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        # I segmenti si eliminano solo dopo che i log spostati sono al sicuro sul disco
+        for old in deletions:
+            try:
+                os.remove(self._segment_path(old))
+            except FileNotFoundError:
+                pass
+        return len(data)
+
+    def take_replay(self, guild_id):
+        return self.replay.pop(guild_id, ())
+
+    def drop_guild(self, guild_id):
+        # Il bot è stato rimosso dal server: i suoi log non potranno più essere reinviati
+        records = self.replay.pop(guild_id, ())
+        if records:
+            self.ack([seq for seq, _ in records])
+            ops_log(f"⚠️ Outbox: {len(records)} log scartati, bot rimosso dal server {guild_id}")
+
+    def drop_expired(self, max_age=LOG_OUTBOX_MAX_AGE):
+        # I server non ancora disponibili (timeout del READY, disservizi) restano in attesa:
+        # si scartano solo i log troppo vecchi. I record senza "ts" (versioni precedenti) restano
+        limit = time.time() - max_age
+        dropped = []
+        for guild_id, records in list(self.replay.items()):
+            kept = [(seq, record) for seq, record in records if record.get("ts", limit) >= limit]
+            dropped.extend(seq for seq, record in records if record.get("ts", limit) < limit)
+            if kept:
+                self.replay[guild_id] = kept
+            else:
+                del self.replay[guild_id]
+        if dropped:
+            self.ack(dropped)
+            ops_log(f"⚠️ Outbox: {len(dropped)} log scartati perché più vecchi di {max_age // 86400} giorni")
+
+    async def close(self):
+        if not self.enabled:
+            return
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+log_outbox = LogOutbox(LOG_OUTBOX_DIR if LOG_CLUSTER_ID is None else os.path.join(LOG_OUTBOX_DIR, f"cluster-{LOG_CLUSTER_ID}"))
+if LOG_OUTBOX_ENABLED and not IS_CLUSTER_SUPERVISOR:
+    try:
+        log_outbox.open()
+    except Exception as e:
+        ops_log(f"❌ Errore apertura outbox: {e}")
+
+async def outbox_on_guild_ready(guild):
+    # Reinvia i log rimasti in sospeso appena il server (e il suo routing) è disponibile
+    for seq, record in log_outbox.take_replay(guild.id):
+        channel = get_log_channel(guild, record["t"]) or guild.get_channel(record["c"])
+        if not isinstance(channel, discord.TextChannel):
+            log_outbox.ack((seq,))
+            continue
+        log_batcher.enqueue(channel, record["t"], Embed.from_dict(record["e"]), seq=seq)
+
+async def outbox_on_ready():
+    log_outbox.drop_expired()
+
+async def outbox_on_guild_remove(guild):
+    log_outbox.drop_guild(guild.id)
+
+bot.add_listener(outbox_on_guild_ready, "on_guild_available")
+bot.add_listener(outbox_on_guild_ready, "on_guild_join")
+bot.add_listener(outbox_on_ready, "on_ready")
+bot.add_listener(outbox_on_guild_remove, "on_guild_remove")
+
+# ========== CODA DI INVIO LOG ==========
+
+# Allegato di un log: source è il contenuto (bytes) o il percorso di un file della cache allegati.
+# Il discord.File è monouso e tiene il file aperto: viene creato solo al momento dell'invio, a ogni tentativo
+LogFile = namedtuple("LogFile", ["filename", "source"])
+
+def open_log_files(file):
+    files = []
+    try:
+        for item in file if isinstance(file, list) else [file]:
+            if isinstance(item.source, bytes):
+                files.append(discord.File(io.BytesIO(item.source), filename=item.filename))
+                continue
+            try:
+                files.append(discord.File(item.source, filename=item.filename))
+            except FileNotFoundError:
+                pass  # eliminato dalla cache nel frattempo: il log parte senza quell'allegato
+    except Exception:
+        for opened in files:
+            opened.close()
+        raise
+    return files
+
+class FairScheduler:
+    # Limita gli invii contemporanei e assegna i turni a rotazione tra i server:
+    # un server sotto raid non può occupare tutti gli slot
+    def __init__(self, slots=LOG_DELIVERY_CONCURRENCY):
+        self.free = slots
+        self.waiters = {}   # guild_id -> deque di future in attesa
+        self.ring = deque() # server con richieste in attesa, in ordine di turno
+
+    async def acquire(self, guild_id):
+        if self.free > 0 and not self.ring:
+            self.free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        waiters = self.waiters.setdefault(guild_id, deque())
+        if not waiters:
+            self.ring.append(guild_id)
+        waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Lo slot era già stato assegnato: restituiscilo
+                self.release()
+            elif future in self.waiters.get(guild_id, ()):
+                waiters.remove(future)
+                if not waiters:
+                    del self.waiters[guild_id]
+                    self.ring.remove(guild_id)
+            raise
+
+    def release(self):
+        while self.ring:
+            guild_id = self.ring.popleft()
+            waiters = self.waiters[guild_id]
+            future = waiters.popleft()
+            if waiters:
+                self.ring.append(guild_id)
+            else:
+                del self.waiters[guild_id]
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+class LogBatcher:
+    def __init__(self, max_embeds=LOG_BATCH_MAX_EMBEDS, max_chars=LOG_BATCH_MAX_CHARS, delay=LOG_BATCH_DELAY,
+                 max_per_guild=LOG_QUEUE_MAX_PER_GUILD, overflow_policy=LOG_OVERFLOW_POLICY):
+        self.max_embeds = max_embeds
+        self.max_chars = max_chars
+        self.delay = delay
+        self.max_per_guild = max_per_guild
+        self.overflow_policy = overflow_policy
+        self.queues = {}          # channel_id -> una deque di (log_type, embed, file, seq, priorità) per classe di priorità
+        self.channels = {}        # channel_id -> ultimo oggetto canale visto
+        self.full = {}            # channel_id -> asyncio.Event, settato quando il batch è pieno
+        self.tasks = {}           # channel_id -> task di consegna attivo
+        self.guild_pending = {}   # guild_id -> embed in coda
+        self.guild_channels = {}  # guild_id -> set di channel_id con una coda
+        self.sample_counts = {}   # (guild_id, log_type) -> eventi visti sopra la soglia di campionamento
+        self.summaries = {}       # channel_id -> {log_type: scartati} ancora da riassumere
+        self.shed = {}            # log_type -> embed scartati in totale
+        self.retry_delays = {}    # channel_id -> attesa prima del prossimo tentativo
+        self.scheduler = FairScheduler()
+        self.closing = False
+        self.closed = asyncio.Event()
+
+    def enqueue(self, channel, log_type, embed, file=None, seq=None):
+        # seq è valorizzato solo per i log reinviati dall'outbox, già su disco e già ammessi in passato
+        guild_id = channel.guild.id
+        priority = LOG_PRIORITIES.get(log_type, LOG_PRIORITY_NORMAL)
+        if seq is None:
+            if not self._admit(guild_id, channel.id, log_type, priority):
+                return
+            if log_outbox.enabled and file is None:
+                seq = log_outbox.append(guild_id, channel.id, log_type, embed)
+        queues = self.queues.get(channel.id)
+        if queues is None:
+            queues = self.queues[channel.id] = (deque(), deque(), deque())
+            self.full[channel.id] = asyncio.Event()
+            self.guild_channels.setdefault(guild_id, set()).add(channel.id)
+        self.channels[channel.id] = channel
+        queues[priority].append((log_type, embed, file, seq, priority))
+        self.guild_pending[guild_id] = self.guild_pending.get(guild_id, 0) + 1
+        if sum(map(len, queues)) >= self.max_embeds:
+            self.full[channel.id].set()
+        if channel.id not in self.tasks:
+            self.tasks[channel.id] = asyncio.create_task(self._run(channel.id))
+
+    def _admit(self, guild_id, channel_id, log_type, priority):
+        pending = self.guild_pending.get(guild_id, 0)
+        if (self.overflow_policy == "sample" and priority != LOG_PRIORITY_HIGH
+                and pending >= self.max_per_guild * LOG_SAMPLE_THRESHOLD):
+            # Sopra la soglia passa un evento ogni LOG_SAMPLE_RATE per tipo di log
+            key = (guild_id, log_type)
+            seen = self.sample_counts.get(key, 0) + 1
+            self.sample_counts[key] = seen
+            if seen % LOG_SAMPLE_RATE:
+                self._shed(channel_id, log_type)
+                return False
+        if pending < self.max_per_guild:
+            return True
+        # Coda piena: fai spazio scartando il log meno importante, se ce n'è uno
+        if self._evict_lower(guild_id, priority):
+            return True
+        self._shed(channel_id, log_type)
+        return False
+
+    def _evict_lower(self, guild_id, priority):
+        for lower in range(LOG_PRIORITY_LOW, priority, -1):
+            for channel_id in self.guild_channels.get(guild_id, ()):
+                channel_queue = self.queues[channel_id][lower]
+                if channel_queue:
+                    log_type, _, _, seq, _ = channel_queue.popleft()
+                    log_outbox.ack((seq,))
+                    self.guild_pending[guild_id] -= 1
+                    self._shed(channel_id, log_type)
+                    return True
+        return False
+
+    def _shed(self, channel_id, log_type):
+        self.shed[log_type] = self.shed.get(log_type, 0) + 1
+        if self.overflow_policy == "summarize":
+            counts = self.summaries.setdefault(channel_id, {})
+            counts[log_type] = counts.get(log_type, 0) + 1
+
+    def _queue_summary(self, channel_id):
+        # Con la policy "summarize" i log scartati diventano un unico embed riassuntivo
+        counts = self.summaries.pop(channel_id, None)
+        if not counts:
+            return False
+        channel = self.channels[channel_id]
+        embed = log_embed(
+            title="⚠️ Log riassunti per sovraccarico",
+            description="Troppi eventi in poco tempo: alcuni log non sono stati inviati singolarmente.",
+            color=Color.dark_orange(),
+            fields=[(log_type, f"{count} eventi", True) for log_type, count in sorted(counts.items())][:25],
+            timestamp=True
+        )
+        self.queues[channel_id][LOG_PRIORITY_HIGH].append(("summary", embed, None, None, LOG_PRIORITY_HIGH))
+        self.guild_pending[channel.guild.id] = self.guild_pending.get(channel.guild.id, 0) + 1
+        return True
+
+    def _take_batch(self, queues):
+        # Preleva prima i log più importanti, finché non si supera il numero massimo o il limite di caratteri.
+        # Un log con allegato viene sempre inviato da solo
+        batch = []
+        chars = 0
+        for channel_queue in queues:
+            while channel_queue and len(batch) < self.max_embeds:
+                size = len(channel_queue[0][1])
+                if batch and (chars + size > self.max_chars or channel_queue[0][2] is not None):
+                    return batch
+                batch.append(channel_queue.popleft())
+                chars += size
+                if batch[-1][2] is not None:
+                    return batch
+        return batch
+
+    async def _run(self, channel_id):
+        queues = self.queues[channel_id]
+        full = self.full[channel_id]
+        guild_id = self.channels[channel_id].guild.id
+        try:
+            while True:
+                if not any(queues) and not self._queue_summary(channel_id):
+                    break
+                if sum(map(len, queues)) < self.max_embeds and not self.closing:
+                    try:
+                        await asyncio.wait_for(full.wait(), self.delay)
+                    except asyncio.TimeoutError:
+                        pass
+                full.clear()
+                batch = self._take_batch(queues)
+                if not batch:
+                    continue
+                self.guild_pending[guild_id] -= len(batch)
+                await self.scheduler.acquire(guild_id)
+                try:
+                    done = await self._deliver(self.channels[channel_id], batch)
+                finally:
+                    self.scheduler.release()
+                if done:
+                    log_outbox.ack(item[3] for item in batch)
+                    self.retry_delays.pop(channel_id, None)
+                    continue
+                # Errore temporaneo: ogni log torna in testa alla coda della sua priorità e si riprova con backoff.
+                # In chiusura si rinuncia: i log restano nell'outbox e verranno reinviati al riavvio
+                for item in reversed(batch):
+                    queues[item[4]].appendleft(item)
+                self.guild_pending[guild_id] += len(batch)
+                if self.closing:
+                    break
+                delay = min(self.retry_delays.get(channel_id, LOG_RETRY_BASE_DELAY / 2) * 2, LOG_RETRY_MAX_DELAY)
+                self.retry_delays[channel_id] = delay
+                try:
+                    await asyncio.wait_for(self.closed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                if self.closing:
+                    break
+        finally:
+            self.tasks.pop(channel_id, None)
+            if not self.guild_pending.get(guild_id):
+                self.guild_pending.pop(guild_id, None)
+                for key in [key for key in self.sample_counts if key[0] == guild_id]:
+                    del self.sample_counts[key]
+
+    async def _deliver(self, channel, batch):
+        # True se il batch è concluso (inviato o scartato definitivamente), False se va ritentato
+        embeds = [item[1] for item in batch]
+        file = batch[0][2]
+        sink = "channel"
+        start = time.perf_counter()
+        try:
+            if file is not None:
+                # Gli allegati passano sempre dal canale (file può essere anche una lista di LogFile)
+                files = open_log_files(file)
+                try:
+                    await channel.send(embed=embeds[0], files=files)
+                finally:
+                    for opened in files:
+                        opened.close()
+                metrics.inc("logbot_embeds_sent_total", (("sink", sink),), 1)
+                return True
+            if LOG_WEBHOOK_MODE:
+                log_type = next((item[0] for item in batch if item[0] in DEFAULT_LOG_CHANNELS), None)
+                hook = logs_webhooks.get(str(channel.guild.id), {}).get(log_type)
+                if hook:
+                    sink = "webhook"
+                    if await webhook_sender.execute(hook, embeds):
+                        metrics.inc("logbot_embeds_sent_total", (("sink", sink),), len(embeds))
+                        return True
+                    sink = "channel"
+            await channel.send(embeds=embeds)
+            metrics.inc("logbot_embeds_sent_total", (("sink", sink),), len(embeds))
+            return True
+        except Exception as e:
+            metrics.inc("logbot_send_errors_total", (("sink", sink),))
+            log_types = ", ".join(sorted(set(item[0] for item in batch)))
+            ops_log(f"❌ Errore invio log ({log_types}): {e}")
+            # Gli allegati vengono riaperti al prossimo tentativo
+            return not is_retryable(e)
+        finally:
+            metrics.observe("logbot_send_seconds", (("sink", sink),), time.perf_counter() - start)
+
+    async def close(self):
+        # Invia subito tutto ciò che è in coda
+        self.closing = True
+        self.closed.set()
+        for event in self.full.values():
+            event.set()
+        if self.tasks:
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+def is_retryable(error):
+    # Errori temporanei (Discord irraggiungibile, 5xx, rate limit): il log verrà ritentato
+    if isinstance(error, (discord.DiscordServerError, discord.RateLimited, WebhookExhausted,
+                          aiohttp.ClientError, asyncio.TimeoutError, OSError)):
+        return True
+    return isinstance(error, discord.HTTPException) and error.status == 429
+
+log_batcher = LogBatcher()
+
+# ========== INVIO TRAMITE WEBHOOK ==========
+
+class WebhookExhausted(RuntimeError):
+    # Tentativi esauriti per 429/5xx: errore temporaneo, il batch verrà ritentato
+    pass
+
+class WebhookSender:
+    def __init__(self, max_retries=LOG_WEBHOOK_MAX_RETRIES):
+        self.max_retries = max_retries
+        self.session = None
+        self.locks = {}         # webhook_id -> asyncio.Lock (un invio alla volta per bucket)
+        self.buckets = {}       # webhook_id -> hash del bucket restituito da Discord
+        self.limits = {}        # webhook_id -> (richieste rimaste, istante di reset)
+        self.global_reset = 0.0
+        self.retries = 0
+        self.rate_limited = 0
+
+    def _get_session(self):
+        # Sessione dedicata: i log non condividono connessioni né rate limit con i comandi del bot
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=20))
+        return self.session
+
+    def _update_limits(self, webhook_id, headers):
+        bucket = headers.get("X-RateLimit-Bucket")
+        if bucket:
+            self.buckets[webhook_id] = bucket
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None and reset_after is not None:
+            self.limits[webhook_id] = (int(remaining), time.monotonic() + float(reset_after))
+
+    async def _wait_for_bucket(self, webhook_id):
+        # Attende prima di inviare se il bucket (o il limite globale) è esaurito
+        now = time.monotonic()
+        delay = self.global_reset - now
+        remaining, reset_at = self.limits.get(webhook_id, (1, 0.0))
+        if remaining <= 0:
+            delay = max(delay, reset_at - now)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def execute(self, hook, embeds):
+        # Restituisce False se il webhook non è più valido: il chiamante userà il canale
+        webhook_id = hook["id"]
+        url = f"{discord.http.Route.BASE}/webhooks/{webhook_id}/{hook['token']}"
+        payload = {
+            "embeds": [embed.to_dict() for embed in embeds],
+            "allowed_mentions": {"parse": []}
+        }
+        lock = self.locks.setdefault(webhook_id, asyncio.Lock())
+        async with lock:
+            for attempt in range(self.max_retries):
+                await self._wait_for_bucket(webhook_id)
+                async with self._get_session().post(url, json=payload) as resp:
+                    self._update_limits(webhook_id, resp.headers)
+                    if resp.status == 429:
+                        self.rate_limited += 1
+                        metrics.inc("logbot_rest_ratelimited_total", (("route", "POST /webhooks/{webhook_id}/{webhook_token}"),))
+                        data = await resp.json(content_type=None)
+                        retry_after = float(data.get("retry_after", 1.0))
+                        if data.get("global") or resp.headers.get("X-RateLimit-Global"):
+                            self.global_reset = time.monotonic() + retry_after
+                        else:
+                            self.limits[webhook_id] = (0, time.monotonic() + retry_after)
+                        self.retries += 1
+                        continue
+                    if resp.status >= 500:
+                        self.retries += 1
+                        metrics.inc("logbot_rest_retries_total", (("route", "POST /webhooks/{webhook_id}/{webhook_token}"),))
+                        await asyncio.sleep(2 ** attempt)
+                        continue
+                    if resp.status in (401, 403, 404):
+                        self._forget(webhook_id)
+                        return False
+                    if resp.status >= 400:
+                        raise RuntimeError(f"webhook {webhook_id}: HTTP {resp.status} {await resp.text()}")
+                    return True
+        raise WebhookExhausted(f"webhook {webhook_id}: troppi tentativi falliti")
+
+    def _forget(self, webhook_id):
+        # Webhook eliminato dal server: rimuovilo dalla configurazione
+        for gid, hooks in logs_webhooks.items():
+            for log_type, hook in list(hooks.items()):
+                if hook["id"] == webhook_id:
+                    hooks.pop(log_type)
+                    config_store.schedule_save(gid)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+webhook_sender = WebhookSender()
+
+async def get_or_create_log_webhook(channel):
+    # Riusa il webhook del bot se esiste già, altrimenti ne crea uno nuovo
+    for webhook in await channel.webhooks():
+        if webhook.name == LOG_WEBHOOK_NAME and webhook.token:
+            return webhook
+    return await channel.create_webhook(name=LOG_WEBHOOK_NAME, reason="Log System")
+
+# ========== ARCHIVIO MESSAGGI ==========
+
+# Voce dell'indice su disco: id messaggio, offset nel segmento, lunghezza del record
+ARCHIVE_INDEX_ENTRY = struct.Struct("<QQI")
+
+class ArchiveSegment:
+    def __init__(self, start):
+        self.start = start
+        self.live = {}  # message_id -> (offset, length), solo per il segmento corrente
+        self.ids = array("Q")
+        self.offsets = array("Q")
+        self.lengths = array("I")
+
+    def add(self, message_id, offset, length):
+        if self.live is None:
+            # Scrittura tardiva in un segmento già chiuso (cambio d'ora durante il flush)
+            self.live = dict(zip(self.ids, zip(self.offsets, self.lengths)))
+            self.ids, self.offsets, self.lengths = array("Q"), array("Q"), array("I")
+        self.live[message_id] = (offset, length)
+
+    def seal(self):
+        # Segmento chiuso: l'indice diventa un array ordinato (20 byte per messaggio)
+        for message_id, (offset, length) in sorted(self.live.items()):
+            self.ids.append(message_id)
+            self.offsets.append(offset)
+            self.lengths.append(length)
+        self.live = None
+
+    def find(self, message_id):
+        if self.live is not None:
+            return self.live.get(message_id)
+        i = bisect_left(self.ids, message_id)
+        if i < len(self.ids) and self.ids[i] == message_id:
+            return self.offsets[i], self.lengths[i]
+        return None
+
+class MessageArchive:
+    def __init__(self, path=ARCHIVE_DIR, segment_seconds=ARCHIVE_SEGMENT_SECONDS,
+                 retention_days=ARCHIVE_RETENTION_DAYS, delay=ARCHIVE_FLUSH_DELAY, flush_size=ARCHIVE_FLUSH_SIZE):
+        self.path = path
+        self.segment_seconds = segment_seconds
+        self.retention = retention_days * 86400
+        self.delay = delay
+        self.flush_size = flush_size
+        self.segments = {}   # inizio segmento -> ArchiveSegment
+        self.pending = {}    # message_id -> (segmento, record) non ancora scritti
+        self.flush_task = None
+        self.size_flush = None   # flush per dimensione in corso: al massimo uno alla volta
+        self.write_lock = asyncio.Lock()
+
+    def _segment_path(self, start, ext):
+        return os.path.join(self.path, f"{start}.{ext}")
+
+    def open(self):
+        # Ricarica gli indici compatti dei segmenti ancora in retention
+        os.makedirs(self.path, exist_ok=True)
+        current = self._current_segment()
+        for name in os.listdir(self.path):
+            if not name.endswith(".idx"):
+                continue
+            start = int(name[:-4])
+            segment = ArchiveSegment(start)
+            with open(self._segment_path(start, "idx"), "rb") as f:
+                data = f.read()
+            usable = len(data) - len(data) % ARCHIVE_INDEX_ENTRY.size
+            for message_id, offset, length in ARCHIVE_INDEX_ENTRY.iter_unpack(data[:usable]):
+                segment.add(message_id, offset, length)
+            if start != current:
+                segment.seal()
+            self.segments[start] = segment
+        self._delete_segments(self._expire_segments())
+
+    def _current_segment(self):
+        now = int(time.time())
+        return now - now % self.segment_seconds
+
+    def add(self, record):
+        self.pending[record["id"]] = (self._current_segment(), record)
+        # Durante la scrittura il buffer resta pieno fino alla fine del batch: i messaggi arrivati
+        # nel frattempo attendono il flush ritardato invece di avviare altri flush
+        if len(self.pending) >= self.flush_size and self.size_flush is None:
+            self.size_flush = asyncio.create_task(self._flush_now())
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_now(self):
+        try:
+            await self.flush()
+        finally:
+            self.size_flush = None
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+        finally:
+            self.flush_task = None
+
+    async def flush(self):
+        async with self.write_lock:
+            if not self.pending:
+                return
+            batch = list(self.pending.values())
+            try:
+                entries = await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                ops_log(f"❌ Errore scrittura archivio messaggi: {e}")
+                return
+            for item, (start, message_id, offset, length) in zip(batch, entries):
+                segment = self.segments.get(start)
+                if segment is None:
+                    segment = self.segments[start] = ArchiveSegment(start)
+                segment.add(message_id, offset, length)
+                # Rimuovi dal buffer solo se non è arrivata una versione più recente nel frattempo
+                if self.pending.get(message_id) is item:
+                    self.pending.pop(message_id)
+            current = self._current_segment()
+            for start, segment in self.segments.items():
+                if start != current and segment.live is not None:
+                    segment.seal()
+            expired = self._expire_segments()
+            if expired:
+                await asyncio.to_thread(self._delete_segments, expired)
+
+    def _write_batch(self, batch):
+        # Append sequenziale per segmento: un'unica write per il log e una per l'indice.
+        # Le voci restituite seguono l'ordine del batch
+        by_segment = {}
+        for position, (start, record) in enumerate(batch):
+            by_segment.setdefault(start, []).append((position, record))
+        entries = [None] * len(batch)
+        for start, records in by_segment.items():
+            data = bytearray()
+            index = bytearray()
+            with open(self._segment_path(start, "log"), "ab") as f:
+                base = f.tell()
+                for position, record in records:
+                    raw = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                    offset = base + len(data)
+                    data += raw
+                    index += ARCHIVE_INDEX_ENTRY.pack(record["id"], offset, len(raw))
+                    entries[position] = (start, record["id"], offset, len(raw))
+                f.write(data)
+            with open(self._segment_path(start, "idx"), "ab") as f:
+                f.write(index)
+        return entries
+
+    def _expire_segments(self):
+        # Retention a tempo: i segmenti scaduti vengono eliminati interi
+        limit = time.time() - self.retention
+        expired = [start for start in self.segments if start + self.segment_seconds < limit]
+        for start in expired:
+            self.segments.pop(start)
+        return expired
+
+    def _delete_segments(self, starts):
+        for start in starts:
+            for ext in ("log", "idx"):
+                try:
+                    os.remove(self._segment_path(start, ext))
+                except FileNotFoundError:
+                    pass
+
+    async def get(self, message_id):
+        pending = self.pending.get(message_id)
+        if pending is not None:
+            return pending[1]
+        # Un messaggio non può trovarsi in segmenti precedenti alla sua creazione
+        created = discord.utils.snowflake_time(message_id).timestamp()
+        for start in sorted(self.segments, reverse=True):
+            if start + self.segment_seconds < created:
+                break
+            location = self.segments[start].find(message_id)
+            if location is not None:
+                return await asyncio.to_thread(self._read_record, start, *location)
+        return None
+
+    def _read_record(self, start, offset, length):
+        try:
+            with open(self._segment_path(start, "log"), "rb") as f:
+                f.seek(offset)
+                return json.loads(f.read(length))
+        except (OSError, ValueError) as e:
+            ops_log(f"❌ Errore lettura archivio messaggi: {e}")
+            return None
+
+    async def close(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+        await self.flush()
+
+def message_record(message):
+    return {
+        "id": message.id,
+        "guild_id": message.guild.id if message.guild else None,
+        "channel_id": message.channel.id,
+        "author_id": message.author.id,
+        "author": str(message.author),
+        "avatar": message.author.display_avatar.url,
+        "bot": message.author.bot,
+        "content": message.content,
+        "attachments": [attachment.url for attachment in message.attachments]
+    }
+
+def wants_archive(guild):
+    return MESSAGE_ARCHIVE_ENABLED and (has_log(guild, "messaggi_cancellati") or has_log(guild, "messaggi_modificati"))
+
+async def archive_on_message(message):
+    if message.author.bot or not message.guild:
+        return
+    if wants_archive(message.guild):
+        message_archive.add(message_record(message))
+
+bot.add_listener(archive_on_message, "on_message")
+
+message_archive = MessageArchive()
+if MESSAGE_ARCHIVE_ENABLED and not IS_CLUSTER_SUPERVISOR:
+    try:
+        message_archive.open()
+    except Exception as e:
+        ops_log(f"❌ Errore apertura archivio messaggi: {e}")
+
+# ========== CACHE ALLEGATI ==========
+
+class AttachmentCache:
+    # File salvati come <hash>: lo stesso contenuto inviato più volte occupa spazio una volta sola.
+    # Superato il limite vengono eliminati i file usati meno di recente
+    def __init__(self, path=ATTACHMENT_CACHE_DIR, max_bytes=ATTACHMENT_CACHE_MAX_BYTES,
+                 max_file_bytes=ATTACHMENT_MAX_FILE_BYTES, concurrency=ATTACHMENT_DOWNLOAD_CONCURRENCY):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.conn = None
+        self.session = None
+        self.total = 0
+        self.inflight = {}   # message_id -> task di download
+        self.db_lock = asyncio.Lock()
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.path, "index.db"), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS attachments ("
+            "message_id INTEGER NOT NULL, position INTEGER NOT NULL, hash TEXT NOT NULL, filename TEXT NOT NULL, "
+            "PRIMARY KEY (message_id, position)) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS attachments_hash ON attachments (hash)")
+        self.conn.commit()
+        self.total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        # File temporanei rimasti da un download interrotto
+        for name in os.listdir(self.path):
+            if name.endswith(".part"):
+                os.remove(os.path.join(self.path, name))
+
+    def _blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=ATTACHMENT_DOWNLOAD_CONCURRENCY),
+                timeout=aiohttp.ClientTimeout(total=120)
+            )
+        return self.session
+
+    def mirror(self, message):
+        attachments = [attachment for attachment in message.attachments if attachment.size <= self.max_file_bytes]
+        if not attachments:
+            return
+        if len(self.inflight) >= ATTACHMENT_MAX_PENDING:
+            metrics.inc("logbot_attachments_skipped_total")
+            return
+        task = asyncio.create_task(self._mirror(message.id, attachments))
+        self.inflight[message.id] = task
+        task.add_done_callback(lambda _: self.inflight.pop(message.id, None))
+
+    async def _mirror(self, message_id, attachments):
+        stored = []
+        for position, attachment in enumerate(attachments):
+            try:
+                async with self.semaphore:
+                    digest, size = await self._download(attachment.url)
+            except Exception as e:
+                ops_log(f"❌ Errore download allegato {attachment.filename}: {e}")
+                continue
+            if digest is not None:
+                stored.append((message_id, position, digest, attachment.filename, size))
+        if stored:
+            async with self.db_lock:
+                evicted = await asyncio.to_thread(self._record, stored)
+            if evicted:
+                metrics.inc("logbot_attachments_evicted_total", (), len(evicted))
+
+    async def _download(self, url):
+        # Scrittura a blocchi durante il download: il file non viene mai tenuto tutto in memoria
+        hasher = hashlib.sha256()
+        size = 0
+        temp_path = os.path.join(self.path, f"{os.getpid()}-{id(hasher)}.part")
+        try:
+            async with self._get_session().get(url) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"HTTP {resp.status}")
+                with open(temp_path, "wb") as f:
+                    async for chunk in resp.content.iter_chunked(ATTACHMENT_CHUNK_BYTES):
+                        size += len(chunk)
+                        if size > self.max_file_bytes:
+                            return None, 0
+                        hasher.update(chunk)
+                        await asyncio.to_thread(f.write, chunk)
+            digest = hasher.hexdigest()
+            await asyncio.to_thread(self._store, temp_path, digest)
+            return digest, size
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _store(self, temp_path, digest):
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def _record(self, stored):
+        # Registra gli allegati e, se si supera il limite, elimina i file usati meno di recente
+        now = time.time()
+        with self.conn:
+            for message_id, position, digest, filename, size in stored:
+                if self.conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone():
+                    self.conn.execute("UPDATE blobs SET last_used = ? WHERE hash = ?", (now, digest))
+                else:
+                    self.conn.execute("INSERT INTO blobs (hash, size, last_used) VALUES (?, ?, ?)", (digest, size, now))
+                    self.total += size
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO attachments (message_id, position, hash, filename) VALUES (?, ?, ?, ?)",
+                    (message_id, position, digest, filename)
+                )
+        evicted = []
+        if self.total <= self.max_bytes:
+            return evicted
+        with self.conn:
+            for digest, size in self.conn.execute("SELECT hash, size FROM blobs ORDER BY last_used").fetchall():
+                if self.total <= self.max_bytes:
+                    break
+                self.conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+                self.conn.execute("DELETE FROM attachments WHERE hash = ?", (digest,))
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+                self.total -= size
+                evicted.append(digest)
+        return evicted
+
+    def _lookup(self, message_id):
+        rows = self.conn.execute(
+            "SELECT a.hash, a.filename, b.size FROM attachments a JOIN blobs b ON b.hash = a.hash "
+            "WHERE a.message_id = ? ORDER BY a.position", (message_id,)
+        ).fetchall()
+        with self.conn:
+            self.conn.execute("DELETE FROM attachments WHERE message_id = ?", (message_id,))
+            self.conn.executemany("UPDATE blobs SET last_used = ? WHERE hash = ?", [(time.time(), row[0]) for row in rows])
+        return [(self._blob_path(digest), filename, size) for digest, filename, size in rows]
+
+    async def files_for(self, message_id, limit=ATTACHMENT_MAX_FILE_BYTES):
+        # Restituisce i LogFile salvati per il messaggio, entro il limite di upload complessivo
+        if self.conn is None:
+            return []
+        task = self.inflight.get(message_id)
+        if task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), ATTACHMENT_WAIT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+        async with self.db_lock:
+            rows = await asyncio.to_thread(self._lookup, message_id)
+        files = []
+        used = 0
+        for path, filename, size in rows:
+            if used + size > limit or not os.path.exists(path):
+                continue
+            files.append(LogFile(filename, path))
+            used += size
+        return files
+
+    async def close(self):
+        for task in list(self.inflight.values()):
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+attachment_cache = AttachmentCache(
+    ATTACHMENT_CACHE_DIR if LOG_CLUSTER_ID is None else os.path.join(ATTACHMENT_CACHE_DIR, f"cluster-{LOG_CLUSTER_ID}")
+)
+if ATTACHMENT_CACHE_ENABLED and not IS_CLUSTER_SUPERVISOR:
+    try:
+        attachment_cache.open()
+    except Exception as e:
+        ops_log(f"❌ Errore apertura cache allegati: {e}")
+        attachment_cache.conn = None
+
+async def attachments_on_message(message):
+    # Solo dove i messaggi eliminati vengono loggati: altrove la copia non servirebbe
+    if not message.attachments or message.author.bot or not message.guild:
+        return
+    if attachment_cache.conn is not None and has_log(message.guild, "messaggi_cancellati"):
+        attachment_cache.mirror(message)
+
+bot.add_listener(attachments_on_message, "on_message")
+
+# ========== COMANDO SETUP LOGS ==========
+
+SETUP_CONCURRENCY = 5           # creazioni di canali in parallelo
+SETUP_PROGRESS_INTERVAL = 1.0   # secondi minimi tra due aggiornamenti di avanzamento
+
+SetupPlan = namedtuple("SetupPlan", ["existing", "renamed", "missing"])
+
+def channel_slug(name):
+    # Discord normalizza i nomi dei canali (minuscole, trattini, emoji): confronta solo lettere e numeri
+    return "".join(c for c in name.lower() if c.isalnum())
+
+def plan_log_setup(guild, category):
+    # existing/renamed: log_type -> canale; missing: lista di log_type da creare
+    configured = logs_channels.get(str(guild.id), {})
+    by_slug = {channel_slug(channel.name): channel for channel in (category.text_channels if category else [])}
+    existing, renamed, missing = {}, {}, []
+    for log_key, log_name in DEFAULT_LOG_CHANNELS.items():
+        channel = guild.get_channel(configured[log_key]) if log_key in configured else None
+        if isinstance(channel, discord.TextChannel):
+            if channel_slug(channel.name) == channel_slug(log_name):
+                existing[log_key] = channel
+            else:
+                # Canale configurato ma rinominato a mano: lo teniamo così com'è
+                renamed[log_key] = channel
+            continue
+        channel = by_slug.get(channel_slug(log_name))
+        if channel is not None:
+            existing[log_key] = channel
+        else:
+            missing.append(log_key)
+    return SetupPlan(existing, renamed, missing)
+
+def describe_channels(log_keys):
+    if not log_keys:
+        return "*Nessuno*"
+    return "\n".join(DEFAULT_LOG_CHANNELS[log_key] for log_key in log_keys)[:1024]
+
+@bot.tree.command(name="setup_logs", description="Configura automaticamente tutti i canali di log.")
+@app_commands.describe(dry_run="Mostra soltanto cosa verrebbe creato, senza modificare il server")
+@app_commands.checks.has_permissions(administrator=True)
+async def setup_logs(interaction: Interaction, dry_run: bool = False):
+    guild = interaction.guild
+    if guild is None:
+        await interaction.response.send_message("> ❌ **Questo comando può essere usato solo in un server.**", ephemeral=True)
+        return
+
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(read_messages=False),
+        guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True, manage_channels=True)
+    }
+
+    category = discord.utils.get(guild.categories, name=LOGS_CATEGORY_NAME)
+    plan = plan_log_setup(guild, category)
+
+    if dry_run:
+        embed = Embed(
+            title="🧪 Anteprima configurazione log",
+            description=f"Categoria `{LOGS_CATEGORY_NAME}`: {'presente' if category else 'da creare'}",
+            color=Color.blurple()
+        )
+        embed.add_field(name=f"Già presenti ({len(plan.existing)})", value=describe_channels(plan.existing), inline=False)
+        embed.add_field(name=f"Rinominati, mantenuti ({len(plan.renamed)})", value=describe_channels(plan.renamed), inline=False)
+        embed.add_field(name=f"Da creare ({len(plan.missing)})", value=describe_channels(plan.missing), inline=False)
+        embed.set_footer(text="Log System • 2025", icon_url=bot.user.display_avatar.url)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+        return
+
+    # Crea la categoria se manca
+    if not category:
+        try:
+            category = await guild.create_category(LOGS_CATEGORY_NAME, overwrites=overwrites)
+        except Exception as e:
+            await interaction.followup.send(f"❌ Errore creazione categoria: {e}", ephemeral=True)
+            return
+
+    channel_objects = dict(plan.existing)
+    channel_objects.update(plan.renamed)
+    errors = []
+    semaphore = asyncio.Semaphore(SETUP_CONCURRENCY)
+    done = 0
+    last_progress = 0.0
+
+    async def report_progress():
+        nonlocal last_progress
+        now = time.monotonic()
+        if now - last_progress < SETUP_PROGRESS_INTERVAL:
+            return
+        last_progress = now
+        try:
+            await interaction.edit_original_response(content=f"⏳ Creazione canali di log: {done}/{len(plan.missing)}")
+        except discord.HTTPException:
+            pass
+
+    async def create_channel(log_key):
+        nonlocal done
+        log_name = DEFAULT_LOG_CHANNELS[log_key]
+        async with semaphore:
+            try:
+                channel_objects[log_key] = await guild.create_text_channel(
+                    log_name,
+                    category=category,
+                    overwrites=overwrites,
+                    topic=f"🔔 Log automatico: {log_name}"
+                )
+            except Exception as e:
+                errors.append(f"Canale {log_name}: {e}")
+        done += 1
+        await report_progress()
+
+    await asyncio.gather(*(create_channel(log_key) for log_key in plan.missing))
+
+    # Salva nella configurazione
+    logs_channels[str(guild.id)] = {log_key: channel.id for log_key, channel in channel_objects.items()}
+    config_store.schedule_save(guild.id)
+    build_guild_routes(guild, channel_objects)
+
+    if LOG_WEBHOOK_MODE:
+        known_webhooks = logs_webhooks.get(str(guild.id), {})
+        created_webhooks = {}
+
+        async def ensure_webhook(log_key, channel):
+            # I webhook già configurati per canali esistenti vengono riutilizzati senza chiamate API
+            if log_key in known_webhooks and log_key not in plan.missing:
+                created_webhooks[log_key] = known_webhooks[log_key]
+                return
+            async with semaphore:
+                try:
+                    webhook = await get_or_create_log_webhook(channel)
+                except Exception as e:
+                    errors.append(f"Webhook {DEFAULT_LOG_CHANNELS[log_key]}: {e}")
+                    return
+            created_webhooks[log_key] = {"id": webhook.id, "token": webhook.token}
+
+        await asyncio.gather(*(ensure_webhook(log_key, channel) for log_key, channel in channel_objects.items()))
+        logs_webhooks[str(guild.id)] = created_webhooks
+        config_store.schedule_save(guild.id)
+
+    created = [log_key for log_key in plan.missing if log_key in channel_objects]
+    embed = Embed(
+        title="🟢 Log configurati con successo!" if not errors else "🟠 Log configurati con alcuni errori",
+        description=("> Tutti i canali di log sono stati **creati** e **configurati** correttamente.\n\n"
+                     if not errors else "> Alcuni canali o webhook non sono stati creati, controlla gli errori qui sotto.\n\n")
+                    + "Puoi personalizzare i permessi o la posizione dei canali a tuo piacimento.",
+        color=Color.green() if not errors else Color.orange()
+    )
+    embed.add_field(name="Creati", value=str(len(created)), inline=True)
+    embed.add_field(name="Già presenti", value=str(len(plan.existing)), inline=True)
+    embed.add_field(name="Rinominati", value=str(len(plan.renamed)), inline=True)
+    if errors:
+        embed.add_field(name="Errori", value="\n".join(errors)[:1024], inline=False)
+    embed.set_footer(text="Log System • 2025", icon_url=bot.user.display_avatar.url)
+    await interaction.edit_original_response(content=None, embed=embed)
+
+# ========== EVENTI DI LOGGING ==========
+
+LOG_FOOTER = "Log System • 2025"
+
+def log_embed(
+    title: str,
+    description: str,
+    color=Color.blurple(),
+    fields=None,
+    author=None,
+    thumbnail=None,
+    footer=None,
+    timestamp=True
+):
+    embed = Embed(
+        title=title,
+        description=description,
+        color=color,
+        timestamp=discord.utils.utcnow() if timestamp else None
+    )
+    for name, value, inline in fields or ():
+        embed.add_field(name=name, value=value, inline=inline)
+    if author:
+        embed.set_author(name=author[0], icon_url=author[1] if len(author) > 1 else None)
+    if thumbnail:
+        embed.set_thumbnail(url=thumbnail)
+    embed.set_footer(text=footer or LOG_FOOTER)
+    return embed
+
+async def send_log(guild, log_type, embed, file=None):
+    enqueue_log(guild, log_type, embed, file)
+
+log_sinks = []  # destinazioni oltre a Discord (indice di ricerca, file): espongono add(guild_id, log_type, embed)
+
+def enqueue_log(guild, log_type, embed, file=None):
+    # Accoda soltanto: l'invio HTTP avviene in background a batch, le altre destinazioni scrivono in batch su disco
+    channel = get_log_channel(guild, log_type)
+    if channel:
+        metrics.inc("logbot_logs_enqueued_total", (("log_type", log_type),))
+        if channel is not FILE_ONLY_ROUTE:
+            log_batcher.enqueue(channel, log_type, embed, file)
+        for sink in log_sinks:
+            sink.add(guild.id, log_type, embed)
+
+# ========== CORRELAZIONE AUDIT LOG ==========
+
+# Azioni di audit che hanno un evento del gateway corrispondente: l'esecutore e il motivo
+# vengono uniti al log dell'evento invece di produrre un secondo embed nel canale audit
+AUDIT_CORRELATED_ACTIONS = {
+    discord.AuditLogAction.ban,
+    discord.AuditLogAction.unban,
+    discord.AuditLogAction.kick,
+    discord.AuditLogAction.role_create,
+    discord.AuditLogAction.role_delete,
+    discord.AuditLogAction.role_update,
+    discord.AuditLogAction.channel_create,
+    discord.AuditLogAction.channel_delete,
+    discord.AuditLogAction.channel_update,
+    discord.AuditLogAction.thread_create,
+    discord.AuditLogAction.thread_delete,
+    discord.AuditLogAction.stage_instance_create,
+    discord.AuditLogAction.stage_instance_delete,
+    discord.AuditLogAction.scheduled_event_create,
+    discord.AuditLogAction.scheduled_event_delete,
+    discord.AuditLogAction.guild_update,
+    discord.AuditLogAction.member_update,
+    discord.AuditLogAction.member_role_update,
+    discord.AuditLogAction.message_bulk_delete,
+    discord.AuditLogAction.overwrite_create,
+    discord.AuditLogAction.overwrite_update,
+    discord.AuditLogAction.overwrite_delete
+}
+
+# Azioni diverse che Discord notifica con lo stesso evento: condividono la chiave di correlazione.
+# I permessi di un canale arrivano come on_guild_channel_update, qualunque sia l'operazione sulle sovrascritture
+AUDIT_CORRELATION_ALIASES = {
+    discord.AuditLogAction.overwrite_create: discord.AuditLogAction.overwrite_update,
+    discord.AuditLogAction.overwrite_delete: discord.AuditLogAction.overwrite_update
+}
+
+# Azioni con un tipo di log dedicato: il log unito (o la voce senza evento) va lì se il server lo ha configurato.
+# Ogni voce finisce in un solo canale: tipo dedicato, altrimenti quello dell'evento o, se non reclamata, audit
+AUDIT_ACTION_LOG_TYPES = {
+    discord.AuditLogAction.kick: "moderazione"
+}
+
+def audit_target_id(entry):
+    target = entry.target
+    return getattr(target, "id", None)
+
+def audit_key(guild_id, action, target_id):
+    return guild_id, AUDIT_CORRELATION_ALIASES.get(action, action), target_id
+
+def audit_log_type(guild, log_type, entry):
+    dedicated = AUDIT_ACTION_LOG_TYPES.get(entry.action)
+    return dedicated if dedicated is not None and has_log(guild, dedicated) else log_type
+
+def merge_audit_entry(embed, entry):
+    if entry.action is discord.AuditLogAction.kick:
+        # L'uscita era un kick: il log di join/leave lo dice esplicitamente
+        embed.title = "👢 Utente espulso"
+        embed.colour = Color.dark_orange()
+    embed.add_field(name="Eseguito da", value=user_mention(entry.user) if entry.user else "N/A", inline=True)
+    if entry.reason:
+        embed.add_field(name="Motivo", value=entry.reason[:1024], inline=False)
+
+def audit_entry_embed(entry):
+    if entry.action is discord.AuditLogAction.kick:
+        # Kick senza evento di uscita abbinato (join/leave non configurato o evento perso)
+        return log_embed(
+            title="👢 Utente espulso",
+            description=f"<@{audit_target_id(entry)}> è stato espulso dal server.",
+            color=Color.dark_orange(),
+            fields=[
+                ("ID Utente", str(audit_target_id(entry)), True),
+                ("Eseguito da", user_mention(entry.user) if entry.user else "N/A", True),
+                ("Motivo", entry.reason[:1024] if entry.reason else "*Nessun motivo*", False)
+            ],
+            timestamp=True
+        )
+    return log_embed(
+        title="🕵️ Audit Log",
+        description=f"Nuova voce nell'audit log: {entry.action}",
+        color=Color.blurple(),
+        fields=[
+            ("Utente", str(entry.user) if entry.user else "N/A", True),
+            ("Target", str(entry.target) if entry.target else "N/A", True)
+        ] + ([("Motivo", entry.reason[:1024], False)] if entry.reason else []),
+        timestamp=True
+    )
+
+class AuditCorrelator:
+    # Chiave (server, azione, id target): chi arriva prima aspetta l'altro al massimo `window` secondi.
+    # Eventi senza voce di audit vengono inviati così come sono; voci senza evento finiscono nel canale audit.
+    def __init__(self, window=AUDIT_CORRELATION_WINDOW):
+        self.window = window
+        self.events = {}   # chiave -> ([(guild, log_type, embed, file)], timer)
+        self.entries = {}  # chiave -> [entry, reclamata, timer]
+
+    def correlates(self, guild):
+        # Senza intent o permesso le voci di audit non arrivano: inutile trattenere l'evento
+        if self.window <= 0 or not bot.intents.moderation:
+            return False
+        me = guild.me
+        return me is not None and me.guild_permissions.view_audit_log
+
+    def submit(self, guild, log_type, embed, action, target_id, file=None):
+        key = audit_key(guild.id, action, target_id)
+        cached = self.entries.get(key)
+        if cached is not None:
+            cached[1] = True
+            merge_audit_entry(embed, cached[0])
+            enqueue_log(guild, audit_log_type(guild, log_type, cached[0]), embed, file)
+            return
+        if not self.correlates(guild):
+            enqueue_log(guild, log_type, embed, file)
+            return
+        pending = self.events.get(key)
+        if pending is None:
+            timer = asyncio.get_running_loop().call_later(self.window, self._expire_events, key)
+            pending = self.events[key] = ([], timer)
+        pending[0].append((guild, log_type, embed, file))
+
+    def on_entry(self, entry):
+        # Restituisce True se la voce è stata presa in carico (unita o in attesa del suo evento)
+        if entry.action not in AUDIT_CORRELATED_ACTIONS:
+            return False
+        key = audit_key(entry.guild.id, entry.action, audit_target_id(entry))
+        previous = self.entries.get(key)
+        if previous is not None:
+            # Due modifiche ravvicinate allo stesso target: la voce precedente scade subito
+            previous[2].cancel()
+            self._expire_entry(key)
+        pending = self.events.pop(key, None)
+        # Se la voce precedente era già stata unita, l'evento di questa può averla usata al suo posto:
+        # conta come reclamata, così non produce un secondo log nel canale audit
+        claimed = pending is not None or (previous is not None and previous[1])
+        if pending is not None:
+            pending[1].cancel()
+            for guild, log_type, embed, file in pending[0]:
+                merge_audit_entry(embed, entry)
+                enqueue_log(guild, audit_log_type(guild, log_type, entry), embed, file)
+        # Resta in cache anche se già unita: altri eventi con la stessa chiave possono arrivare dopo
+        timer = asyncio.get_running_loop().call_later(self.window, self._expire_entry, key)
+        self.entries[key] = [entry, claimed, timer]
+        return True
+
+    def _expire_events(self, key):
+        pending = self.events.pop(key, None)
+        if pending is not None:
+            for guild, log_type, embed, file in pending[0]:
+                enqueue_log(guild, log_type, embed, file)
+
+    def _expire_entry(self, key):
+        cached = self.entries.pop(key, None)
+        if cached is not None and not cached[1]:
+            entry = cached[0]
+            log_type = audit_log_type(entry.guild, "audit", entry)
+            if log_type != "audit" and is_filtered(entry.guild, log_type, entry.target, None, None):
+                return
+            enqueue_log(entry.guild, log_type, audit_entry_embed(entry))
+
+    def flush(self):
+        # Alla chiusura nulla resta in attesa: tutto viene accodato subito
+        for key in list(self.events):
+            self.events[key][1].cancel()
+            self._expire_events(key)
+        for key in list(self.entries):
+            self.entries[key][2].cancel()
+            self._expire_entry(key)
+
+audit_correlator = AuditCorrelator()
+
+async def audit_on_entry_create(entry):
+    if audit_correlator.on_entry(entry):
+        return
+    await send_log(entry.guild, "audit", audit_entry_embed(entry))
+
+bot.add_listener(audit_on_entry_create, "on_audit_log_entry_create")
+
+# ========== REGISTRO EVENTI ==========
+
+# Ogni voce descrive un log: l'handler viene generato e l'embed costruito solo se il server ha
+# quel tipo di log configurato (e skip non scarta l'evento).
+# Per aggiungere un log basta una voce qui (più il canale in DEFAULT_LOG_CHANNELS).
+# digest, se presente, estrae il record compatto usato dai riepiloghi durante i picchi (vedi BurstAggregator).
+# audit, se presente, è (azione, id target): il log attende la voce di audit corrispondente (vedi AuditCorrelator).
+# subject, se presente, estrae (utente, id canale, testo) su cui si applicano i filtri del server (vedi GuildFilter).
+EventSpec = namedtuple(
+    "EventSpec",
+    ["event", "log_type", "title", "color", "guild", "description", "fields", "author", "thumbnail", "skip", "digest", "audit", "subject"],
+    defaults=((), None, None, None, None, None, None)
+)
+
+def user_mention(user):
+    return user.mention if hasattr(user, "mention") else str(user)
+
+def user_avatar(user):
+    return user.display_avatar.url if hasattr(user, "display_avatar") else None
+
+def boost_changed(before, after):
+    return before.premium_since != after.premium_since
+
+EVENT_SPECS = [
+    # Log messaggi inviati
+    EventSpec(
+        event="on_message",
+        log_type="messaggi",
+        title="💬 Nuovo messaggio",
+        color=Color.blue(),
+        guild=lambda message: message.guild,
+        skip=lambda message: message.author.bot,
+        description=lambda message: f"**{message.author.mention}** ha inviato un messaggio in {message.channel.mention}",
+        fields=(
+            ("Contenuto", lambda message: message.content[:1024] if message.content else "*Nessun testo*", False),
+            ("ID Utente", lambda message: str(message.author.id), True),
+            ("ID Messaggio", lambda message: str(message.id), True)
+        ),
+        author=lambda message: (str(message.author), message.author.display_avatar.url),
+        subject=lambda message: (message.author, message.channel.id, message.content),
+        digest=lambda message: {
+            "author_id": message.author.id,
+            "author": str(message.author),
+            "channel_id": message.channel.id,
+            "content": message.content[:200],
+            "created_at": message.created_at.isoformat()
+        }
+    ),
+    # Log join/leave
+    EventSpec(
+        event="on_member_join",
+        log_type="join_leave",
+        title="👋 Utente entrato",
+        color=Color.green(),
+        guild=lambda member: member.guild,
+        description=lambda member: f"{member.mention} è entrato nel server.",
+        fields=(
+            ("ID Utente", lambda member: str(member.id), True),
+            ("Account creato", lambda member: member.created_at.strftime('%d/%m/%Y %H:%M'), True)
+        ),
+        author=lambda member: (str(member), member.display_avatar.url),
+        subject=lambda member: (member, None, None),
+        digest=lambda member: {
+            "user_id": member.id,
+            "user": str(member),
+            "account_created": member.created_at.isoformat(),
+            "account_age_days": (discord.utils.utcnow() - member.created_at).days
+        }
+    ),
+    # Evento raw: arriva anche se il membro non è in cache (profilo lean)
+    EventSpec(
+        event="on_raw_member_remove",
+        log_type="join_leave",
+        title="👋 Utente uscito",
+        color=Color.red(),
+        guild=lambda payload: bot.get_guild(payload.guild_id),
+        description=lambda payload: f"{payload.user.mention} ha lasciato il server.",
+        fields=(
+            ("ID Utente", lambda payload: str(payload.user.id), True),
+            ("Account creato", lambda payload: payload.user.created_at.strftime('%d/%m/%Y %H:%M'), True)
+        ),
+        author=lambda payload: (str(payload.user), payload.user.display_avatar.url),
+        subject=lambda payload: (payload.user, None, None),
+        audit=(discord.AuditLogAction.kick, lambda payload: payload.user.id)
+    ),
+    # Log ban/unban
+    EventSpec(
+        event="on_member_ban",
+        log_type="ban_unban",
+        title="🔨 Utente bannato",
+        color=Color.red(),
+        guild=lambda guild, user: guild,
+        description=lambda guild, user: f"{user_mention(user)} è stato **bannato**.",
+        fields=(
+            ("ID Utente", lambda guild, user: str(user.id), True),
+        ),
+        author=lambda guild, user: (str(user), user_avatar(user)),
+        subject=lambda guild, user: (user, None, None),
+        audit=(discord.AuditLogAction.ban, lambda guild, user: user.id)
+    ),
+    EventSpec(
+        event="on_member_unban",
+        log_type="ban_unban",
+        title="🔨 Utente sbannato",
+        color=Color.green(),
+        guild=lambda guild, user: guild,
+        description=lambda guild, user: f"{user_mention(user)} è stato **sbannato**.",
+        fields=(
+            ("ID Utente", lambda guild, user: str(user.id), True),
+        ),
+        author=lambda guild, user: (str(user), user_avatar(user)),
+        subject=lambda guild, user: (user, None, None),
+        audit=(discord.AuditLogAction.unban, lambda guild, user: user.id)
+    ),
+    # Log ruoli creati/eliminati
+    EventSpec(
+        event="on_guild_role_create",
+        log_type="ruoli",
+        title="🎭 Ruolo creato",
+        color=Color.green(),
+        guild=lambda role: role.guild,
+        description=lambda role: f"Ruolo `{role.name}` creato.",
+        fields=(
+            ("ID Ruolo", lambda role: str(role.id), True),
+        ),
+        audit=(discord.AuditLogAction.role_create, lambda role: role.id)
+    ),
+    EventSpec(
+        event="on_guild_role_delete",
+        log_type="ruoli",
+        title="🎭 Ruolo eliminato",
+        color=Color.red(),
+        guild=lambda role: role.guild,
+        description=lambda role: f"Ruolo `{role.name}` eliminato.",
+        fields=(
+            ("ID Ruolo", lambda role: str(role.id), True),
+        ),
+        audit=(discord.AuditLogAction.role_delete, lambda role: role.id)
+    ),
+    # Log canali creati/eliminati
+    EventSpec(
+        event="on_guild_channel_create",
+        log_type="canali",
+        title="📁 Canale creato",
+        color=Color.green(),
+        guild=lambda channel: channel.guild,
+        description=lambda channel: f"Canale `{channel.name}` creato ({str(channel.type)})",
+        fields=(
+            ("ID Canale", lambda channel: str(channel.id), True),
+        ),
+        subject=lambda channel: (None, channel.id, None),
+        audit=(discord.AuditLogAction.channel_create, lambda channel: channel.id)
+    ),
+    EventSpec(
+        event="on_guild_channel_delete",
+        log_type="canali",
+        title="📁 Canale eliminato",
+        color=Color.red(),
+        guild=lambda channel: channel.guild,
+        description=lambda channel: f"Canale `{channel.name}` eliminato ({str(channel.type)})",
+        fields=(
+            ("ID Canale", lambda channel: str(channel.id), True),
+        ),
+        subject=lambda channel: (None, channel.id, None),
+        audit=(discord.AuditLogAction.channel_delete, lambda channel: channel.id)
+    ),
+    # Log boost
+    EventSpec(
+        event="on_member_update",
+        log_type="boost",
+        title="🚀 Boost ricevuto",
+        color=Color.purple(),
+        guild=lambda before, after: after.guild,
+        skip=lambda before, after: not boost_changed(before, after) or not after.premium_since,
+        description=lambda before, after: f"{after.mention} ha boostato il server!",
+        fields=(
+            ("ID Utente", lambda before, after: str(after.id), True),
+        ),
+        subject=lambda before, after: (after, None, None)
+    ),
+    EventSpec(
+        event="on_member_update",
+        log_type="boost",
+        title="🚀 Boost rimosso",
+        color=Color.red(),
+        guild=lambda before, after: after.guild,
+        skip=lambda before, after: not boost_changed(before, after) or after.premium_since,
+        description=lambda before, after: f"{after.mention} ha rimosso il boost dal server.",
+        fields=(
+            ("ID Utente", lambda before, after: str(after.id), True),
+        ),
+        subject=lambda before, after: (after, None, None)
+    ),
+    # Log inviti
+    EventSpec(
+        event="on_invite_create",
+        log_type="inviti",
+        title="🔗 Invito creato",
+        color=Color.green(),
+        guild=lambda invite: invite.guild,
+        description=lambda invite: f"Invito creato da {invite.inviter.mention if invite.inviter else 'N/A'} per {invite.channel.mention}",
+        fields=(
+            ("Codice", lambda invite: invite.code, True),
+            ("Scadenza", lambda invite: str(invite.max_age) if invite.max_age else "Mai", True)
+        ),
+        subject=lambda invite: (invite.inviter, invite.channel.id if invite.channel else None, None)
+    ),
+    EventSpec(
+        event="on_invite_delete",
+        log_type="inviti",
+        title="🔗 Invito eliminato",
+        color=Color.red(),
+        guild=lambda invite: invite.guild,
+        description=lambda invite: f"Invito eliminato per {invite.channel.mention}",
+        fields=(
+            ("Codice", lambda invite: invite.code, True),
+        ),
+        subject=lambda invite: (None, invite.channel.id if invite.channel else None, None)
+    ),
+    # Log webhook
+    EventSpec(
+        event="on_webhooks_update",
+        log_type="webhook",
+        title="🌐 Webhook aggiornato",
+        color=Color.blurple(),
+        guild=lambda channel: channel.guild,
+        description=lambda channel: f"Webhook aggiornato nel canale {channel.mention}",
+        fields=(
+            ("ID Canale", lambda channel: str(channel.id), True),
+        ),
+        subject=lambda channel: (None, channel.id, None)
+    ),
+    # Log integrazioni
+    EventSpec(
+        event="on_guild_integrations_update",
+        log_type="integrazioni",
+        title="🔌 Integrazioni aggiornate",
+        color=Color.blurple(),
+        guild=lambda guild: guild,
+        description=lambda guild: "Le integrazioni del server sono state aggiornate."
+    ),
+    # Log thread
+    EventSpec(
+        event="on_thread_create",
+        log_type="thread",
+        title="🧵 Thread creato",
+        color=Color.green(),
+        guild=lambda thread: thread.guild,
+        description=lambda thread: f"Thread `{thread.name}` creato in {thread.parent.mention if thread.parent else 'N/A'}",
+        fields=(
+            ("ID Thread", lambda thread: str(thread.id), True),
+        ),
+        subject=lambda thread: (thread.owner, thread.parent_id, None),
+        audit=(discord.AuditLogAction.thread_create, lambda thread: thread.id)
+    ),
+    EventSpec(
+        event="on_thread_delete",
+        log_type="thread",
+        title="🧵 Thread eliminato",
+        color=Color.red(),
+        guild=lambda thread: thread.guild,
+        description=lambda thread: f"Thread `{thread.name}` eliminato.",
+        fields=(
+            ("ID Thread", lambda thread: str(thread.id), True),
+        ),
+        subject=lambda thread: (thread.owner, thread.parent_id, None),
+        audit=(discord.AuditLogAction.thread_delete, lambda thread: thread.id)
+    ),
+    # Log stage
+    EventSpec(
+        event="on_stage_instance_create",
+        log_type="stage",
+        title="🎤 Stage creato",
+        color=Color.green(),
+        guild=lambda stage_instance: stage_instance.guild,
+        description=lambda stage_instance: f"Stage `{stage_instance.topic}` creato in {stage_instance.channel.mention}",
+        audit=(discord.AuditLogAction.stage_instance_create, lambda stage_instance: stage_instance.id)
+    ),
+    EventSpec(
+        event="on_stage_instance_delete",
+        log_type="stage",
+        title="🎤 Stage eliminato",
+        color=Color.red(),
+        guild=lambda stage_instance: stage_instance.guild,
+        description=lambda stage_instance: f"Stage `{stage_instance.topic}` eliminato in {stage_instance.channel.mention}",
+        audit=(discord.AuditLogAction.stage_instance_delete, lambda stage_instance: stage_instance.id)
+    ),
+    # Log eventi programmati
+    EventSpec(
+        event="on_scheduled_event_create",
+        log_type="scheduled_events",
+        title="📅 Evento programmato creato",
+        color=Color.green(),
+        guild=lambda event: event.guild,
+        description=lambda event: f"Evento `{event.name}` creato.",
+        fields=(
+            ("ID Evento", lambda event: str(event.id), True),
+        ),
+        audit=(discord.AuditLogAction.scheduled_event_create, lambda event: event.id)
+    ),
+    EventSpec(
+        event="on_scheduled_event_delete",
+        log_type="scheduled_events",
+        title="📅 Evento programmato eliminato",
+        color=Color.red(),
+        guild=lambda event: event.guild,
+        description=lambda event: f"Evento `{event.name}` eliminato.",
+        fields=(
+            ("ID Evento", lambda event: str(event.id), True),
+        ),
+        audit=(discord.AuditLogAction.scheduled_event_delete, lambda event: event.id)
+    )
+]
+
+def make_spec_handler(spec):
+    # Le parti statiche (indice di routing, colore, footer) sono risolte una volta sola
+    route_index = LOG_TYPE_INDEX[spec.log_type]
+    log_type = spec.log_type
+    title = spec.title
+    colour = spec.color
+    guild_of = spec.guild
+    skip = spec.skip
+    describe = spec.description
+    fields = spec.fields
+    author_of = spec.author
+    thumbnail_of = spec.thumbnail
+    # I tipi scritti solo su file non vengono riassunti nei digest: su disco resta ogni evento
+    digest = spec.digest if spec.log_type not in LOG_FILE_ONLY_TYPES else None
+    audit_action, audit_target = spec.audit or (None, None)
+    subject = spec.subject
+    metric_labels = (("log_type", log_type),)
+
+    async def handler(*args):
+        guild = guild_of(*args)
+        if guild is None:
+            return
+        routes = log_routes.get(guild.id)
+        if routes is None or routes[route_index] is None:
+            return
+        if skip is not None and skip(*args):
+            return
+        if subject is not None:
+            rules = guild_filters.get(guild.id)
+            if rules is not None and rules.rejects(*subject(*args)):
+                metrics.inc("logbot_filtered_total", metric_labels)
+                return
+        if digest is not None and burst_aggregator.intercept(guild, log_type, digest, args):
+            return
+        start = time.perf_counter()
+        embed = Embed(title=title, description=describe(*args), colour=colour, timestamp=discord.utils.utcnow())
+        for name, value, inline in fields:
+            embed.add_field(name=name, value=value(*args), inline=inline)
+        if author_of is not None:
+            name, icon_url = author_of(*args)
+            embed.set_author(name=name, icon_url=icon_url)
+        if thumbnail_of is not None:
+            thumbnail = thumbnail_of(*args)
+            if thumbnail:
+                embed.set_thumbnail(url=thumbnail)
+        embed.set_footer(text=LOG_FOOTER)
+        metrics.observe("logbot_embed_build_seconds", metric_labels, time.perf_counter() - start)
+        if audit_action is not None:
+            audit_correlator.submit(guild, log_type, embed, audit_action, audit_target(*args))
+            return
+        await send_log(guild, log_type, embed)
+
+    handler.__name__ = f"{spec.event}_{log_type}"
+    return handler
+
+def register_event_specs():
+    for spec in EVENT_SPECS:
+        bot.add_listener(make_spec_handler(spec), spec.event)
+
+register_event_specs()
+
+# ========== DIGEST DEI PICCHI ==========
+
+class BurstWindow:
+    # Conteggio a finestra scorrevole con bucket da un secondo: memoria costante anche durante un raid
+    __slots__ = ("buckets", "total", "bursting", "records", "dropped", "started")
+
+    def __init__(self):
+        self.buckets = deque()  # [secondo, eventi]
+        self.total = 0
+        self.bursting = False
+        self.records = []
+        self.dropped = 0
+        self.started = 0.0
+
+    def count(self, now, window):
+        while self.buckets and self.buckets[0][0] <= now - window:
+            self.total -= self.buckets.popleft()[1]
+        return self.total
+
+    def hit(self, now, window):
+        if self.buckets and self.buckets[-1][0] == now:
+            self.buckets[-1][1] += 1
+        else:
+            self.buckets.append([now, 1])
+        self.total += 1
+        return self.count(now, window)
+
+def summarize_messages(records):
+    authors = Counter(record["author_id"] for record in records)
+    channels = Counter(record["channel_id"] for record in records)
+    return [
+        ("Messaggi", str(len(records)), True),
+        ("Autori unici", str(len(authors)), True),
+        ("Autori principali", "\n".join(f"<@{user_id}>: {count}" for user_id, count in authors.most_common(5)), False),
+        ("Canali principali", "\n".join(f"<#{channel_id}>: {count}" for channel_id, count in channels.most_common(5)), False)
+    ]
+
+def summarize_joins(records):
+    ages = Counter()
+    for record in records:
+        days = record["account_age_days"]
+        if days < 1:
+            ages["meno di 1 giorno"] += 1
+        elif days < 7:
+            ages["1-7 giorni"] += 1
+        elif days < 30:
+            ages["7-30 giorni"] += 1
+        else:
+            ages["oltre 30 giorni"] += 1
+    newest = sorted(records, key=lambda record: record["account_age_days"])[:5]
+    return [
+        ("Ingressi", str(len(records)), True),
+        ("Età account", "\n".join(f"{label}: {count}" for label, count in ages.most_common()), False),
+        ("Account più recenti", "\n".join(f"<@{record['user_id']}> ({record['account_age_days']} giorni)" for record in newest), False)
+    ]
+
+# log_type -> (titolo, funzione che riassume i record in campi dell'embed)
+BURST_DIGESTS = {
+    "messaggi": ("📊 Digest messaggi", summarize_messages),
+    "join_leave": ("📊 Digest ingressi", summarize_joins)
+}
+
+class BurstAggregator:
+    def __init__(self):
+        self.windows = {}  # (guild_id, log_type) -> BurstWindow
+
+    def thresholds(self, guild_id, log_type):
+        # Soglie per server (/log_burst) o predefinite: (eventi, secondi)
+        custom = logs_settings.get(str(guild_id), {}).get("burst", {}).get(log_type)
+        return tuple(custom) if custom else BURST_DEFAULTS[log_type]
+
+    def intercept(self, guild, log_type, digest, args):
+        # True se l'evento è stato assorbito in un digest e non va loggato singolarmente
+        threshold, window = self.thresholds(guild.id, log_type)
+        if threshold <= 0:
+            return False
+        key = (guild.id, log_type)
+        state = self.windows.get(key)
+        if state is None:
+            state = self.windows[key] = BurstWindow()
+        count = state.hit(int(time.monotonic()), window)
+        if not state.bursting:
+            if count < threshold:
+                return False
+            state.bursting = True
+            state.started = time.time()
+            asyncio.create_task(self._digest_loop(guild, log_type, state))
+        if len(state.records) < BURST_DIGEST_MAX_RECORDS:
+            state.records.append(digest(*args))
+        else:
+            state.dropped += 1
+        return True
+
+    async def _digest_loop(self, guild, log_type, state):
+        try:
+            while True:
+                await asyncio.sleep(BURST_DIGEST_INTERVAL)
+                records, state.records = state.records, []
+                dropped, state.dropped = state.dropped, 0
+                period_start, state.started = state.started, time.time()
+                if records:
+                    await self._send_digest(guild, log_type, records, dropped, period_start)
+                # Isteresi: si torna ai log singoli solo quando il ritmo scende sotto metà soglia
+                threshold, window = self.thresholds(guild.id, log_type)
+                if state.count(int(time.monotonic()), window) < threshold * BURST_EXIT_RATIO:
+                    break
+        finally:
+            state.bursting = False
+
+    async def _send_digest(self, guild, log_type, records, dropped, period_start):
+        title, summarize = BURST_DIGESTS[log_type]
+        seconds = int(time.time() - period_start)
+        fields = [(name, value[:1024] or "-", inline) for name, value, inline in summarize(records)]
+        if dropped:
+            fields.append(("Non inclusi nel file", str(dropped), True))
+        embed = log_embed(
+            title=title,
+            description=f"Picco di attività: {len(records)} eventi negli ultimi {seconds}s. Dettaglio completo nel file allegato.",
+            color=Color.gold(),
+            fields=fields,
+            timestamp=True
+        )
+        detail = "\n".join(json.dumps(record, ensure_ascii=False) for record in records).encode("utf-8")
+        file = LogFile(f"digest-{log_type}-{int(period_start)}.jsonl", detail)
+        await send_log(guild, log_type, embed, file=file)
+
+burst_aggregator = BurstAggregator()
+
+@bot.tree.command(name="log_burst", description="Configura la soglia oltre cui i log vengono raccolti in digest.")
+@app_commands.describe(
+    tipo="Tipo di log",
+    soglia="Numero di eventi nella finestra che attiva il digest (0 = mai)",
+    finestra="Durata della finestra in secondi"
+)
+@app_commands.choices(tipo=[app_commands.Choice(name=log_type, value=log_type) for log_type in BURST_DIGESTS])
+@app_commands.checks.has_permissions(administrator=True)
+async def log_burst(interaction: Interaction, tipo: str, soglia: app_commands.Range[int, 0, 100000],
+                    finestra: app_commands.Range[int, 5, 3600]):
+    guild = interaction.guild
+    if guild is None:
+        await interaction.response.send_message("> ❌ **Questo comando può essere usato solo in un server.**", ephemeral=True)
+        return
+    logs_settings.setdefault(str(guild.id), {}).setdefault("burst", {})[tipo] = [soglia, finestra]
+    config_store.schedule_save(guild.id)
+    if soglia:
+        text = f"> ✅ Digest `{tipo}` attivo oltre **{soglia}** eventi in **{finestra}s**."
+    else:
+        text = f"> ✅ Digest `{tipo}` disattivato."
+    await interaction.response.send_message(text, ephemeral=True)
+
+# ========== SESSIONI VOCALI ==========
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+class VoiceSession:
+    __slots__ = ("member_id", "member", "started", "path", "entered", "changes", "seeded")
+
+    def __init__(self, member_id, member, channel_id, now, seeded=False):
+        self.member_id = member_id
+        self.member = member
+        self.started = now
+        self.path = [channel_id]   # canali attraversati, in ordine
+        self.entered = now         # ingresso nel canale corrente
+        self.changes = 0           # mute/deaf/stream/video durante la sessione
+        self.seeded = seeded       # già in vocale all'avvio del bot: inizio non noto
+
+class VoiceChannelStats:
+    __slots__ = ("users", "sessions", "seconds", "current", "peak")
+
+    def __init__(self):
+        self.users = set()
+        self.sessions = 0
+        self.seconds = 0.0
+        self.current = 0
+        self.peak = 0
+
+class VoiceTracker:
+    # Ogni evento aggiorna solo lo stato in memoria; i log partono a intervalli regolari
+    def __init__(self):
+        self.sessions = {}   # (guild_id, member_id) -> VoiceSession aperta
+        self.finished = {}   # guild_id -> [record di sessione da inviare]
+        self.stats = {}      # guild_id -> {channel_id: VoiceChannelStats} del periodo in corso
+        self.summary_at = {} # guild_id -> inizio del periodo di riepilogo
+        self.task = None
+
+    def _channel_stats(self, guild_id, channel_id):
+        channels = self.stats.setdefault(guild_id, {})
+        stats = channels.get(channel_id)
+        if stats is None:
+            stats = channels[channel_id] = VoiceChannelStats()
+        return stats
+
+    def _enter(self, guild_id, channel_id, member_id, now, new_session=True):
+        stats = self._channel_stats(guild_id, channel_id)
+        stats.users.add(member_id)
+        stats.sessions += new_session
+        stats.current += 1
+        stats.peak = max(stats.peak, stats.current)
+        self.summary_at.setdefault(guild_id, now)
+
+    def _leave(self, guild_id, session, now):
+        stats = self._channel_stats(guild_id, session.path[-1])
+        stats.seconds += now - session.entered
+        stats.current = max(0, stats.current - 1)
+
+    def seed(self, guild):
+        # Membri già in vocale quando il server diventa disponibile
+        now = time.time()
+        for channel in guild.voice_channels + guild.stage_channels:
+            for member_id in channel.voice_states:
+                key = (guild.id, member_id)
+                if key not in self.sessions:
+                    member = guild.get_member(member_id)
+                    self.sessions[key] = VoiceSession(member_id, str(member) if member else None, channel.id, now, seeded=True)
+                    self._enter(guild.id, channel.id, member_id, now)
+        self._ensure_task()
+
+    def update(self, member, before, after):
+        guild_id = member.guild.id
+        key = (guild_id, member.id)
+        now = time.time()
+        session = self.sessions.get(key)
+        if after.channel is not None and (session is None or before.channel is None):
+            # Ingresso (o sessione persa, ad esempio per un evento mancato: si riparte da qui)
+            if session is not None:
+                self._close(guild_id, key, session, now)
+            self.sessions[key] = VoiceSession(member.id, str(member), after.channel.id, now)
+            self._enter(guild_id, after.channel.id, member.id, now)
+        elif session is None:
+            return
+        elif after.channel is None:
+            self._close(guild_id, key, session, now)
+        elif before.channel is not None and before.channel.id != after.channel.id:
+            self._leave(guild_id, session, now)
+            session.path.append(after.channel.id)
+            session.entered = now
+            self._enter(guild_id, after.channel.id, member.id, now)
+        else:
+            session.changes += 1
+        self._ensure_task()
+
+    def _close(self, guild_id, key, session, now):
+        self._leave(guild_id, session, now)
+        del self.sessions[key]
+        self.finished.setdefault(guild_id, []).append({
+            "user_id": session.member_id,
+            "user": session.member,
+            "joined": None if session.seeded else int(session.started),
+            "left": int(now),
+            "channels": session.path,
+            "duration": int(now - session.started),
+            "state_changes": session.changes
+        })
+
+    def _ensure_task(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+
+    async def _loop(self):
+        try:
+            while self.finished or self.sessions or self.summary_at:
+                await asyncio.sleep(VOICE_FLUSH_INTERVAL)
+                await self.flush()
+        finally:
+            self.task = None
+
+    async def flush(self, final=False):
+        finished, self.finished = self.finished, {}
+        for guild_id, records in finished.items():
+            guild = bot.get_guild(guild_id)
+            if guild is not None:
+                await send_log(guild, "voice", voice_sessions_embed(records), file=voice_sessions_file(records))
+        now = time.time()
+        for guild_id, started in list(self.summary_at.items()):
+            if not final and now - started < VOICE_SUMMARY_INTERVAL:
+                continue
+            del self.summary_at[guild_id]
+            channels = self.stats.pop(guild_id, {})
+            guild = bot.get_guild(guild_id)
+            # Chi è ancora in vocale resta conteggiato nel periodo successivo
+            for (session_guild, member_id), session in self.sessions.items():
+                if session_guild == guild_id:
+                    stats = channels.get(session.path[-1])
+                    if stats is not None:
+                        stats.seconds += now - session.entered
+                    session.entered = now
+                    self._enter(guild_id, session.path[-1], member_id, now, new_session=False)
+            if guild is not None and channels:
+                await send_log(guild, "voice", voice_summary_embed(channels, now - started))
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        await self.flush(final=True)
+
+def voice_sessions_embed(records):
+    lines = []
+    for record in records[:VOICE_RECORDS_PER_EMBED]:
+        path = " → ".join(f"<#{channel_id}>" for channel_id in record["channels"])
+        start = f"<t:{record['joined']}:t>" if record["joined"] else "prima dell'avvio"
+        lines.append(f"<@{record['user_id']}> · {path} · {start}–<t:{record['left']}:t> · {format_duration(record['duration'])}")
+    if len(records) > VOICE_RECORDS_PER_EMBED:
+        lines.append(f"… altre {len(records) - VOICE_RECORDS_PER_EMBED} sessioni nel file allegato")
+    return log_embed(
+        title="🔊 Sessioni vocali concluse",
+        description="\n".join(lines)[:4096],
+        color=Color.teal(),
+        fields=[
+            ("Sessioni", str(len(records)), True),
+            ("Durata totale", format_duration(sum(record["duration"] for record in records)), True)
+        ],
+        timestamp=True
+    )
+
+def voice_sessions_file(records):
+    if len(records) <= VOICE_RECORDS_PER_EMBED:
+        return None
+    detail = "\n".join(json.dumps(record, ensure_ascii=False) for record in records).encode("utf-8")
+    return LogFile(f"voice-sessions-{records[0]['left']}.jsonl", detail)
+
+def voice_summary_embed(channels, seconds):
+    ranked = sorted(channels.items(), key=lambda item: item[1].seconds, reverse=True)
+    fields = [
+        (str(bot.get_channel(channel_id) or channel_id),
+         f"<#{channel_id}>\n{len(stats.users)} utenti · {stats.sessions} ingressi\n"
+         f"{format_duration(stats.seconds)} totali · picco {stats.peak}", True)
+        for channel_id, stats in ranked[:24]
+    ]
+    return log_embed(
+        title="📊 Riepilogo attività vocale",
+        description=f"Attività nei canali vocali nell'ultimo periodo ({format_duration(seconds)}).",
+        color=Color.teal(),
+        fields=fields,
+        timestamp=True
+    )
+
+voice_tracker = VoiceTracker()
+
+async def voice_on_state_update(member, before, after):
+    # Solo utenti e ruoli: ignorare un canale a metà sessione lascerebbe sessioni aperte
+    if has_log(member.guild, "voice") and not is_filtered(member.guild, "voice", member, None, None):
+        voice_tracker.update(member, before, after)
+
+async def voice_on_guild_ready(guild):
+    if has_log(guild, "voice"):
+        voice_tracker.seed(guild)
+
+bot.add_listener(voice_on_state_update, "on_voice_state_update")
+bot.add_listener(voice_on_guild_ready, "on_guild_available")
+bot.add_listener(voice_on_guild_ready, "on_guild_join")
+
+# ========== RICERCA NEI LOG ==========
+
+USER_MENTION = re.compile(r"<@!?(\d+)>")
+CHANNEL_MENTION = re.compile(r"<#(\d+)>")
+
+def index_row(guild_id, log_type, embed, created_at):
+    # Utente e canale vengono dai campi "ID Utente"/"ID Canale" o dalla prima menzione nella descrizione
+    description = embed.description or ""
+    user_id = channel_id = None
+    text = [description]
+    for field in embed.fields:
+        name, value = field.name or "", field.value or ""
+        if name == "ID Utente" and value.isdigit():
+            user_id = int(value)
+        elif name == "ID Canale" and value.isdigit():
+            channel_id = int(value)
+        text.append(f"{name}: {value}")
+    if user_id is None:
+        match = USER_MENTION.search(description)
+        user_id = int(match.group(1)) if match else None
+    if channel_id is None:
+        match = CHANNEL_MENTION.search(description)
+        channel_id = int(match.group(1)) if match else None
+    return (guild_id, log_type, user_id, channel_id, created_at, embed.title or "", description, "\n".join(text))
+
+class LogIndex:
+    # Scritture a batch in un thread separato; le ricerche usano una connessione di sola lettura
+    def __init__(self, path=LOG_INDEX_FILE, delay=LOG_INDEX_FLUSH_DELAY, flush_size=LOG_INDEX_FLUSH_SIZE,
+                 retention_days=LOG_INDEX_RETENTION_DAYS):
+        self.path = path
+        self.delay = delay
+        self.flush_size = flush_size
+        self.retention = retention_days * 86400
+        self.conn = None
+        self.reader = None
+        self.pending = []   # (guild_id, log_type, embed, timestamp) non ancora indicizzati
+        self.flush_task = None
+        self.size_flush = None   # flush per dimensione in corso: al massimo uno alla volta
+        self.write_lock = asyncio.Lock()
+        self.pruned_at = 0.0
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS log_events ("
+            "id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, log_type TEXT NOT NULL, "
+            "user_id INTEGER, channel_id INTEGER, created_at REAL NOT NULL, title TEXT NOT NULL, description TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS log_events_type ON log_events (guild_id, log_type, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS log_events_user ON log_events (guild_id, user_id, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS log_events_time ON log_events (guild_id, created_at)")
+        # Testo completo (titolo, descrizione e campi) in FTS5, con lo stesso rowid di log_events
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS log_events_fts USING fts5("
+            "text, tokenize='unicode61 remove_diacritics 2')"
+        )
+        self.conn.commit()
+        self.reader = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def add(self, guild_id, log_type, embed):
+        self.pending.append((guild_id, log_type, embed, time.time()))
+        # Durante una scrittura lenta gli eventi successivi aspettano il flush ritardato, senza altri task
+        if len(self.pending) >= self.flush_size and self.size_flush is None:
+            self.size_flush = asyncio.create_task(self._flush_now())
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_now(self):
+        try:
+            await self.flush()
+        finally:
+            self.size_flush = None
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.delay)
+            await self.flush()
+        finally:
+            self.flush_task = None
+
+    async def flush(self):
+        async with self.write_lock:
+            if not self.pending:
+                return
+            batch = self.pending
+            self.pending = []
+            prune = time.time() - self.pruned_at > 3600
+            # Una scrittura già avviata nel thread si completa anche se il flush viene annullato:
+            # il lock resta preso fino alla fine, così la connessione non viene usata da due thread
+            write = asyncio.ensure_future(asyncio.to_thread(self._write_batch, batch, prune))
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                await asyncio.gather(write, return_exceptions=True)
+                raise
+            except Exception as e:
+                ops_log(f"❌ Errore scrittura indice log: {e}")
+                return
+            if prune:
+                self.pruned_at = time.time()
+
+    def _write_batch(self, batch, prune):
+        rows = [index_row(*item) for item in batch]
+        with self.conn:
+            for row in rows:
+                rowid = self.conn.execute(
+                    "INSERT INTO log_events (guild_id, log_type, user_id, channel_id, created_at, title, description) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", row[:7]
+                ).lastrowid
+                self.conn.execute("INSERT INTO log_events_fts (rowid, text) VALUES (?, ?)", (rowid, row[7]))
+            if prune:
+                limit = time.time() - self.retention
+                self.conn.execute(
+                    "DELETE FROM log_events_fts WHERE rowid IN (SELECT id FROM log_events WHERE created_at < ?)", (limit,)
+                )
+                self.conn.execute("DELETE FROM log_events WHERE created_at < ?", (limit,))
+
+    def _query(self, guild_id, since, log_type, user_id, channel_id, text):
+        sql = " FROM log_events WHERE guild_id = ? AND created_at >= ?"
+        params = [guild_id, since]
+        if log_type:
+            sql += " AND log_type = ?"
+            params.append(log_type)
+        if user_id:
+            sql += " AND user_id = ?"
+            params.append(user_id)
+        if channel_id:
+            sql += " AND channel_id = ?"
+            params.append(channel_id)
+        if text:
+            # Ogni parola diventa un termine tra virgolette: la sintassi FTS dell'utente non viene interpretata
+            terms = " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+            sql += " AND id IN (SELECT rowid FROM log_events_fts WHERE log_events_fts MATCH ?)"
+            params.append(terms)
+        return sql, params
+
+    def _search(self, query, page):
+        sql, params = self._query(*query)
+        total = self.reader.execute("SELECT COUNT(*)" + sql, params).fetchone()[0]
+        rows = self.reader.execute(
+            "SELECT created_at, log_type, title, description, user_id" + sql + " ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            params + [SEARCH_PAGE_SIZE, page * SEARCH_PAGE_SIZE]
+        ).fetchall()
+        return total, rows
+
+    async def search(self, query, page=0):
+        # I log ancora in coda vengono scritti prima, così la ricerca li trova
+        await self.flush()
+        return await asyncio.to_thread(self._search, query, page)
+
+    async def close(self):
+        if self.conn is None:
+            return
+        for task in (self.flush_task, self.size_flush):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+        self.reader.close()
+        self.conn.close()
+        self.conn = None
+
+log_index = LogIndex()
+if LOG_INDEX_ENABLED and not IS_CLUSTER_SUPERVISOR:
+    try:
+        log_index.open()
+        log_sinks.append(log_index)
+    except Exception as e:
+        ops_log(f"❌ Errore apertura indice log: {e}")
+        log_index.conn = None
+
+def search_results_embed(query, page, total, rows):
+    pages = max(1, -(-total // SEARCH_PAGE_SIZE))
+    lines = []
+    for created_at, log_type, title, description, user_id in rows:
+        summary = description.replace("\n", " ")
+        if len(summary) > 120:
+            summary = summary[:117] + "..."
+        lines.append(f"<t:{int(created_at)}:R> · `{log_type}` · **{title}**\n{summary}")
+    embed = Embed(
+        title="🔎 Risultati ricerca log",
+        description="\n\n".join(lines) if lines else "*Nessun log trovato.*",
+        color=Color.blurple()
+    )
+    embed.set_footer(text=f"Pagina {page + 1}/{pages} • {total} risultati")
+    return embed
+
+class SearchLogsView(discord.ui.View):
+    def __init__(self, author_id, query, total):
+        super().__init__(timeout=300)
+        self.author_id = author_id
+        self.query = query
+        self.total = total
+        self.page = 0
+        self._update_buttons()
+
+    def _update_buttons(self):
+        self.previous.disabled = self.page == 0
+        self.next.disabled = (self.page + 1) * SEARCH_PAGE_SIZE >= self.total
+
+    async def interaction_check(self, interaction: Interaction):
+        return interaction.user.id == self.author_id
+
+    async def _show(self, interaction):
+        self.total, rows = await log_index.search(self.query, self.page)
+        self._update_buttons()
+        await interaction.response.edit_message(embed=search_results_embed(self.query, self.page, self.total, rows), view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction: Interaction, button: discord.ui.Button):
+        self.page = max(0, self.page - 1)
+        await self._show(interaction)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next(self, interaction: Interaction, button: discord.ui.Button):
+        self.page += 1
+        await self._show(interaction)
+
+async def log_type_autocomplete(interaction: Interaction, current: str):
+    # I tipi di log sono più di 25 (limite delle scelte fisse): si filtrano mentre l'utente scrive
+    current = current.lower()
+    return [
+        app_commands.Choice(name=log_type, value=log_type)
+        for log_type in DEFAULT_LOG_CHANNELS if current in log_type
+    ][:25]
+
+@bot.tree.command(name="search_logs", description="Cerca nei log registrati dal bot.")
+@app_commands.describe(
+    testo="Parole da cercare nel contenuto dei log",
+    utente="Utente coinvolto",
+    tipo="Tipo di log",
+    canale="Canale coinvolto",
+    giorni="Quanti giorni indietro cercare"
+)
+@app_commands.autocomplete(tipo=log_type_autocomplete)
+@app_commands.checks.has_permissions(manage_guild=True)
+async def search_logs(interaction: Interaction, testo: str = None, utente: discord.User = None, tipo: str = None,
+                      canale: discord.abc.GuildChannel = None, giorni: app_commands.Range[int, 1, 365] = 7):
+    guild = interaction.guild
+    if guild is None:
+        await interaction.response.send_message("> ❌ **Questo comando può essere usato solo in un server.**", ephemeral=True)
+        return
+    if log_index.conn is None:
+        await interaction.response.send_message("> ❌ **L'indice di ricerca dei log non è attivo.**", ephemeral=True)
+        return
+    if tipo and tipo not in DEFAULT_LOG_CHANNELS:
+        await interaction.response.send_message(f"> ❌ **Tipo di log sconosciuto:** `{tipo}`", ephemeral=True)
+        return
+    query = (
+        guild.id, time.time() - giorni * 86400, tipo,
+        utente.id if utente else None, canale.id if canale else None, testo
+    )
+    try:
+        total, rows = await log_index.search(query)
+    except sqlite3.Error as e:
+        await interaction.response.send_message(f"> ❌ **Errore nella ricerca:** {e}", ephemeral=True)
+        return
+    view = SearchLogsView(interaction.user.id, query, total) if total > SEARCH_PAGE_SIZE else discord.utils.MISSING
+    await interaction.response.send_message(embed=search_results_embed(query, 0, total, rows), view=view, ephemeral=True)
+
+# ========== LOG SU FILE ==========
+
+class LogFileSink:
+    # Un record JSON per riga. Un thread dedicato serializza, scrive con buffer, ruota i segmenti per
+    # dimensione o età e comprime quelli chiusi: add() è soltanto un put in coda, anche da altri thread
+    def __init__(self, directory, segment_bytes=LOG_FILE_SEGMENT_BYTES, rotate_seconds=LOG_FILE_ROTATE_SECONDS,
+                 compression=LOG_FILE_COMPRESSION, flush_interval=LOG_FILE_FLUSH_INTERVAL):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compression = compression
+        self.flush_interval = flush_interval
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.file = None
+        self.path = None
+        self.size = 0
+        self.opened_at = 0.0
+        self.written = 0
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        if self.compression == "zstd" and zstandard is None:
+            ops_log("❌ zstandard non installato: i segmenti dei log su file verranno compressi con gzip")
+            self.compression = "gzip"
+        self.thread = threading.Thread(target=self._run, name="log-file-sink", daemon=True)
+        self.thread.start()
+        ops_logger.sink = self
+
+    def add(self, guild_id, log_type, embed):
+        self.queue.put((time.time(), guild_id, log_type, embed))
+
+    def add_record(self, record):
+        self.queue.put(record)
+
+    def _line(self, item):
+        if isinstance(item, dict):
+            record = item
+        else:
+            created_at, guild_id, log_type, embed = item
+            row = index_row(guild_id, log_type, embed, created_at)
+            record = {
+                "ts": created_at,
+                "guild_id": guild_id,
+                "log_type": log_type,
+                "user_id": row[2],
+                "channel_id": row[3],
+                "embed": embed.to_dict()
+            }
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+
+    def _run(self):
+        # Segmenti rimasti aperti da un'esecuzione precedente: vengono compressi prima di iniziare.
+        # Le compressioni interrotte (.part) si scartano prima, perché la nuova compressione riusa lo stesso nome
+        names = sorted(os.listdir(self.directory))
+        for name in names:
+            if name.endswith(".part"):
+                os.remove(os.path.join(self.directory, name))
+        for name in names:
+            if name.endswith(".jsonl"):
+                self._compress(os.path.join(self.directory, name))
+        flushed_at = time.monotonic()
+        running = True
+        while running:
+            try:
+                items = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                items = []
+            while items and len(items) < 1000:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in items:
+                running = False
+                items = [item for item in items if item is not None]
+            if items:
+                self._write(items)
+            now = time.monotonic()
+            if self.file is not None and (now - flushed_at >= self.flush_interval or not running):
+                self.file.flush()
+                flushed_at = now
+            if self.file is not None and (not running or self.size >= self.segment_bytes
+                                          or time.time() - self.opened_at >= self.rotate_seconds):
+                self._rotate()
+
+    def _write(self, items):
+        lines = []
+        for item in items:
+            try:
+                lines.append(self._line(item))
+            except Exception as e:
+                ops_log(f"❌ Errore serializzazione log su file: {e}")
+        data = "".join(lines).encode("utf-8")
+        try:
+            if self.file is None:
+                stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+                self.path = os.path.join(self.directory, f"logs-{stamp}-{int(time.time() * 1000) % 1000:03d}.jsonl")
+                self.file = open(self.path, "ab", buffering=1024 * 1024)
+                self.size = 0
+                self.opened_at = time.time()
+            self.file.write(data)
+            self.size += len(data)
+            self.written += len(lines)
+        except OSError as e:
+            ops_log(f"❌ Errore scrittura log su file: {e}")
+
+    def _rotate(self):
+        try:
+            self.file.close()
+            self._compress(self.path)
+        except OSError as e:
+            ops_log(f"❌ Errore rotazione log su file: {e}")
+        self.file = None
+
+    def _compress(self, path):
+        # Il file compresso diventa visibile solo quando è completo; poi il segmento originale viene rimosso
+        target = path + (".zst" if self.compression == "zstd" else ".gz")
+        with open(path, "rb") as source, open(target + ".part", "wb") as raw:
+            if self.compression == "zstd":
+                zstandard.ZstdCompressor(level=6).copy_stream(source, raw)
+            else:
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as out:
+                    shutil.copyfileobj(source, out, 1024 * 1024)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(target + ".part", target)
+        os.remove(path)
+
+    async def close(self):
+        # Scrive quanto resta in coda e comprime il segmento aperto
+        if self.thread is not None:
+            ops_logger.sink = None
+            self.queue.put(None)
+            await asyncio.to_thread(self.thread.join, 60)
+            self.thread = None
+
+log_file_sink = LogFileSink(LOG_FILE_SINK_DIR if LOG_CLUSTER_ID is None else os.path.join(LOG_FILE_SINK_DIR, f"cluster-{LOG_CLUSTER_ID}"))
+if LOG_FILE_SINK_ENABLED and not IS_CLUSTER_SUPERVISOR:
+    try:
+        log_file_sink.open()
+        log_sinks.append(log_file_sink)
+    except Exception as e:
+        ops_log(f"❌ Errore apertura log su file: {e}")
+
+# ========== STATISTICHE DI ATTIVITÀ ==========
+
+# Contatori per server in tre anelli di bucket: 60 minuti, 24 ore, 30 giorni. Ogni slot ricorda il
+# bucket a cui appartiene e viene azzerato quando viene riusato: memoria fissa per server, qualunque sia il traffico
+STAT_KINDS = ("messaggi", "cancellati", "modificati", "entrate", "uscite", "ban", "minuti_voce")
+STAT_MESSAGES, STAT_DELETES, STAT_EDITS, STAT_JOINS, STAT_LEAVES, STAT_BANS, STAT_VOICE_MINUTES = range(len(STAT_KINDS))
+STAT_LABELS = {
+    "messaggi": "💬 Messaggi",
+    "cancellati": "🗑️ Eliminati",
+    "modificati": "✏️ Modificati",
+    "entrate": "👋 Entrate",
+    "uscite": "🚪 Uscite",
+    "ban": "🔨 Ban",
+    "minuti_voce": "🔊 Minuti in voce"
+}
+# periodo -> (offset del primo slot, secondi per bucket, numero di bucket)
+STAT_RINGS = {"ora": (0, 60, 60), "giorno": (60, 3600, 24), "mese": (84, 86400, 30)}
+STAT_SLOTS = 114
+STAT_ZERO_ROW = array("I", bytes(4 * len(STAT_KINDS)))
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+class GuildActivity:
+    __slots__ = ("stamps", "counts")
+
+    def __init__(self, data=None):
+        if data is None:
+            self.stamps = array("q", [-1] * STAT_SLOTS)
+            self.counts = array("I", bytes(4 * STAT_SLOTS * len(STAT_KINDS)))
+            return
+        if len(data) != 8 * STAT_SLOTS + 4 * STAT_SLOTS * len(STAT_KINDS):
+            raise ValueError("dimensione non valida")
+        self.stamps = array("q", data[:8 * STAT_SLOTS])
+        self.counts = array("I", data[8 * STAT_SLOTS:])
+
+    def hit(self, kind, amount, now):
+        width = len(STAT_KINDS)
+        for offset, size, buckets in STAT_RINGS.values():
+            bucket = now // size
+            slot = offset + bucket % buckets
+            stamp = self.stamps[slot]
+            if stamp != bucket:
+                if stamp > bucket:
+                    continue  # orologio tornato indietro: lo slot contiene già dati più recenti
+                self.stamps[slot] = bucket
+                self.counts[slot * width:(slot + 1) * width] = STAT_ZERO_ROW
+            self.counts[slot * width + kind] += amount
+
+    def series(self, period, now):
+        # Righe per bucket dal più vecchio al più recente (zero per i bucket senza dati)
+        offset, size, buckets = STAT_RINGS[period]
+        width = len(STAT_KINDS)
+        current = now // size
+        rows = []
+        for bucket in range(current - buckets + 1, current + 1):
+            slot = offset + bucket % buckets
+            if self.stamps[slot] == bucket:
+                rows.append(self.counts[slot * width:(slot + 1) * width])
+            else:
+                rows.append((0,) * width)
+        return rows
+
+    def to_bytes(self):
+        return self.stamps.tobytes() + self.counts.tobytes()
+
+class ActivityStats:
+    # Aggiornate in memoria dagli eventi; i server modificati vengono salvati in blocco ogni STATS_SAVE_INTERVAL
+    def __init__(self, path=STATS_FILE):
+        self.path = path
+        self.conn = None
+        self.guilds = {}   # guild_id -> GuildActivity
+        self.dirty = set()
+        self.task = None
+
+    def open(self):
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS activity (guild_id INTEGER PRIMARY KEY, data BLOB NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.commit()
+        for guild_id, data in self.conn.execute("SELECT guild_id, data FROM activity"):
+            if owns_guild(guild_id):
+                try:
+                    self.guilds[guild_id] = GuildActivity(data)
+                except ValueError:
+                    ops_log(f"❌ Statistiche del server {guild_id} non valide: azzerate")
+
+    def start(self):
+        if self.conn is not None and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def hit(self, guild_id, kind, amount=1):
+        activity = self.guilds.get(guild_id)
+        if activity is None:
+            activity = self.guilds[guild_id] = GuildActivity()
+        activity.hit(kind, amount, int(time.time()))
+        self.dirty.add(guild_id)
+
+    def sample_voice(self):
+        # I minuti in voce si contano campionando ogni minuto chi è connesso (canale AFK escluso)
+        for guild in bot.guilds:
+            afk = guild.afk_channel
+            connected = sum(len(channel.voice_states) for channel in guild.voice_channels + guild.stage_channels if channel != afk)
+            if connected:
+                self.hit(guild.id, STAT_VOICE_MINUTES, connected)
+
+    async def _run(self):
+        saved_at = time.monotonic()
+        while True:
+            await asyncio.sleep(STATS_SAMPLE_INTERVAL)
+            self.sample_voice()
+            if time.monotonic() - saved_at >= STATS_SAVE_INTERVAL:
+                saved_at = time.monotonic()
+                await self.save()
+
+    async def save(self):
+        if not self.dirty:
+            return
+        rows = [(guild_id, self.guilds[guild_id].to_bytes()) for guild_id in self.dirty if guild_id in self.guilds]
+        self.dirty.clear()
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            self.dirty.update(guild_id for guild_id, _ in rows)
+            ops_log(f"❌ Errore salvataggio statistiche: {e}")
+
+    def _write(self, rows):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO activity (guild_id, data) VALUES (?, ?)", rows)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.conn is not None:
+            await self.save()
+            self.conn.close()
+            self.conn = None
+
+activity_stats = ActivityStats(STATS_FILE if LOG_CLUSTER_ID is None else f"activity_stats-{LOG_CLUSTER_ID}.db")
+if STATS_ENABLED and not IS_CLUSTER_SUPERVISOR:
+    try:
+        activity_stats.open()
+    except Exception as e:
+        ops_log(f"❌ Errore apertura statistiche: {e}")
+        activity_stats.conn = None
+
+async def stats_on_message(message):
+    if message.guild is not None and not message.author.bot:
+        activity_stats.hit(message.guild.id, STAT_MESSAGES)
+
+async def stats_on_message_edit(payload):
+    # Solo modifiche vere: gli aggiornamenti delle anteprime dei link non hanno edited_timestamp
+    data = payload.data
+    if payload.guild_id and data.get("edited_timestamp") and not data.get("author", {}).get("bot"):
+        activity_stats.hit(payload.guild_id, STAT_EDITS)
+
+async def stats_on_message_delete(payload):
+    if payload.guild_id:
+        activity_stats.hit(payload.guild_id, STAT_DELETES)
+
+async def stats_on_bulk_message_delete(payload):
+    if payload.guild_id:
+        activity_stats.hit(payload.guild_id, STAT_DELETES, len(payload.message_ids))
+
+async def stats_on_member_join(member):
+    activity_stats.hit(member.guild.id, STAT_JOINS)
+
+async def stats_on_member_remove(payload):
+    activity_stats.hit(payload.guild_id, STAT_LEAVES)
+
+async def stats_on_member_ban(guild, user):
+    activity_stats.hit(guild.id, STAT_BANS)
+
+if activity_stats.conn is not None:
+    bot.add_listener(stats_on_message, "on_message")
+    bot.add_listener(stats_on_message_edit, "on_raw_message_edit")
+    bot.add_listener(stats_on_message_delete, "on_raw_message_delete")
+    bot.add_listener(stats_on_bulk_message_delete, "on_raw_bulk_message_delete")
+    bot.add_listener(stats_on_member_join, "on_member_join")
+    bot.add_listener(stats_on_member_remove, "on_raw_member_remove")
+    bot.add_listener(stats_on_member_ban, "on_member_ban")
+
+def sparkline(values):
+    top = max(values)
+    if not top:
+        return SPARK_CHARS[0] * len(values)
+    return "".join(SPARK_CHARS[min(len(SPARK_CHARS) - 1, value * len(SPARK_CHARS) // (top + 1))] for value in values)
+
+def activity_embed(guild, period):
+    _, size, buckets = STAT_RINGS[period]
+    activity = activity_stats.guilds.get(guild.id)
+    rows = activity.series(period, int(time.time())) if activity is not None else [(0,) * len(STAT_KINDS)] * buckets
+    lines = []
+    for index, kind in enumerate(STAT_KINDS):
+        values = [row[index] for row in rows]
+        lines.append(f"{kind:<12}{sparkline(values)} {sum(values)}")
+    unit = {60: "minuto", 3600: "ora", 86400: "giorno"}[size]
+    embed = log_embed(
+        title=f"📈 Attività del server ({'ultima ora' if period == 'ora' else 'ultime 24 ore' if period == 'giorno' else 'ultimi 30 giorni'})",
+        description=f"Un carattere per {unit}, dal più vecchio al più recente.\n```\n" + "\n".join(lines) + "\n```",
+        color=Color.teal(),
+        fields=[(STAT_LABELS[kind], str(sum(row[index] for row in rows)), True) for index, kind in enumerate(STAT_KINDS)],
+        timestamp=True
+    )
+    return embed
+
+@bot.tree.command(name="log_stats", description="Mostra le statistiche di attività del server.")
+@app_commands.describe(periodo="Intervallo di tempo")
+@app_commands.choices(periodo=[
+    app_commands.Choice(name="ultima ora", value="ora"),
+    app_commands.Choice(name="ultime 24 ore", value="giorno"),
+    app_commands.Choice(name="ultimi 30 giorni", value="mese")
+])
+@app_commands.checks.has_permissions(manage_guild=True)
+async def log_stats(interaction: Interaction, periodo: str = "giorno"):
+    guild = interaction.guild
+    if guild is None:
+        await interaction.response.send_message("> ❌ **Questo comando può essere usato solo in un server.**", ephemeral=True)
+        return
+    if activity_stats.conn is None:
+        await interaction.response.send_message("> ❌ **Le statistiche di attività non sono attive.**", ephemeral=True)
+        return
+    await interaction.response.send_message(embed=activity_embed(guild, periodo), ephemeral=True)
+
+# ========== FILTRI PER SERVER ==========
+
+# Le regole di ogni server (canali, ruoli e utenti ignorati, tipi di log disattivati, pattern sul testo)
+# sono salvate in logs_settings[guild_id]["filters"] e compilate in set di id, una bitmask e un'unica regex.
+# I server senza regole non hanno voce in guild_filters: il controllo costa una lookup nel dizionario.
+FILTER_LISTS = ("channels", "roles", "users", "disabled", "patterns")
+FILTER_MAX_PATTERNS = 20
+FILTER_MAX_PATTERN_LENGTH = 200
+# Gruppo ripetuto che contiene a sua volta un quantificatore, es. (a+)+ o (\w*)*: backtracking esponenziale
+FILTER_NESTED_QUANTIFIER = re.compile(r"\((?:[^()\\]|\\.)*[*+}](?:[^()\\]|\\.)*\)(?:[*+]|\{\d*,)")
+
+def filter_pattern_error(pattern):
+    # Le regex girano sul loop degli eventi per ogni messaggio: lunghezza limitata e niente quantificatori annidati
+    if len(pattern) > FILTER_MAX_PATTERN_LENGTH:
+        return f"massimo {FILTER_MAX_PATTERN_LENGTH} caratteri"
+    if FILTER_NESTED_QUANTIFIER.search(pattern):
+        return "quantificatori annidati non consentiti"
+    try:
+        re.compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        return str(e)
+    return None
+
+class FilterPatternSet:
+    # Pattern che non possono stare in un'unica alternanza (es. flag globali come (?i)): provati in sequenza
+    __slots__ = ("patterns",)
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+
+    def search(self, content):
+        for pattern in self.patterns:
+            match = pattern.search(content)
+            if match is not None:
+                return match
+        return None
+
+def compile_filter_patterns(patterns):
+    # Un pattern non valido viene scartato da solo, senza invalidare gli altri
+    valid = []
+    for pattern in patterns[:FILTER_MAX_PATTERNS]:
+        error = filter_pattern_error(pattern)
+        if error is None:
+            valid.append(pattern)
+        else:
+            ops_log(f"❌ Pattern dei filtri `{pattern}` ignorato: {error}")
+    if not valid:
+        return None
+    try:
+        return re.compile("|".join(f"(?:{pattern})" for pattern in valid), re.IGNORECASE)
+    except re.error:
+        return FilterPatternSet([re.compile(pattern, re.IGNORECASE) for pattern in valid])
+
+class GuildFilter:
+    __slots__ = ("channels", "roles", "users", "disabled", "pattern")
+
+    def __init__(self, rules):
+        self.channels = frozenset(rules.get("channels", ()))
+        self.roles = frozenset(rules.get("roles", ()))
+        self.users = frozenset(rules.get("users", ()))
+        self.disabled = 0
+        for log_type in rules.get("disabled", ()):
+            if log_type in LOG_TYPE_INDEX:
+                self.disabled |= 1 << LOG_TYPE_INDEX[log_type]
+        self.pattern = compile_filter_patterns(list(rules.get("patterns", ())))
+
+    def rejects(self, user, channel_id, content):
+        # user può essere un Member (controlla anche i ruoli), uno User, un Object o None
+        if user is not None:
+            if user.id in self.users:
+                return True
+            if self.roles and isinstance(user, discord.Member) and not self.roles.isdisjoint(role.id for role in user.roles):
+                return True
+        if channel_id is not None and channel_id in self.channels:
+            return True
+        return content is not None and self.pattern is not None and self.pattern.search(content) is not None
+
+def compile_guild_filter(guild_id):
+    rules = logs_settings.get(str(guild_id), {}).get("filters")
+    if rules and any(rules.get(name) for name in FILTER_LISTS):
+        guild_filters[int(guild_id)] = GuildFilter(rules)
+    else:
+        guild_filters.pop(int(guild_id), None)
+
+def apply_guild_filter(guild_id):
+    # Ricompila le regole e ricostruisce le rotte, così i tipi disattivati spariscono subito
+    compile_guild_filter(guild_id)
+    guild = bot.get_guild(int(guild_id))
+    if guild is not None:
+        build_guild_routes(guild)
+
+def is_filtered(guild, log_type, user, channel_id, content):
+    rules = guild_filters.get(guild.id)
+    if rules is None or not rules.rejects(user, channel_id, content):
+        return False
+    metrics.inc("logbot_filtered_total", (("log_type", log_type),))
+    return True
+
+def update_guild_rules(guild_id, name, add=(), remove=()):
+    settings = logs_settings.setdefault(str(guild_id), {})
+    rules = settings.setdefault("filters", {})
+    values = [value for value in rules.get(name, []) if value not in remove]
+    values += [value for value in add if value not in values]
+    if values:
+        rules[name] = values
+    else:
+        rules.pop(name, None)
+    if not rules:
+        del settings["filters"]
+    config_store.schedule_save(guild_id)
+    apply_guild_filter(guild_id)
+
+async def reload_guild_filters():
+    # Rilegge le regole dal database (modifiche esterne o di un altro processo) e le ricompila tutte
+    async with config_store.write_lock:
+        _, _, settings = await asyncio.to_thread(config_store.load)
+    guild_ids = {gid for gid, values in logs_settings.items() if "filters" in values} | set(settings)
+    for gid in guild_ids:
+        rules = settings.get(gid, {}).get("filters")
+        if gid in config_store.dirty:
+            continue
+        if rules:
+            logs_settings.setdefault(gid, {})["filters"] = rules
+        elif gid in logs_settings:
+            logs_settings[gid].pop("filters", None)
+        apply_guild_filter(gid)
+    ops_log(f"🔄 Filtri dei log ricaricati ({len(guild_filters)} server con regole)")
+    return len(guild_filters)
+
+guild_filters = {}  # guild_id (int) -> GuildFilter
+for guild_id in list(logs_settings):
+    compile_guild_filter(guild_id)
+
+def describe_guild_filter(guild):
+    rules = logs_settings.get(str(guild.id), {}).get("filters", {})
+    lines = []
+    if rules.get("channels"):
+        lines.append("**Canali ignorati:** " + ", ".join(f"<#{channel_id}>" for channel_id in rules["channels"]))
+    if rules.get("roles"):
+        lines.append("**Ruoli ignorati:** " + ", ".join(f"<@&{role_id}>" for role_id in rules["roles"]))
+    if rules.get("users"):
+        lines.append("**Utenti ignorati:** " + ", ".join(f"<@{user_id}>" for user_id in rules["users"]))
+    if rules.get("disabled"):
+        lines.append("**Tipi disattivati:** " + ", ".join(f"`{log_type}`" for log_type in rules["disabled"]))
+    if rules.get("patterns"):
+        lines.append("**Pattern ignorati:** " + ", ".join(f"`{pattern}`" for pattern in rules["patterns"]))
+    return "\n".join(lines)[:4000] or "Nessun filtro attivo: vengono registrati tutti gli eventi."
+
+async def edit_guild_targets(interaction, channel, role, user, ignore):
+    targets = [(name, value.id) for name, value in (("channels", channel), ("roles", role), ("users", user)) if value is not None]
+    if not targets:
+        await interaction.response.send_message("> ❌ **Indica almeno un canale, un ruolo o un utente.**", ephemeral=True)
+        return
+    for name, target_id in targets:
+        if ignore:
+            update_guild_rules(interaction.guild.id, name, add=(target_id,))
+        else:
+            update_guild_rules(interaction.guild.id, name, remove=(target_id,))
+    await interaction.response.send_message(f"> ✅ **Filtri aggiornati.**\n{describe_guild_filter(interaction.guild)}", ephemeral=True)
+
+log_filter_group = app_commands.Group(name="log_filter", description="Escludi canali, ruoli, utenti o tipi di log.", guild_only=True)
+
+@log_filter_group.command(name="ignora", description="Ignora gli eventi di un canale, ruolo o utente.")
+@app_commands.describe(canale="Canale da ignorare", ruolo="Ruolo da ignorare", utente="Utente da ignorare")
+@app_commands.checks.has_permissions(administrator=True)
+async def log_filter_ignore(interaction: Interaction, canale: discord.abc.GuildChannel = None,
+                            ruolo: discord.Role = None, utente: discord.User = None):
+    await edit_guild_targets(interaction, canale, ruolo, utente, ignore=True)
+
+@log_filter_group.command(name="consenti", description="Torna a registrare gli eventi di un canale, ruolo o utente.")
+@app_commands.describe(canale="Canale da registrare", ruolo="Ruolo da registrare", utente="Utente da registrare")
+@app_commands.checks.has_permissions(administrator=True)
+async def log_filter_allow(interaction: Interaction, canale: discord.abc.GuildChannel = None,
+                           ruolo: discord.Role = None, utente: discord.User = None):
+    await edit_guild_targets(interaction, canale, ruolo, utente, ignore=False)
+
+@log_filter_group.command(name="tipo", description="Attiva o disattiva un tipo di log senza rimuoverne il canale.")
+@app_commands.describe(tipo="Tipo di log", attivo="Se registrare questo tipo di log")
+@app_commands.autocomplete(tipo=log_type_autocomplete)
+@app_commands.checks.has_permissions(administrator=True)
+async def log_filter_type(interaction: Interaction, tipo: str, attivo: bool):
+    if tipo not in DEFAULT_LOG_CHANNELS:
+        await interaction.response.send_message(f"> ❌ **Tipo di log sconosciuto:** `{tipo}`", ephemeral=True)
+        return
+    if attivo:
+        update_guild_rules(interaction.guild.id, "disabled", remove=(tipo,))
+    else:
+        update_guild_rules(interaction.guild.id, "disabled", add=(tipo,))
+    await interaction.response.send_message(f"> ✅ Log `{tipo}` {'attivato' if attivo else 'disattivato'}.", ephemeral=True)
+
+@log_filter_group.command(name="pattern", description="Ignora i messaggi il cui testo corrisponde a una regex.")
+@app_commands.describe(azione="Aggiungere o rimuovere il pattern", regex="Espressione regolare (senza distinzione maiuscole)")
+@app_commands.choices(azione=[app_commands.Choice(name="aggiungi", value="aggiungi"), app_commands.Choice(name="rimuovi", value="rimuovi")])
+@app_commands.checks.has_permissions(administrator=True)
+async def log_filter_pattern(interaction: Interaction, azione: str, regex: app_commands.Range[str, 1, FILTER_MAX_PATTERN_LENGTH]):
+    if azione == "rimuovi":
+        update_guild_rules(interaction.guild.id, "patterns", remove=(regex,))
+        await interaction.response.send_message(f"> ✅ Pattern `{regex}` rimosso.", ephemeral=True)
+        return
+    error = filter_pattern_error(regex)
+    if error is not None:
+        await interaction.response.send_message(f"> ❌ **Regex non valida:** {error}", ephemeral=True)
+        return
+    patterns = logs_settings.get(str(interaction.guild.id), {}).get("filters", {}).get("patterns", [])
+    if len(patterns) >= FILTER_MAX_PATTERNS:
+        await interaction.response.send_message(f"> ❌ **Massimo {FILTER_MAX_PATTERNS} pattern per server.**", ephemeral=True)
+        return
+    update_guild_rules(interaction.guild.id, "patterns", add=(regex,))
+    await interaction.response.send_message(f"> ✅ Pattern `{regex}` aggiunto.", ephemeral=True)
+
+@log_filter_group.command(name="mostra", description="Mostra i filtri attivi nel server.")
+@app_commands.checks.has_permissions(administrator=True)
+async def log_filter_show(interaction: Interaction):
+    embed = Embed(title="🧹 Filtri dei log", description=describe_guild_filter(interaction.guild), color=Color.blurple())
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@log_filter_group.command(name="ricarica", description="Rilegge i filtri salvati su disco.")
+@app_commands.checks.has_permissions(administrator=True)
+async def log_filter_reload(interaction: Interaction):
+    await reload_guild_filters()
+    await interaction.response.send_message(f"> ✅ **Filtri ricaricati.**\n{describe_guild_filter(interaction.guild)}", ephemeral=True)
+
+bot.tree.add_command(log_filter_group)
+
+# ========== AVVIO RAPIDO ==========
+
+STARTUP_PHASE_NAMES = {
+    "config": "configurazione caricata",
+    "import": "modulo importato",
+    "login": "login completato",
+    "warm_routes": "rotte a caldo pronte",
+    "command_sync": "comandi slash verificati",
+    "gateway": "gateway connesso",
+    "first_guild": "primo server disponibile",
+    "ready": "ready"
+}
+
+def report_startup():
+    ops_log(f"⏱️ Avvio completato in {startup_phases[-1][1]:.2f}s")
+    previous = 0.0
+    for phase, seconds in startup_phases:
+        ops_log(f"⏱️   {STARTUP_PHASE_NAMES.get(phase, phase)}: {seconds:.3f}s (+{seconds - previous:.3f}s)")
+        previous = seconds
+
+def command_tree_hash():
+    # L'hash copre ciò che verrebbe inviato a Discord, più l'applicazione (un token diverso va risincronizzato)
+    payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+    data = json.dumps([bot.application_id, payload], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+async def sync_command_tree():
+    # I comandi sono globali: in modalità cluster li sincronizza soltanto il cluster 0
+    if LOG_CLUSTER_ID:
+        return
+    digest = command_tree_hash()
+    try:
+        with open(COMMAND_HASH_FILE, "r", encoding="utf-8") as f:
+            previous = f.read().strip()
+    except OSError:
+        previous = None
+    if digest == previous:
+        ops_log("🔄 Comandi slash invariati: sincronizzazione saltata")
+        mark_startup("command_sync")
+        return
+    try:
+        synced = await bot.tree.sync()
+    except Exception as e:
+        ops_log(f"❌ Errore sincronizzazione comandi slash: {e}")
+        return
+    try:
+        with open(COMMAND_HASH_FILE, "w", encoding="utf-8") as f:
+            f.write(digest)
+    except OSError as e:
+        ops_log(f"❌ Errore salvataggio {COMMAND_HASH_FILE}: {e}")
+    ops_log(f"🔄 Comandi slash sincronizzati: {len(synced)}")
+    mark_startup("command_sync")
+
+async def startup_on_connect():
+    if not any(phase == "gateway" for phase, _ in startup_phases):
+        mark_startup("gateway")
+
+async def startup_on_guild_available(guild):
+    if not any(phase == "first_guild" for phase, _ in startup_phases):
+        mark_startup("first_guild")
+    bot.remove_listener(startup_on_guild_available, "on_guild_available")
+
+bot.add_listener(startup_on_connect, "on_connect")
+bot.add_listener(startup_on_guild_available, "on_guild_available")
+
+# ========== DIFF DEGLI AGGIORNAMENTI ==========
+
+# Tabelle degli attributi confrontati per ogni evento di aggiornamento. Per ogni classe (membro, ruolo,
+# tipo di canale, server) la tabella viene filtrata una volta sola sugli attributi che la classe ha:
+# un aggiornamento senza modifiche rilevanti (la maggior parte di on_member_update) costa un solo confronto di tuple.
+# kind indica come confrontare e descrivere il valore; audit è l'azione con cui correlare il log (vedi AuditCorrelator).
+# Solo attributi pubblici di discord.py: gli oggetti (ruoli, asset, canali, permessi) vengono ridotti a id e valori.
+# La posizione di ruoli e canali è esclusa: un solo spostamento genera un aggiornamento per ogni elemento riordinato.
+DiffField = namedtuple("DiffField", ["attr", "label", "kind", "log_type", "audit"])
+
+MEMBER_DIFF = (
+    DiffField("roles", "Ruoli", "roles", "member_update", discord.AuditLogAction.member_role_update),
+    DiffField("nick", "Nickname nel server", "value", "nickname", discord.AuditLogAction.member_update),
+    DiffField("timed_out_until", "Timeout", "timeout", "moderazione", discord.AuditLogAction.member_update),
+    DiffField("guild_avatar", "Avatar nel server", "changed", "member_update", None),
+    DiffField("pending", "In attesa di verifica", "value", "member_update", None)
+)
+
+ROLE_DIFF = tuple(
+    DiffField(attr, label, kind, "role_update", discord.AuditLogAction.role_update)
+    for attr, label, kind in (
+        ("name", "Nome", "value"),
+        ("colour", "Colore", "colour"),
+        ("hoist", "Mostrato separatamente", "value"),
+        ("mentionable", "Menzionabile", "value"),
+        ("permissions", "Permessi", "permissions"),
+        ("icon", "Icona", "changed"),
+        ("unicode_emoji", "Emoji", "value")
+    )
+)
+
+CHANNEL_DIFF = tuple(
+    DiffField(attr, label, kind, "channel_update", discord.AuditLogAction.channel_update)
+    for attr, label, kind in (
+        ("name", "Nome", "value"),
+        ("topic", "Topic", "value"),
+        ("category", "Categoria", "channel"),
+        ("nsfw", "NSFW", "value"),
+        ("slowmode_delay", "Slowmode (s)", "value"),
+        ("bitrate", "Bitrate", "value"),
+        ("user_limit", "Limite utenti", "value"),
+        ("rtc_region", "Regione", "value"),
+        ("video_quality_mode", "Qualità video", "value"),
+        ("default_auto_archive_duration", "Archiviazione thread (min)", "value"),
+    )
+) + (
+    DiffField("overwrites", "Permessi del canale", "overwrites", "channel_update", discord.AuditLogAction.overwrite_update),
+)
+
+GUILD_DIFF = tuple(
+    DiffField(attr, label, kind, log_type, discord.AuditLogAction.guild_update)
+    for attr, label, kind, log_type in (
+        ("verification_level", "Livello verifica", "value", "permessi"),
+        ("explicit_content_filter", "Filtro contenuti espliciti", "value", "permessi"),
+        ("mfa_level", "2FA per la moderazione", "value", "permessi"),
+        ("nsfw_level", "Livello NSFW", "value", "permessi"),
+        ("name", "Nome", "value", "guild_update"),
+        ("description", "Descrizione", "value", "guild_update"),
+        ("icon", "Icona", "changed", "guild_update"),
+        ("banner", "Banner", "changed", "guild_update"),
+        ("splash", "Sfondo invito", "changed", "guild_update"),
+        ("vanity_url_code", "Invito personalizzato", "value", "guild_update"),
+        ("preferred_locale", "Lingua", "value", "guild_update"),
+        ("owner_id", "Proprietario", "user", "guild_update"),
+        ("default_notifications", "Notifiche predefinite", "value", "guild_update"),
+        ("afk_channel", "Canale AFK", "channel", "guild_update"),
+        ("afk_timeout", "Timeout AFK (s)", "value", "guild_update"),
+        ("system_channel", "Canale di sistema", "channel", "guild_update"),
+        ("rules_channel", "Canale regole", "channel", "guild_update"),
+        ("public_updates_channel", "Canale aggiornamenti community", "channel", "guild_update"),
+        ("premium_progress_bar_enabled", "Barra progressi boost", "value", "guild_update")
+    )
+)
+
+# Un bit per permesso, con il nome canonico (alcuni permessi hanno alias in discord.py)
+PERMISSION_NAMES = {}
+for name, value in discord.Permissions.VALID_FLAGS.items():
+    PERMISSION_NAMES.setdefault(value, name)
+PERMISSION_BITS = sorted(PERMISSION_NAMES.items())
+
+def permission_names(bits):
+    return ", ".join(name for bit, name in PERMISSION_BITS if bits & bit) or "-"
+
+def format_diff_value(value):
+    if value is None or value == "":
+        return "*nessuno*"
+    if isinstance(value, bool):
+        return "sì" if value else "no"
+    return f"`{str(value)[:200]}`"
+
+def overwrites_key(overwrites):
+    # {ruolo/membro: PermissionOverwrite} -> {id: (allow, deny, tipo)}, con tipo 1 per i membri come nell'API
+    key = {}
+    for target, overwrite in overwrites.items():
+        allow, deny = overwrite.pair()
+        is_role = isinstance(target, discord.Role) or getattr(target, "type", None) is discord.Role
+        key[target.id] = (allow.value, deny.value, 0 if is_role else 1)
+    return key
+
+def object_id(value):
+    return value.id if value is not None else None
+
+def asset_key(asset):
+    return asset.key if asset is not None else None
+
+def diff_overwrites(before, after):
+    # Per ogni ruolo/membro: quali permessi sono passati a consentito, negato o ereditato
+    lines = []
+    for target_id in sorted(before.keys() | after.keys()):
+        old_allow, old_deny, kind = before.get(target_id, (0, 0, None))
+        new_allow, new_deny, new_kind = after.get(target_id, (0, 0, None))
+        if (old_allow, old_deny) == (new_allow, new_deny):
+            continue
+        mention = f"<@{target_id}>" if (kind if kind is not None else new_kind) == 1 else f"<@&{target_id}>"
+        if target_id not in before:
+            mention += " (aggiunto)"
+        elif target_id not in after:
+            mention += " (rimosso)"
+        changed = (old_allow ^ new_allow) | (old_deny ^ new_deny)
+        parts = []
+        for symbol, bits in (("✅", new_allow & changed), ("❌", new_deny & changed), ("⬜", changed & ~(new_allow | new_deny))):
+            if bits:
+                parts.append(f"{symbol} {permission_names(bits)}")
+        lines.append(f"{mention}: " + " · ".join(parts))
+    return "\n".join(lines)
+
+def diff_roles(before, after):
+    before, after = set(before), set(after)
+    lines = []
+    if after - before:
+        lines.append("➕ " + " ".join(f"<@&{role_id}>" for role_id in sorted(after - before)))
+    if before - after:
+        lines.append("➖ " + " ".join(f"<@&{role_id}>" for role_id in sorted(before - after)))
+    return "\n".join(lines)
+
+def diff_permissions(before, after):
+    lines = []
+    if after & ~before:
+        lines.append(f"➕ {permission_names(after & ~before)}")
+    if before & ~after:
+        lines.append(f"➖ {permission_names(before & ~after)}")
+    return "\n".join(lines)
+
+def diff_timeout(before, after):
+    if after is None or after <= discord.utils.utcnow():
+        return "Rimosso" if before is not None else ""
+    timestamp = int(after.timestamp())
+    return f"Fino a <t:{timestamp}:f> (<t:{timestamp}:R>)"
+
+DIFF_RENDERERS = {
+    "value": lambda before, after: f"{format_diff_value(before)} → {format_diff_value(after)}",
+    "changed": lambda before, after: "Modificato" if after else "Rimosso",
+    "colour": lambda before, after: f"`#{before:06x}` → `#{after:06x}`",
+    "channel": lambda before, after: f"{f'<#{before}>' if before else '*nessuno*'} → {f'<#{after}>' if after else '*nessuno*'}",
+    "user": lambda before, after: f"<@{before}> → <@{after}>",
+    "roles": diff_roles,
+    "permissions": diff_permissions,
+    "overwrites": diff_overwrites,
+    "timeout": diff_timeout
+}
+# Valori da normalizzare prima del confronto: gli oggetti restituiti da discord.py vengono ricreati a ogni
+# accesso, si confrontano i loro id e valori
+DIFF_KEYS = {
+    "roles": lambda roles: frozenset(role.id for role in roles),
+    "changed": asset_key,
+    "colour": lambda colour: colour.value,
+    "permissions": lambda permissions: permissions.value,
+    "channel": object_id,
+    "overwrites": overwrites_key
+}
+
+diff_tables = {}  # (nome tabella, classe) -> (getter degli attributi semplici, attributi normalizzati, campi)
+
+def diff_table(name, fields, cls):
+    table = diff_tables.get((name, cls))
+    if table is None:
+        fields = tuple(field for field in fields if hasattr(cls, field.attr))
+        plain = [field.attr for field in fields if field.kind not in DIFF_KEYS]
+        keyed = tuple((field.attr, DIFF_KEYS[field.kind]) for field in fields if field.kind in DIFF_KEYS)
+        table = diff_tables[(name, cls)] = (attrgetter(*plain) if plain else None, keyed, fields)
+    return table
+
+def diff_objects(name, fields, before, after):
+    # Restituisce [(campo, testo)] con le sole modifiche rilevanti
+    getter, keyed, fields = diff_table(name, fields, type(after))
+    if (getter is None or getter(before) == getter(after)) and all(
+            key(getattr(before, attr)) == key(getattr(after, attr)) for attr, key in keyed):
+        return []
+    changes = []
+    for field in fields:
+        old, new = getattr(before, field.attr), getattr(after, field.attr)
+        if field.kind in DIFF_KEYS:
+            old, new = DIFF_KEYS[field.kind](old), DIFF_KEYS[field.kind](new)
+        if old != new:
+            text = DIFF_RENDERERS[field.kind](old, new)
+            if text:
+                changes.append((field, text))
+    return changes
+
+def routes_any(guild, fields):
+    routes = log_routes.get(guild.id)
+    return routes is not None and any(routes[LOG_TYPE_INDEX[field.log_type]] is not None for field in fields)
+
+def submit_update_diff(guild, changes, titles, description, target_id, id_field, subject=None):
+    # Un embed per tipo di log, correlato alla voce di audit del primo campo che ne ha una
+    groups = {}
+    for field, text in changes:
+        if has_log(guild, field.log_type):
+            groups.setdefault(field.log_type, []).append((field, text))
+    for log_type, items in groups.items():
+        if subject is not None and is_filtered(guild, log_type, *subject):
+            continue
+        embed = log_embed(
+            title=titles[log_type],
+            description=description,
+            color=Color.orange(),
+            fields=[(field.label, text[:1024], False) for field, text in items] + [id_field],
+            timestamp=True
+        )
+        action = next((field.audit for field, _ in items if field.audit is not None), None)
+        if action is not None:
+            audit_correlator.submit(guild, log_type, embed, action, target_id)
+        else:
+            enqueue_log(guild, log_type, embed)
+
+# ========== EVENTI DI LOGGING AVANZATI ==========
+
+# --- Sincronizzazione dei comandi slash ---
+# on_ready scatta anche a ogni riconnessione: la sincronizzazione avviene una volta sola in setup_hook
+@bot.event
+async def on_ready():
+    ops_log(f"✅ Bot connesso come {bot.user}")
+    if not any(phase == "ready" for phase, _ in startup_phases):
+        mark_startup("ready")
+        report_startup()
+        report_memory_profile()
+
+# Log messaggi modificati (evento raw: funziona anche se il messaggio non è in cache)
+@bot.event
+async def on_raw_message_edit(payload):
+    data = payload.data
+    guild = bot.get_guild(payload.guild_id) if payload.guild_id else None
+    # Le anteprime dei link e gli aggiornamenti dei soli embed arrivano senza edited_timestamp
+    if guild is None or "content" not in data or not data.get("edited_timestamp"):
+        return
+    author = data.get("author")
+    if not author or author.get("bot"):
+        return
+    if not has_log(guild, "messaggi_modificati") and not wants_archive(guild):
+        return
+    if payload.cached_message:
+        before = message_record(payload.cached_message)
+    else:
+        before = await message_archive.get(payload.message_id) if MESSAGE_ARCHIVE_ENABLED else None
+    after_content = data["content"]
+    if before and before["content"] == after_content:
+        return
+    user = discord.User(state=bot._connection, data=author)
+    if is_filtered(guild, "messaggi_modificati", guild.get_member(user.id) or user, payload.channel_id, after_content):
+        return
+    if wants_archive(guild):
+        message_archive.add({
+            "id": payload.message_id,
+            "guild_id": guild.id,
+            "channel_id": payload.channel_id,
+            "author_id": user.id,
+            "author": str(user),
+            "avatar": user.display_avatar.url,
+            "bot": False,
+            "content": after_content,
+            "attachments": [attachment["url"] for attachment in data.get("attachments", [])]
+        })
+    if not has_log(guild, "messaggi_modificati"):
+        return
+    embed = log_embed(
+        title="✏️ Messaggio modificato",
+        description=f"**{user.mention}** ha modificato un messaggio in <#{payload.channel_id}>",
+        color=Color.orange(),
+        fields=[
+            ("Prima", (before["content"][:1024] or "*Vuoto*") if before else "*Non disponibile*", False),
+            ("Dopo", after_content[:1024] if after_content else "*Vuoto*", False),
+            ("ID Messaggio", str(payload.message_id), True)
+        ],
+        author=(str(user), user.display_avatar.url),
+        timestamp=True
+    )
+    await send_log(guild, "messaggi_modificati", embed)
+
+# Log messaggi cancellati (evento raw: il contenuto viene dalla cache o dall'archivio locale)
+@bot.event
+async def on_raw_message_delete(payload):
+    guild = bot.get_guild(payload.guild_id) if payload.guild_id else None
+    if not has_log(guild, "messaggi_cancellati") or was_bulk_deleted(payload.message_id):
+        return
+    if payload.cached_message:
+        record = message_record(payload.cached_message)
+    else:
+        record = await message_archive.get(payload.message_id) if MESSAGE_ARCHIVE_ENABLED else None
+    if record is None or record["bot"]:
+        return
+    author = guild.get_member(record["author_id"]) or discord.Object(record["author_id"])
+    if is_filtered(guild, "messaggi_cancellati", author, payload.channel_id, record["content"]):
+        return
+    fields = [
+        ("Contenuto", record["content"][:1024] if record["content"] else "*Nessun testo*", False),
+        ("ID Messaggio", str(payload.message_id), True)
+    ]
+    files = await attachment_cache.files_for(payload.message_id) if record["attachments"] else []
+    if record["attachments"]:
+        fields.append(("Allegati", "\n".join(record["attachments"])[:1024], False))
+    if files:
+        fields.append(("Copie conservate", f"{len(files)} di {len(record['attachments'])} allegati", True))
+    embed = log_embed(
+        title="🗑️ Messaggio eliminato",
+        description=f"**<@{record['author_id']}>** ha eliminato un messaggio in <#{payload.channel_id}>",
+        color=Color.red(),
+        fields=fields,
+        author=(record["author"], record["avatar"]),
+        timestamp=True
+    )
+    image = next((file.filename for file in files if file.filename.lower().endswith((".png", ".jpg", ".jpeg", ".gif", ".webp"))), None)
+    if image:
+        embed.set_image(url=f"attachment://{image}")
+    await send_log(guild, "messaggi_cancellati", embed, file=files or None)
+
+# Eliminazioni di massa (purge): un solo log con la trascrizione compressa invece di un log per messaggio.
+# Gli id restano in memoria per qualche minuto, così eventuali delete singoli degli stessi messaggi vengono ignorati
+BULK_DELETE_SUPPRESS_SECONDS = 300
+bulk_deleted_ids = {}       # message_id -> scadenza
+bulk_deleted_expiry = deque()
+
+def remember_bulk_delete(message_ids):
+    now = time.monotonic()
+    while bulk_deleted_expiry and bulk_deleted_expiry[0][0] <= now:
+        for message_id in bulk_deleted_expiry.popleft()[1]:
+            bulk_deleted_ids.pop(message_id, None)
+    expires = now + BULK_DELETE_SUPPRESS_SECONDS
+    bulk_deleted_expiry.append((expires, message_ids))
+    for message_id in message_ids:
+        bulk_deleted_ids[message_id] = expires
+
+def was_bulk_deleted(message_id):
+    expires = bulk_deleted_ids.get(message_id)
+    return expires is not None and expires > time.monotonic()
+
+def transcript_line(message_id, record):
+    created = discord.utils.snowflake_time(message_id).strftime("%d/%m/%Y %H:%M:%S")
+    if record is None:
+        return f"[{created}] ({message_id}) <contenuto non disponibile>"
+    line = f"[{created}] {record['author']} ({record['author_id']}): {record['content']}"
+    if record["attachments"]:
+        line += " | allegati: " + " ".join(record["attachments"])
+    return line
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    guild = bot.get_guild(payload.guild_id) if payload.guild_id else None
+    if not has_log(guild, "messaggi_cancellati"):
+        return
+    remember_bulk_delete(list(payload.message_ids))
+    if is_filtered(guild, "messaggi_cancellati", None, payload.channel_id, None):
+        return
+    cached = {message.id: message_record(message) for message in payload.cached_messages}
+    records = {}
+    for message_id in sorted(payload.message_ids):
+        record = cached.get(message_id)
+        if record is None and MESSAGE_ARCHIVE_ENABLED:
+            record = await message_archive.get(message_id)
+        records[message_id] = record
+    found = [record for record in records.values() if record is not None]
+    authors = Counter(record["author"] for record in found if not record["bot"])
+    transcript = "\n".join(transcript_line(message_id, record) for message_id, record in records.items())
+    data = await asyncio.to_thread(gzip.compress, transcript.encode("utf-8"))
+    file = LogFile(f"purge-{payload.channel_id}-{int(time.time())}.txt.gz", data)
+    embed = log_embed(
+        title="🧹 Eliminazione di massa",
+        description=f"**{len(payload.message_ids)}** messaggi eliminati in <#{payload.channel_id}>.",
+        color=Color.dark_red(),
+        fields=[
+            ("Recuperati", f"{len(found)} di {len(payload.message_ids)}", True),
+            ("ID Canale", str(payload.channel_id), True),
+            ("Autori", "\n".join(f"{author}: {count}" for author, count in authors.most_common(10)) or "-", False)
+        ],
+        timestamp=True
+    )
+    audit_correlator.submit(guild, "messaggi_cancellati", embed, discord.AuditLogAction.message_bulk_delete,
+                            payload.channel_id, file=file)
+
+# Log membri modificati: ruoli, nickname nel server, timeout (i boost passano dal registro eventi)
+MEMBER_DIFF_TITLES = {
+    "member_update": "👤 Membro aggiornato",
+    "nickname": "📝 Nickname nel server cambiato",
+    "moderazione": "⏳ Timeout aggiornato"
+}
+
+@bot.event
+async def on_member_update(before, after):
+    guild = after.guild
+    if not routes_any(guild, MEMBER_DIFF):
+        return
+    changes = diff_objects("member", MEMBER_DIFF, before, after)
+    if changes:
+        submit_update_diff(guild, changes, MEMBER_DIFF_TITLES, f"{after.mention} è stato aggiornato.", after.id,
+                           ("ID Utente", str(after.id), True), subject=(after, None, None))
+
+# Log ruoli modificati
+@bot.event
+async def on_guild_role_update(before, after):
+    if not routes_any(after.guild, ROLE_DIFF):
+        return
+    changes = diff_objects("role", ROLE_DIFF, before, after)
+    if changes:
+        submit_update_diff(after.guild, changes, {"role_update": "🛠️ Ruolo modificato"},
+                           f"Ruolo {after.mention} (`{before.name}`) modificato.", after.id, ("ID Ruolo", str(after.id), True))
+
+# Log canali modificati (compresi i permessi del canale, bit per bit)
+@bot.event
+async def on_guild_channel_update(before, after):
+    if not routes_any(after.guild, CHANNEL_DIFF):
+        return
+    changes = diff_objects("channel", CHANNEL_DIFF, before, after)
+    if changes:
+        submit_update_diff(after.guild, changes, {"channel_update": "🔄 Canale modificato"},
+                           f"Canale {after.mention} (`{before.name}`) modificato.", after.id,
+                           ("ID Canale", str(after.id), True), subject=(None, after.id, None))
+
+# Log impostazioni del server: sicurezza nel canale permessi, il resto in server-update
+GUILD_DIFF_TITLES = {
+    "permessi": "🔑 Impostazioni di sicurezza modificate",
+    "guild_update": "🏛️ Server modificato"
+}
+
+@bot.event
+async def on_guild_update(before, after):
+    if not routes_any(after, GUILD_DIFF):
+        return
+    changes = diff_objects("guild", GUILD_DIFF, before, after)
+    if changes:
+        submit_update_diff(after, changes, GUILD_DIFF_TITLES, "Le impostazioni del server sono state modificate.",
+                           after.id, ("ID Server", str(after.id), True))
+
+# Log nickname e avatar
+@bot.event
+async def on_user_update(before, after):
+    # Non c'è guild: logga solo nei server in comune che hanno il tipo di log configurato
+    if before.avatar != after.avatar:
+        targets = user_log_targets(after.id, "avatar")
+        if targets:
+            embed = log_embed(
+                title="🖼️ Avatar cambiato",
+                description=f"{after.mention} ha cambiato avatar.",
+                color=Color.blurple(),
+                fields=[
+                    ("ID Utente", str(after.id), True)
+                ],
+                thumbnail=after.display_avatar.url,
+                timestamp=True
+            )
+            fan_out_log(targets, "avatar", embed)
+    if before.display_name != after.display_name:
+        targets = user_log_targets(after.id, "nickname")
+        if targets:
+            embed = log_embed(
+                title="📝 Nickname cambiato",
+                description=f"{after.mention} ha cambiato nickname.",
+                color=Color.blurple(),
+                fields=[
+                    ("Prima", before.display_name, True),
+                    ("Dopo", after.display_name, True),
+                    ("ID Utente", str(after.id), True)
+                ],
+                timestamp=True
+            )
+            fan_out_log(targets, "nickname", embed)
+
+# Log emoji
+@bot.event
+async def on_guild_emojis_update(guild, before, after):
+    if not has_log(guild, "emoji"):
+        return
+    before_set = set(e.id for e in before)
+    after_set = set(e.id for e in after)
+    added = [e for e in after if e.id not in before_set]
+    removed = [e for e in before if e.id not in after_set]
+    for emoji in added:
+        embed = log_embed(
+            title="😃 Emoji aggiunta",
+            description=f"Emoji `{emoji.name}` aggiunta.",
+            color=Color.green(),
+            fields=[
+                ("ID Emoji", str(emoji.id), True)
+            ],
+            thumbnail=emoji.url,
+            timestamp=True
+        )
+        await send_log(guild, "emoji", embed)
+    for emoji in removed:
+        embed = log_embed(
+            title="😃 Emoji rimossa",
+            description=f"Emoji `{emoji.name}` rimossa.",
+            color=Color.red(),
+            fields=[
+                ("ID Emoji", str(emoji.id), True)
+            ],
+            thumbnail=emoji.url,
+            timestamp=True
+        )
+        await send_log(guild, "emoji", embed)
+
+# Log stickers
+@bot.event
+async def on_guild_stickers_update(guild, before, after):
+    if not has_log(guild, "stickers"):
+        return
+    before_set = set(s.id for s in before)
+    after_set = set(s.id for s in after)
+    added = [s for s in after if s.id not in before_set]
+    removed = [s for s in before if s.id not in after_set]
+    for sticker in added:
+        embed = log_embed(
+            title="🏷️ Sticker aggiunto",
+            description=f"Sticker `{sticker.name}` aggiunto.",
+            color=Color.green(),
+            fields=[
+                ("ID Sticker", str(sticker.id), True)
+            ],
+            timestamp=True
+        )
+        await send_log(guild, "stickers", embed)
+    for sticker in removed:
+        embed = log_embed(
+            title="🏷️ Sticker rimosso",
+            description=f"Sticker `{sticker.name}` rimosso.",
+            color=Color.red(),
+            fields=[
+                ("ID Sticker", str(sticker.id), True)
+            ],
+            timestamp=True
+        )
+        await send_log(guild, "stickers", embed)
+
+# Sicurezza: catch errori globali
+@bot.event
+async def on_error(event, *args, **kwargs):
+    logging.exception(f"Errore nell'evento {event}")
+
+# ========== CLUSTER ==========
+
+def fetch_recommended_shards(token):
+    request = urllib.request.Request(
+        f"{discord.http.Route.BASE}/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "LogSystem (cluster, 1.0)"}
+    )
+    with urllib.request.urlopen(request, timeout=30) as resp:
+        return json.load(resp)["shards"]
+
+def split_shards(shard_count, clusters):
+    # Distribuisce gli shard in intervalli contigui il più possibile uguali
+    base, extra = divmod(shard_count, clusters)
+    ranges = []
+    start = 0
+    for cluster_id in range(clusters):
+        size = base + (1 if cluster_id < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return [shard_ids for shard_ids in ranges if shard_ids]
+
+def start_cluster(cluster_id, shard_ids, shard_count):
+    env = dict(os.environ)
+    env.update({
+        "LOG_CLUSTER_ID": str(cluster_id),
+        "LOG_SHARD_IDS": ",".join(map(str, shard_ids)),
+        "LOG_SHARD_COUNT": str(shard_count)
+    })
+    ops_log(f"🚀 Avvio cluster {cluster_id} (shard {shard_ids[0]}-{shard_ids[-1]} di {shard_count})")
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+
+def run_cluster_supervisor(token, clusters):
+    shard_count = LOG_SHARD_COUNT or max(fetch_recommended_shards(token), clusters)
+    shard_ranges = split_shards(shard_count, clusters)
+    processes = {}
+    started_at = {}
+    failures = {}
+    restart_at = {}
+
+    def stop(*_):
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+        for process in processes.values():
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    for cluster_id, shard_ids in enumerate(shard_ranges):
+        processes[cluster_id] = start_cluster(cluster_id, shard_ids, shard_count)
+        started_at[cluster_id] = time.monotonic()
+        failures[cluster_id] = 0
+        # Scagliona gli identify: un solo shard alla volta può connettersi
+        time.sleep(CLUSTER_IDENTIFY_DELAY * len(shard_ids))
+
+    try:
+        while True:
+            time.sleep(1)
+            now = time.monotonic()
+            for cluster_id, process in processes.items():
+                if process.poll() is None:
+                    continue
+                if cluster_id not in restart_at:
+                    # Backoff esponenziale; azzerato se il cluster è rimasto attivo a lungo
+                    if now - started_at[cluster_id] > CLUSTER_RESTART_MAX_DELAY:
+                        failures[cluster_id] = 0
+                    delay = min(CLUSTER_RESTART_MAX_DELAY, 2 ** failures[cluster_id])
+                    failures[cluster_id] += 1
+                    restart_at[cluster_id] = now + delay
+                    ops_log(f"❌ Cluster {cluster_id} terminato (codice {process.returncode}), riavvio tra {delay}s")
+                elif now >= restart_at[cluster_id]:
+                    del restart_at[cluster_id]
+                    processes[cluster_id] = start_cluster(cluster_id, shard_ranges[cluster_id], shard_count)
+                    started_at[cluster_id] = time.monotonic()
+    except KeyboardInterrupt:
+        stop()
+
+# ========== AVVIO DEL BOT ==========
+
+mark_startup("import")
+
+if __name__ == "__main__":
+    TOKEN = os.getenv("DISCORD_TOKEN") or "INSERISCI_IL_TUO_TOKEN"
+    if TOKEN == "INSERISCI_IL_TUO_TOKEN":
+        ops_log("❌ Inserisci il token del bot in una variabile d'ambiente DISCORD_TOKEN o direttamente nel codice!")
+    elif IS_CLUSTER_SUPERVISOR:
+        run_cluster_supervisor(TOKEN, LOG_CLUSTERS)
+    else:
+        bot.run(TOKEN)
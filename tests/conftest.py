@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# bot.py apre database e cartelle nella directory corrente già all'import: i test girano in una cartella temporanea
+os.chdir(tempfile.mkdtemp(prefix="logbot-tests-"))
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import time
+
+import discord
+
+import bot
+
+
+def make_archive(path, **options):
+    archive = bot.MessageArchive(path=str(path), delay=0.01, **options)
+    archive.open()
+    return archive
+
+
+def record(message_id, content):
+    return {"id": message_id, "guild_id": 1, "channel_id": 2, "author_id": 3, "content": content}
+
+
+def test_archive_segments_survive_restart_and_keep_latest_version(tmp_path):
+    message_ids = [discord.utils.time_snowflake(discord.utils.utcnow()) + i for i in range(3)]
+
+    async def first_run():
+        archive = make_archive(tmp_path, flush_size=2)
+        for message_id in message_ids:
+            archive.add(record(message_id, "originale"))
+        archive.add(record(message_ids[0], "modificato"))
+        await archive.close()
+        assert archive.pending == {}
+
+    async def second_run():
+        archive = make_archive(tmp_path)
+        assert (await archive.get(message_ids[0]))["content"] == "modificato"
+        assert (await archive.get(message_ids[2]))["content"] == "originale"
+        assert await archive.get(message_ids[2] + 100) is None
+        # Un segmento chiuso viene letto dall'indice compatto ordinato
+        for segment in archive.segments.values():
+            segment.seal()
+        assert (await archive.get(message_ids[1]))["content"] == "originale"
+        await archive.close()
+
+    asyncio.run(first_run())
+    asyncio.run(second_run())
+
+
+def test_archive_drops_expired_segments(tmp_path):
+    old_start = int(time.time()) - 10 * 86400
+    old_start -= old_start % bot.ARCHIVE_SEGMENT_SECONDS
+    for ext in ("log", "idx"):
+        (tmp_path / f"{old_start}.{ext}").write_bytes(b"")
+
+    async def run():
+        archive = make_archive(tmp_path, retention_days=7)
+        assert old_start not in archive.segments
+        archive.add(record(discord.utils.time_snowflake(discord.utils.utcnow()), "nuovo"))
+        await archive.close()
+
+    asyncio.run(run())
+    assert not os.path.exists(tmp_path / f"{old_start}.log")
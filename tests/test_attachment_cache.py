@@ -0,0 +1,72 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+from aiohttp import web
+
+import bot
+
+CONTENTS = {
+    "a.png": b"a" * 1000,
+    "copia-a.png": b"a" * 1000,
+    "c.png": b"c" * 1000,
+    "d.png": b"d" * 1000
+}
+
+
+async def start_server():
+    async def handle(request):
+        return web.Response(body=CONTENTS[request.match_info["name"]])
+
+    app = web.Application()
+    app.router.add_get("/{name}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+def make_message(message_id, base_url, *names):
+    attachments = [
+        SimpleNamespace(url=f"{base_url}/{name}", filename=name, size=len(CONTENTS[name]))
+        for name in names
+    ]
+    return SimpleNamespace(id=message_id, attachments=attachments)
+
+
+async def mirror(cache, message):
+    cache.mirror(message)
+    await asyncio.gather(*cache.inflight.values())
+
+
+def test_attachment_cache_dedupes_and_evicts_least_recently_used(tmp_path):
+    async def run():
+        runner, base_url = await start_server()
+        cache = bot.AttachmentCache(path=str(tmp_path), max_bytes=2500)
+        cache.open()
+        try:
+            await mirror(cache, make_message(1, base_url, "a.png"))
+            await mirror(cache, make_message(2, base_url, "copia-a.png"))
+            # Stesso contenuto: un solo file su disco
+            assert cache.total == 1000
+            assert cache.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 1
+
+            files = await cache.files_for(2)
+            assert [file.filename for file in files] == ["copia-a.png"]
+            with open(files[0].source, "rb") as file:
+                assert file.read() == CONTENTS["a.png"]
+
+            await mirror(cache, make_message(3, base_url, "c.png"))
+            await mirror(cache, make_message(4, base_url, "d.png"))
+            # Oltre il limite: il contenuto usato meno di recente (a) viene eliminato
+            assert cache.total <= 2500
+            assert await cache.files_for(1) == []
+            files = await cache.files_for(4)
+            assert [file.filename for file in files] == ["d.png"]
+            assert not any(name.endswith(".part") for name in os.listdir(tmp_path))
+        finally:
+            await cache.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+import bot
+
+
+def make_guild(guild_id, *log_types):
+    routes = [None] * len(bot.LogType)
+    for log_type in log_types:
+        routes[bot.LOG_TYPE_INDEX[log_type]] = discord.Object(id=guild_id + bot.LOG_TYPE_INDEX[log_type])
+    bot.set_guild_routes(guild_id, routes)
+    return SimpleNamespace(id=guild_id, get_member=lambda user_id: None)
+
+
+def make_entry(guild, action, target_id):
+    return SimpleNamespace(guild=guild, action=action, target=discord.Object(id=target_id), user=None, reason="spam")
+
+
+def run_correlator(monkeypatch, steps):
+    sent = []
+    monkeypatch.setattr(bot, "enqueue_log", lambda guild, log_type, embed, file=None: sent.append((log_type, embed.title)))
+
+    async def run():
+        correlator = bot.AuditCorrelator(window=0.01)
+        monkeypatch.setattr(correlator, "correlates", lambda guild: True)
+        for step in steps:
+            step(correlator)
+        await asyncio.sleep(0.05)
+        correlator.flush()
+
+    asyncio.run(run())
+    return sent
+
+
+def submit_leave(guild, user_id):
+    embed = discord.Embed(title="👋 Utente uscito")
+    return lambda correlator: correlator.submit(guild, "join_leave", embed, discord.AuditLogAction.kick, user_id)
+
+
+def test_kick_is_logged_once_in_moderation(monkeypatch):
+    guild = make_guild(7001, "join_leave", "moderazione", "audit")
+    entry = make_entry(guild, discord.AuditLogAction.kick, 55)
+    sent = run_correlator(monkeypatch, [submit_leave(guild, 55), lambda correlator: correlator.on_entry(entry)])
+    assert sent == [("moderazione", "👢 Utente espulso")]
+
+
+def test_kick_without_leave_log_goes_to_one_fallback(monkeypatch):
+    guild = make_guild(7002, "moderazione", "audit")
+    entry = make_entry(guild, discord.AuditLogAction.kick, 56)
+    assert run_correlator(monkeypatch, [lambda correlator: correlator.on_entry(entry)]) == [("moderazione", "👢 Utente espulso")]
+
+    guild = make_guild(7003, "audit")
+    entry = make_entry(guild, discord.AuditLogAction.kick, 57)
+    assert run_correlator(monkeypatch, [lambda correlator: correlator.on_entry(entry)]) == [("audit", "👢 Utente espulso")]
+
+
+def test_overwrite_entries_merge_with_channel_update(monkeypatch):
+    guild = make_guild(7004, "channel_update", "audit")
+    steps = []
+    for action in (discord.AuditLogAction.overwrite_create, discord.AuditLogAction.overwrite_delete):
+        embed = discord.Embed(title="🔧 Canale aggiornato")
+        steps.append(lambda correlator, embed=embed: correlator.submit(
+            guild, "channel_update", embed, discord.AuditLogAction.overwrite_update, 900
+        ))
+        steps.append(lambda correlator, action=action: correlator.on_entry(make_entry(guild, action, 900)))
+    sent = run_correlator(monkeypatch, steps)
+    assert sent == [("channel_update", "🔧 Canale aggiornato")] * 2
@@ -0,0 +1,197 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+import bot
+
+
+class FakeChannel:
+    def __init__(self, channel_id=500, guild_id=1, failures=0):
+        self.id = channel_id
+        self.guild = SimpleNamespace(id=guild_id)
+        self.failures = failures
+        self.failed = asyncio.Event()
+        self.sent = []
+
+    async def send(self, embed=None, embeds=None, files=None):
+        if self.failures:
+            self.failures -= 1
+            self.failed.set()
+            raise OSError("Discord non raggiungibile")
+        self.sent.append([item.title for item in (embeds or [embed])])
+
+
+def make_batcher(monkeypatch, tmp_path, **options):
+    # Outbox disattivato: i test verificano solo code e priorità
+    monkeypatch.setattr(bot, "log_outbox", bot.LogOutbox(path=str(tmp_path)))
+    options.setdefault("delay", 0.01)
+    return bot.LogBatcher(**options)
+
+
+def enqueue(batcher, channel, log_type, title):
+    batcher.enqueue(channel, log_type, discord.Embed(title=title))
+
+
+def test_failed_batch_keeps_each_log_in_its_own_priority(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "LOG_RETRY_BASE_DELAY", 0.05)
+
+    async def run():
+        batcher = make_batcher(monkeypatch, tmp_path)
+        channel = FakeChannel(failures=1)
+        for i in range(3):
+            enqueue(batcher, channel, "messaggi", f"messaggio {i}")
+        await channel.failed.wait()
+        # Dopo l'errore arriva un log di moderazione: deve passare davanti ai messaggi da ritentare
+        enqueue(batcher, channel, "ban_unban", "ban")
+        while not channel.sent:
+            await asyncio.sleep(0.01)
+        await batcher.close()
+        return channel.sent
+
+    assert asyncio.run(run()) == [["ban", "messaggio 0", "messaggio 1", "messaggio 2"]]
+
+
+def test_drop_policy_limits_each_guild_and_evicts_lower_priority(monkeypatch, tmp_path):
+    async def run():
+        batcher = make_batcher(monkeypatch, tmp_path, max_per_guild=3, overflow_policy="drop", delay=10)
+        channel = FakeChannel()
+        other_guild = FakeChannel(channel_id=501, guild_id=2)
+        for i in range(5):
+            enqueue(batcher, channel, "messaggi", f"messaggio {i}")
+        enqueue(batcher, other_guild, "messaggi", "altro server")
+        assert batcher.guild_pending == {1: 3, 2: 1}
+        assert batcher.shed == {"messaggi": 2}
+        # Coda piena: un log più importante scarta il messaggio più vecchio
+        enqueue(batcher, channel, "ban_unban", "ban")
+        assert batcher.guild_pending[1] == 3
+        assert batcher.shed == {"messaggi": 3}
+        await batcher.close()
+        return channel.sent, other_guild.sent
+
+    sent, other = asyncio.run(run())
+    assert sent == [["ban", "messaggio 1", "messaggio 2"]]
+    assert other == [["altro server"]]
+
+
+def test_summarize_policy_sends_one_summary_embed(monkeypatch, tmp_path):
+    async def run():
+        batcher = make_batcher(monkeypatch, tmp_path, max_per_guild=2, overflow_policy="summarize", delay=10)
+        channel = FakeChannel()
+        for i in range(4):
+            enqueue(batcher, channel, "messaggi", f"messaggio {i}")
+        # Un log di priorità normale prende il posto di un messaggio, che finisce nel riassunto
+        enqueue(batcher, channel, "voice", "voce")
+        assert batcher.summaries == {channel.id: {"messaggi": 3}}
+        summary = {}
+
+        async def send(embed=None, embeds=None, files=None):
+            embeds = embeds or [embed]
+            if embeds[0].title.startswith("⚠️"):
+                summary["fields"] = [(field.name, field.value) for field in embeds[0].fields]
+            channel.sent.append([item.title for item in embeds])
+
+        channel.send = send
+        await batcher.close()
+        return channel.sent, summary
+
+    sent, summary = asyncio.run(run())
+    assert sent == [["voce", "messaggio 1"], ["⚠️ Log riassunti per sovraccarico"]]
+    assert summary["fields"] == [("messaggi", "3 eventi")]
+
+
+def test_sample_policy_lets_one_event_in_ten_through(monkeypatch, tmp_path):
+    async def run():
+        batcher = make_batcher(monkeypatch, tmp_path, max_per_guild=10, overflow_policy="sample", delay=10)
+        channel = FakeChannel()
+        for i in range(30):
+            enqueue(batcher, channel, "messaggi", f"messaggio {i}")
+        # Sopra metà coda si campiona: i log ad alta priorità passano comunque
+        enqueue(batcher, channel, "ban_unban", "ban")
+        pending = batcher.guild_pending[1]
+        shed = dict(batcher.shed)
+        await batcher.close()
+        return pending, shed, [title for batch in channel.sent for title in batch]
+
+    pending, shed, titles = asyncio.run(run())
+    assert pending == 8
+    assert shed == {"messaggi": 23}
+    assert titles[0] == "ban"
+    assert titles[-2:] == ["messaggio 14", "messaggio 24"]
+
+
+def test_fair_scheduler_serves_guilds_round_robin():
+    async def run():
+        scheduler = bot.FairScheduler(slots=1)
+        await scheduler.acquire(1)
+        order = []
+
+        async def worker(guild_id, label):
+            await scheduler.acquire(guild_id)
+            order.append(label)
+            scheduler.release()
+
+        tasks = []
+        for guild_id, label in ((1, "1a"), (1, "1b"), (1, "1c"), (2, "2"), (3, "3")):
+            tasks.append(asyncio.create_task(worker(guild_id, label)))
+            await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        assert scheduler.free == 1
+        return order
+
+    assert asyncio.run(run()) == ["1a", "2", "3", "1b", "1c"]
+
+
+def test_sent_counter_ignores_failed_attempts(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "LOG_RETRY_BASE_DELAY", 0.02)
+    metrics = bot.Metrics()
+    monkeypatch.setattr(bot, "metrics", metrics)
+
+    async def run():
+        batcher = make_batcher(monkeypatch, tmp_path)
+        channel = FakeChannel(failures=2)
+        for i in range(3):
+            enqueue(batcher, channel, "messaggi", f"messaggio {i}")
+        while not channel.sent:
+            await asyncio.sleep(0.01)
+        await batcher.close()
+
+    asyncio.run(run())
+    labels = (("sink", "channel"),)
+    assert metrics.counters[("logbot_embeds_sent_total", labels)] == 3
+    assert metrics.counters[("logbot_send_errors_total", labels)] == 2
+
+
+def test_file_logs_are_reopened_on_retry_and_closed_after_each_attempt(monkeypatch, tmp_path):
+    monkeypatch.setattr(bot, "LOG_RETRY_BASE_DELAY", 0.02)
+    cached = tmp_path / "blob"
+    cached.write_bytes(b"immagine")
+    opened = []
+
+    async def run():
+        batcher = make_batcher(monkeypatch, tmp_path)
+        channel = FakeChannel(failures=1)
+        send = channel.send
+
+        async def send_files(embed=None, embeds=None, files=None):
+            opened.extend(files)
+            channel.sent.append([(file.filename, file.fp.read()) for file in files])
+            await send(embed=embed)
+
+        channel.send = send_files
+        files = [bot.LogFile("foto.png", str(cached)), bot.LogFile("sparito.png", str(tmp_path / "evicted")),
+                 bot.LogFile("purge.txt.gz", b"trascrizione")]
+        batcher.enqueue(channel, "messaggi_cancellati", discord.Embed(title="eliminato"), files)
+        while len(channel.sent) < 3:
+            await asyncio.sleep(0.01)
+        await batcher.close()
+        return channel.sent
+
+    sent = asyncio.run(run())
+    # Primo tentativo fallito, secondo riuscito: entrambi con file nuovi e contenuto completo.
+    # Un file rimosso dalla cache nel frattempo viene saltato
+    attempt = [("foto.png", b"immagine"), ("purge.txt.gz", b"trascrizione")]
+    assert sent == [attempt, attempt, ["eliminato"]]
+    assert len(opened) == 4 and len({id(file) for file in opened}) == 4
+    assert all(file.fp.closed for file in opened if file.filename == "foto.png")
@@ -0,0 +1,79 @@
+import asyncio
+import gzip
+from types import SimpleNamespace
+
+import discord
+
+import bot
+
+GUILD_ID, CHANNEL_ID = 1, 2
+
+
+class FakeAuthor:
+    def __init__(self, author_id, name, is_bot=False):
+        self.id = author_id
+        self.name = name
+        self.bot = is_bot
+        self.display_avatar = SimpleNamespace(url=f"https://example.invalid/{author_id}.png")
+
+    def __str__(self):
+        return self.name
+
+
+def archived(message_id, author_id, author, content, attachments=()):
+    return {
+        "id": message_id, "guild_id": GUILD_ID, "channel_id": CHANNEL_ID, "author_id": author_id, "author": author,
+        "avatar": None, "bot": False, "content": content, "attachments": list(attachments)
+    }
+
+
+def test_bulk_delete_sends_one_gzipped_transcript(tmp_path, monkeypatch):
+    base = discord.utils.time_snowflake(discord.utils.utcnow())
+    ids = [base + i for i in range(4)]
+    guild = SimpleNamespace(id=GUILD_ID)
+    submitted = []
+
+    class Correlator:
+        def submit(self, guild, log_type, embed, action, target_id, file=None):
+            submitted.append((log_type, embed, action, target_id, file))
+
+    cached = SimpleNamespace(
+        id=ids[2], guild=guild, channel=SimpleNamespace(id=CHANNEL_ID), author=FakeAuthor(7, "robot", is_bot=True),
+        content="messaggio del bot", attachments=[]
+    )
+    payload = SimpleNamespace(guild_id=GUILD_ID, channel_id=CHANNEL_ID, message_ids=set(ids), cached_messages=[cached])
+
+    monkeypatch.setattr(bot.bot._connection, "_guilds", {GUILD_ID: guild})
+    monkeypatch.setattr(bot, "has_log", lambda guild, log_type: True)
+    monkeypatch.setattr(bot, "MESSAGE_ARCHIVE_ENABLED", True)
+    monkeypatch.setattr(bot, "audit_correlator", Correlator())
+
+    async def run():
+        archive = bot.MessageArchive(path=str(tmp_path), delay=0.01)
+        archive.open()
+        archive.add(archived(ids[0], 5, "mario", "ciao a tutti"))
+        archive.add(archived(ids[1], 5, "mario", "guarda", ["https://cdn.example.invalid/foto.png"]))
+        monkeypatch.setattr(bot, "message_archive", archive)
+        try:
+            await bot.on_raw_bulk_message_delete(payload)
+        finally:
+            await archive.close()
+
+    asyncio.run(run())
+    (log_type, embed, action, target_id, file), = submitted
+    assert (log_type, action, target_id) == ("messaggi_cancellati", discord.AuditLogAction.message_bulk_delete, CHANNEL_ID)
+    assert embed.title == "🧹 Eliminazione di massa"
+    assert embed.description == f"**4** messaggi eliminati in <#{CHANNEL_ID}>."
+    fields = {field.name: field.value for field in embed.fields}
+    assert fields["Recuperati"] == "3 di 4"
+    assert fields["Autori"] == "mario: 2"  # i messaggi dei bot sono nella trascrizione ma non tra gli autori
+
+    assert file.filename.startswith(f"purge-{CHANNEL_ID}-") and file.filename.endswith(".txt.gz")
+    lines = gzip.decompress(file.source).decode("utf-8").splitlines()
+    assert len(lines) == 4
+    assert lines[0].endswith("] mario (5): ciao a tutti")
+    assert lines[1].endswith("] mario (5): guarda | allegati: https://cdn.example.invalid/foto.png")
+    assert lines[2].endswith("] robot (7): messaggio del bot")
+    assert lines[3].endswith(f"({ids[3]}) <contenuto non disponibile>")
+    # I delete singoli degli stessi messaggi che arrivano dopo vengono ignorati
+    assert all(bot.was_bulk_deleted(message_id) for message_id in ids)
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import bot
+
+GUILD_ID = 1
+
+
+class FakeClock:
+    # Sostituisce il modulo time di bot.py: le finestre avanzano senza aspettare davvero
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return 1_700_000_000 + self.now
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+
+class FakeResponse:
+    def __init__(self):
+        self.text = None
+
+    async def send_message(self, text, ephemeral=False):
+        self.text = text
+
+
+def setup(monkeypatch):
+    clock = FakeClock()
+    sent = []
+
+    async def send_log(guild, log_type, embed, file=None):
+        sent.append((log_type, embed, file))
+
+    monkeypatch.setattr(bot, "time", clock)
+    monkeypatch.setattr(bot, "send_log", send_log)
+    monkeypatch.setattr(bot, "logs_settings", {})
+    monkeypatch.setattr(bot, "BURST_DIGEST_INTERVAL", 0.01)
+    monkeypatch.setattr(bot.config_store, "schedule_save", lambda guild_id: None)
+    return clock, sent
+
+
+async def configure(tipo, soglia, finestra):
+    interaction = SimpleNamespace(guild=SimpleNamespace(id=GUILD_ID), response=FakeResponse())
+    await bot.log_burst.callback(interaction, tipo, soglia, finestra)
+    return interaction.response.text
+
+
+def message(index):
+    return {"author_id": 10 + index % 2, "channel_id": 20, "index": index}
+
+
+async def wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condizione mai verificata")
+
+
+def test_burst_switches_to_digest_and_back(monkeypatch):
+    clock, sent = setup(monkeypatch)
+
+    async def run():
+        aggregator = bot.BurstAggregator()
+        guild = SimpleNamespace(id=GUILD_ID)
+        assert "oltre **3** eventi in **10s**" in await configure("messaggi", 3, 10)
+        assert aggregator.thresholds(GUILD_ID, "messaggi") == (3, 10)
+        absorbed = [aggregator.intercept(guild, "messaggi", message, (index,)) for index in range(5)]
+        state = aggregator.windows[(GUILD_ID, "messaggi")]
+        started = state.started
+        # Passata la finestra il ritmo è sotto metà soglia: dopo il digest si torna ai log singoli
+        clock.now += 60
+        await wait_for(lambda: not state.bursting)
+        return absorbed, started, aggregator.intercept(guild, "messaggi", message, (5,))
+
+    absorbed, started, after = asyncio.run(run())
+    assert absorbed == [False, False, True, True, True]
+    assert after is False
+    assert len(sent) == 1
+    log_type, embed, file = sent[0]
+    assert log_type == "messaggi"
+    assert embed.title == "📊 Digest messaggi"
+    fields = {field.name: field.value for field in embed.fields}
+    assert fields["Messaggi"] == "3"
+    assert fields["Autori unici"] == "2"
+    assert fields["Canali principali"] == "<#20>: 3"
+    assert file.filename == f"digest-messaggi-{int(started)}.jsonl"
+    assert [json.loads(line) for line in file.source.decode("utf-8").splitlines()] == [message(index) for index in (2, 3, 4)]
+
+
+def test_burst_caps_detail_file_and_can_be_disabled(monkeypatch):
+    clock, sent = setup(monkeypatch)
+    monkeypatch.setattr(bot, "BURST_DIGEST_MAX_RECORDS", 2)
+
+    async def run():
+        aggregator = bot.BurstAggregator()
+        guild = SimpleNamespace(id=GUILD_ID)
+        await configure("join_leave", 2, 30)
+        for index in range(6):
+            aggregator.intercept(guild, "join_leave", lambda index: {"user_id": index, "account_age_days": index * 5}, (index,))
+        clock.now += 120
+        await wait_for(lambda: sent)
+        assert "disattivato" in await configure("join_leave", 0, 30)
+        return [aggregator.intercept(guild, "join_leave", None, ()) for _ in range(10)]
+
+    assert asyncio.run(run()) == [False] * 10
+    _, embed, file = sent[0]
+    fields = {field.name: field.value for field in embed.fields}
+    assert embed.title == "📊 Digest ingressi"
+    assert fields["Ingressi"] == "2"
+    assert fields["Non inclusi nel file"] == "3"
+    assert len(file.source.splitlines()) == 2
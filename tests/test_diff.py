@@ -0,0 +1,125 @@
+import discord
+import pytest
+
+import bot
+
+GUILD_ID = 100
+ROLE_A, ROLE_B = 201, 202
+CHANNEL_ID, AFK_ID, CATEGORY_ID = 301, 302, 303
+USER_ID = 401
+
+
+def role_payload(role_id, name, **changes):
+    payload = {
+        "id": str(role_id), "name": name, "color": 0, "hoist": False, "position": 1,
+        "permissions": "0", "managed": False, "mentionable": False, "icon": None, "flags": 0
+    }
+    payload.update(changes)
+    return payload
+
+
+def channel_payload(channel_id=CHANNEL_ID, **changes):
+    payload = {
+        "id": str(channel_id), "guild_id": str(GUILD_ID), "type": 0, "name": "generale", "position": 0,
+        "permission_overwrites": [], "topic": None, "nsfw": False, "parent_id": None
+    }
+    payload.update(changes)
+    return payload
+
+
+def member_payload(**changes):
+    payload = {
+        "user": {"id": str(USER_ID), "username": "utente", "discriminator": "0", "avatar": None},
+        "roles": [], "joined_at": "2025-01-01T00:00:00+00:00", "deaf": False, "mute": False,
+        "nick": None, "avatar": None, "flags": 0
+    }
+    payload.update(changes)
+    return payload
+
+
+def guild_payload(**changes):
+    payload = {
+        "id": str(GUILD_ID), "name": "server", "icon": None, "banner": None, "splash": None,
+        "owner_id": str(USER_ID), "afk_channel_id": None, "afk_timeout": 300,
+        "roles": [role_payload(GUILD_ID, "@everyone", position=0), role_payload(ROLE_A, "a"), role_payload(ROLE_B, "b")],
+        "channels": [
+            channel_payload(),
+            channel_payload(AFK_ID, name="afk", type=2, bitrate=64000, user_limit=0),
+            channel_payload(CATEGORY_ID, name="categoria", type=4)
+        ],
+        "emojis": [], "stickers": [], "features": [], "member_count": 1, "verification_level": 0,
+        "explicit_content_filter": 0, "mfa_level": 0, "premium_tier": 0, "nsfw_level": 0,
+        "preferred_locale": "it", "default_message_notifications": 0, "system_channel_flags": 0
+    }
+    payload.update(changes)
+    return payload
+
+
+@pytest.fixture()
+def guild():
+    return discord.Guild(data=guild_payload(), state=bot.bot._connection)
+
+
+def member(guild, **changes):
+    return discord.Member(data=member_payload(**changes), guild=guild, state=bot.bot._connection)
+
+
+def role(guild, **changes):
+    return discord.Role(guild=guild, state=bot.bot._connection, data=role_payload(ROLE_A, "a", **changes))
+
+
+def channel(guild, **changes):
+    return discord.TextChannel(state=bot.bot._connection, guild=guild, data=channel_payload(**changes))
+
+
+def rendered(name, fields, before, after):
+    return [(field.label, text) for field, text in bot.diff_objects(name, fields, before, after)]
+
+
+VIEW = discord.Permissions(view_channel=True).value
+SEND = discord.Permissions(send_messages=True).value
+VIEW_NAME = bot.permission_names(VIEW)
+SEND_NAME = bot.permission_names(SEND)
+
+CASES = [
+    ("member", bot.MEMBER_DIFF, member, {}, {}, []),
+    ("member", bot.MEMBER_DIFF, member, {"roles": [str(ROLE_A)]}, {"roles": [str(ROLE_B)]},
+     [("Ruoli", f"➕ <@&{ROLE_B}>\n➖ <@&{ROLE_A}>")]),
+    ("member", bot.MEMBER_DIFF, member, {}, {"roles": [str(ROLE_A), str(ROLE_B)]},
+     [("Ruoli", f"➕ <@&{ROLE_A}> <@&{ROLE_B}>")]),
+    ("member", bot.MEMBER_DIFF, member, {"nick": "vecchio"}, {"nick": None},
+     [("Nickname nel server", "`vecchio` → *nessuno*")]),
+    ("member", bot.MEMBER_DIFF, member, {}, {"avatar": "a" * 32}, [("Avatar nel server", "Modificato")]),
+    ("role", bot.ROLE_DIFF, role, {}, {"colors": {"primary_color": 0xFF0000}, "permissions": str(SEND)},
+     [("Colore", "`#000000` → `#ff0000`"), ("Permessi", f"➕ {SEND_NAME}")]),
+    ("role", bot.ROLE_DIFF, role, {"icon": "b" * 32}, {}, [("Icona", "Rimosso")]),
+    ("channel", bot.CHANNEL_DIFF, channel, {}, {"parent_id": str(CATEGORY_ID)},
+     [("Categoria", f"*nessuno* → <#{CATEGORY_ID}>")]),
+    ("channel", bot.CHANNEL_DIFF, channel,
+     {"permission_overwrites": [{"id": str(ROLE_A), "type": 0, "allow": str(VIEW), "deny": "0"}]},
+     {"permission_overwrites": [
+         {"id": str(ROLE_A), "type": 0, "allow": "0", "deny": str(VIEW)},
+         {"id": str(USER_ID), "type": 1, "allow": str(SEND), "deny": "0"}
+     ]},
+     [("Permessi del canale", f"<@&{ROLE_A}>: ❌ {VIEW_NAME}\n<@{USER_ID}> (aggiunto): ✅ {SEND_NAME}")]),
+    ("channel", bot.CHANNEL_DIFF, channel,
+     {"permission_overwrites": [{"id": str(ROLE_A), "type": 0, "allow": str(VIEW), "deny": "0"}]}, {},
+     [("Permessi del canale", f"<@&{ROLE_A}> (rimosso): ⬜ {VIEW_NAME}")])
+]
+
+
+@pytest.mark.parametrize("name, fields, build, before, after, expected", CASES)
+def test_diff_objects(guild, name, fields, build, before, after, expected):
+    assert rendered(name, fields, build(guild, **before), build(guild, **after)) == expected
+
+
+def test_guild_diff_compares_channels_by_id():
+    state = bot.bot._connection
+    before = discord.Guild(data=guild_payload(), state=state)
+    after = discord.Guild(data=guild_payload(afk_channel_id=str(AFK_ID), afk_timeout=60, icon="c" * 32), state=state)
+    assert rendered("guild", bot.GUILD_DIFF, before, after) == [
+        ("Icona", "Modificato"),
+        ("Canale AFK", f"*nessuno* → <#{AFK_ID}>"),
+        ("Timeout AFK (s)", "`300` → `60`")
+    ]
+    assert rendered("guild", bot.GUILD_DIFF, before, discord.Guild(data=guild_payload(), state=state)) == []
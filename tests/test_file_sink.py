@@ -0,0 +1,127 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import discord
+
+import bot
+
+
+class RecordingSink:
+    def __init__(self):
+        self.records = []
+
+    def add(self, guild_id, log_type, embed):
+        self.records.append((guild_id, log_type))
+
+
+def make_guild(guild_id):
+    return SimpleNamespace(id=guild_id, members=[], get_channel=lambda channel_id: None)
+
+
+def test_file_only_types_do_not_need_a_discord_channel(monkeypatch):
+    guild = make_guild(5151)
+    sink = RecordingSink()
+    sent = []
+    monkeypatch.setattr(bot, "LOG_FILE_ONLY_TYPES", {"messaggi"})
+    monkeypatch.setattr(bot, "log_sinks", [sink])
+    monkeypatch.setattr(bot.log_batcher, "enqueue", lambda *args: sent.append(args))
+    bot.build_guild_routes(guild)
+
+    assert bot.has_log(guild, "messaggi")
+    assert not bot.has_log(guild, "voice")
+
+    bot.enqueue_log(guild, "messaggi", discord.Embed(title="Messaggio"))
+    assert sink.records == [(guild.id, "messaggi")]
+    assert sent == []
+
+
+def test_file_only_types_respect_disabled_filters(monkeypatch):
+    guild = make_guild(5252)
+    monkeypatch.setattr(bot, "LOG_FILE_ONLY_TYPES", {"messaggi"})
+    bot.logs_settings[str(guild.id)] = {"filters": {"disabled": ["messaggi"]}}
+    bot.compile_guild_filter(guild.id)
+    bot.build_guild_routes(guild)
+
+    assert not bot.has_log(guild, "messaggi")
+
+
+def make_sink(directory, **options):
+    options.setdefault("segment_bytes", 1 << 30)
+    options.setdefault("rotate_seconds", 3600)
+    options.setdefault("flush_interval", 0.01)
+    return bot.LogFileSink(str(directory), compression="gzip", **options)
+
+
+def segments(directory, suffix=".jsonl.gz"):
+    return sorted(name for name in os.listdir(directory) if name.endswith(suffix))
+
+
+def read_segments(directory):
+    records = []
+    for name in segments(directory):
+        with gzip.open(os.path.join(directory, name), "rt", encoding="utf-8") as file:
+            records += [json.loads(line) for line in file]
+    return records
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condizione mai verificata"
+        time.sleep(0.01)
+
+
+def log(index):
+    embed = discord.Embed(title=f"Messaggio {index}", description=f"<@{100 + index}> ha scritto in <#7>")
+    embed.add_field(name="ID Canale", value="9")
+    return embed
+
+
+def test_file_sink_rotates_by_size_into_gzip_segments(tmp_path):
+    sink = make_sink(tmp_path, segment_bytes=200)
+    sink.open()
+    for index in range(3):
+        sink.add(42, "messaggi", log(index))
+        # Ogni record supera da solo la dimensione del segmento: il thread lo chiude e lo comprime
+        wait_for(lambda: len(segments(tmp_path)) == index + 1)
+    asyncio.run(sink.close())
+
+    assert segments(tmp_path, ".jsonl") == []
+    records = read_segments(tmp_path)
+    assert [record["embed"]["title"] for record in records] == ["Messaggio 0", "Messaggio 1", "Messaggio 2"]
+    assert set(records[0]) == {"ts", "guild_id", "log_type", "user_id", "channel_id", "embed"}
+    assert (records[1]["guild_id"], records[1]["log_type"], records[1]["user_id"], records[1]["channel_id"]) == (42, "messaggi", 101, 9)
+
+
+def test_file_sink_rotates_by_age(tmp_path):
+    sink = make_sink(tmp_path, rotate_seconds=0.05)
+    sink.open()
+    sink.add(42, "messaggi", log(0))
+    wait_for(lambda: len(segments(tmp_path)) == 1)
+    sink.add(42, "messaggi", log(1))
+    wait_for(lambda: len(segments(tmp_path)) == 2)
+    asyncio.run(sink.close())
+
+    assert [record["embed"]["title"] for record in read_segments(tmp_path)] == ["Messaggio 0", "Messaggio 1"]
+
+
+def test_file_sink_close_flushes_the_open_segment(tmp_path):
+    # Segmento lasciato aperto da un'esecuzione interrotta: viene compresso all'avvio, il .part scartato
+    (tmp_path / "logs-20250101-000000-000.jsonl").write_text(json.dumps({"log_type": "sistema", "message": "vecchio"}) + "\n")
+    (tmp_path / "logs-20250101-000000-000.jsonl.gz.part").write_bytes(b"incompleto")
+    sink = make_sink(tmp_path, flush_interval=10)
+    sink.open()
+    sink.add(42, "ban_unban", log(0))
+    sink.add_record({"ts": 1.0, "log_type": "sistema", "level": "info", "message": "avvio"})
+    asyncio.run(sink.close())
+
+    assert sorted(os.listdir(tmp_path))[0] == "logs-20250101-000000-000.jsonl.gz"
+    assert not any(name.endswith((".jsonl", ".part")) for name in os.listdir(tmp_path))
+    records = read_segments(tmp_path)
+    assert [record.get("message") or record["embed"]["title"] for record in records] == ["vecchio", "Messaggio 0", "avvio"]
+    assert sink.written == 2
+    assert bot.ops_logger.sink is None
@@ -0,0 +1,117 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import discord
+
+import bot
+
+
+def make_text_channel(channel_id, name):
+    channel = discord.TextChannel.__new__(discord.TextChannel)
+    channel.id = channel_id
+    channel.name = name
+    return channel
+
+
+class FakeResponse:
+    async def defer(self, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    def __init__(self, guild):
+        self.guild = guild
+        self.response = FakeResponse()
+        self.edited = None
+
+    async def edit_original_response(self, **kwargs):
+        self.edited = kwargs
+
+
+def make_guild(guild_id):
+    channels = {
+        1000 + index: make_text_channel(1000 + index, name)
+        for index, name in enumerate(bot.DEFAULT_LOG_CHANNELS.values())
+    }
+    category = SimpleNamespace(name=bot.LOGS_CATEGORY_NAME, text_channels=list(channels.values()))
+    return SimpleNamespace(
+        id=guild_id,
+        default_role=object(),
+        me=object(),
+        categories=[category],
+        members=[],
+        get_channel=channels.get
+    )
+
+
+def test_setup_logs_keeps_filter_disabled_types_off(monkeypatch):
+    guild = make_guild(4242)
+    monkeypatch.setattr(bot.bot._connection, "user", SimpleNamespace(display_avatar=SimpleNamespace(url="https://example.invalid/a.png")))
+    bot.logs_settings[str(guild.id)] = {"filters": {"disabled": ["messaggi", "voice"]}}
+    bot.compile_guild_filter(guild.id)
+
+    async def run():
+        interaction = FakeInteraction(guild)
+        await bot.setup_logs.callback(interaction)
+        return interaction
+
+    interaction = asyncio.run(run())
+    assert interaction.edited is not None
+    assert set(bot.logs_channels[str(guild.id)]) == set(bot.DEFAULT_LOG_CHANNELS)
+    assert not bot.has_log(guild, "messaggi")
+    assert not bot.has_log(guild, "voice")
+    assert bot.has_log(guild, "ban_unban")
+
+
+def make_member(guild_id, user_id, role_ids):
+    def role(role_id, position):
+        return {
+            "id": str(role_id), "name": str(role_id), "color": 0, "hoist": False, "position": position,
+            "permissions": "0", "managed": False, "mentionable": False
+        }
+
+    guild = discord.Guild(data={
+        "id": str(guild_id), "name": "server", "owner_id": str(user_id), "channels": [], "emojis": [], "features": [],
+        "roles": [role(guild_id, 0)] + [role(role_id, 1) for role_id in (5, 6)]
+    }, state=bot.bot._connection)
+    return discord.Member(data={
+        "user": {"id": str(user_id), "username": "utente", "discriminator": "0", "avatar": None},
+        "roles": [str(role_id) for role_id in role_ids], "joined_at": None, "deaf": False, "mute": False, "flags": 0
+    }, guild=guild, state=bot.bot._connection)
+
+
+def test_filter_rejects_users_roles_channels_and_patterns():
+    rules = bot.GuildFilter({"channels": [10], "roles": [5], "users": [7], "patterns": ["^!"]})
+    assert rules.rejects(discord.Object(7), None, None)
+    assert rules.rejects(make_member(4242, 3, [5]), None, None)
+    assert not rules.rejects(make_member(4242, 3, [6]), None, None)
+    # Uno User o un Object non hanno ruoli: contano solo l'id, il canale e il testo
+    assert not rules.rejects(discord.Object(3), None, None)
+    assert rules.rejects(None, 10, None)
+    assert rules.rejects(None, 11, "!comando")
+    assert not rules.rejects(discord.Object(8), 11, "ciao")
+
+
+def read_ops_log(capsys, count):
+    # ops_log scrive su stdout da un thread: si attende che i messaggi attesi siano arrivati
+    output = ""
+    deadline = time.monotonic() + 5
+    while output.count("\n") < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+        output += capsys.readouterr().out
+    return output.splitlines()
+
+
+def test_filter_patterns_with_inline_flags_and_invalid_entries(capsys):
+    rules = bot.GuildFilter({"patterns": ["(?i)spam", "[non valida", "(a+)+$", "^!"]})
+    assert read_ops_log(capsys, 2) == [
+        "❌ Pattern dei filtri `[non valida` ignorato: unterminated character set at position 0",
+        "❌ Pattern dei filtri `(a+)+$` ignorato: quantificatori annidati non consentiti"
+    ]
+    assert rules.rejects(None, None, "SPAM qui")
+    assert rules.rejects(None, None, "!comando")
+    assert not rules.rejects(None, None, "aaaaaaaaaaaaaaaaaaaaaaaaaaaaaa!")
+    assert bot.filter_pattern_error("(\\w*)*") is not None
+    assert bot.filter_pattern_error("x" * (bot.FILTER_MAX_PATTERN_LENGTH + 1)) is not None
+    assert bot.filter_pattern_error("(ciao|salve)+") is None
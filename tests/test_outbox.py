@@ -0,0 +1,78 @@
+import asyncio
+import os
+
+import discord
+
+import bot
+
+
+def make_outbox(path, **options):
+    outbox = bot.LogOutbox(path=str(path), interval=0.01, **options)
+    outbox.open()
+    return outbox
+
+
+def append(outbox, guild_id, title):
+    return outbox.append(guild_id, 10, "messaggi", discord.Embed(title=title))
+
+
+def titles(outbox, guild_id):
+    return [record["e"]["title"] for _, record in outbox.replay.get(guild_id, ())]
+
+
+def test_outbox_replays_unacked_logs_after_restart(tmp_path):
+    async def first_run():
+        outbox = make_outbox(tmp_path)
+        seqs = [append(outbox, 1, f"log {i}") for i in range(5)]
+        append(outbox, 2, "altro server")
+        outbox.ack(seqs[:2])
+        await outbox.close()
+
+    async def second_run():
+        outbox = make_outbox(tmp_path)
+        assert titles(outbox, 1) == ["log 2", "log 3", "log 4"]
+        # Server non ancora disponibile al primo on_ready: i suoi log restano in attesa
+        outbox.drop_expired()
+        assert titles(outbox, 2) == ["altro server"]
+        outbox.ack(seq for seq, _ in outbox.take_replay(1))
+        outbox.drop_guild(2)
+        await outbox.close()
+
+    async def third_run():
+        outbox = make_outbox(tmp_path)
+        assert outbox.replay == {}
+        await outbox.close()
+
+    asyncio.run(first_run())
+    asyncio.run(second_run())
+    asyncio.run(third_run())
+
+
+def test_outbox_compaction_keeps_pending_logs(tmp_path):
+    async def first_run():
+        outbox = make_outbox(tmp_path, segment_bytes=256, compact_age=0)
+        pending = None
+        for i in range(20):
+            seq = append(outbox, 1, f"log {i}")
+            await outbox.flush()
+            if i == 3:
+                pending = seq
+            else:
+                outbox.ack((seq,))
+        # Due flush: il primo chiude il segmento corrente, il secondo compatta quelli chiusi
+        await outbox.flush()
+        await outbox.flush()
+        segments = [name for name in os.listdir(tmp_path) if name.endswith(".log")]
+        # Il log in attesa era nel primo segmento: è stato riscritto e i segmenti confermati eliminati
+        assert outbox.current >= 3
+        assert "00000000.log" not in segments and len(segments) <= 2
+        assert outbox.segment_of[pending] == outbox.current
+        await outbox.close()
+
+    async def second_run():
+        outbox = make_outbox(tmp_path)
+        assert titles(outbox, 1) == ["log 3"]
+        await outbox.close()
+
+    asyncio.run(first_run())
+    asyncio.run(second_run())
@@ -0,0 +1,145 @@
+import asyncio
+import time
+
+import discord
+
+import bot
+
+GUILD_ID = 1
+
+
+def log(title, user_id=None, channel_id=None, description=""):
+    embed = discord.Embed(title=title, description=description)
+    if user_id is not None:
+        embed.add_field(name="ID Utente", value=str(user_id))
+    if channel_id is not None:
+        embed.add_field(name="ID Canale", value=str(channel_id))
+    return embed
+
+
+def make_index(path, **options):
+    index = bot.LogIndex(path=str(path / "index.db"), delay=0.01, **options)
+    index.open()
+    return index
+
+
+def query(since_days=7, log_type=None, user_id=None, channel_id=None, text=None):
+    return (GUILD_ID, time.time() - since_days * 86400, log_type, user_id, channel_id, text)
+
+
+def test_index_row_reads_public_fields_and_mentions():
+    row = bot.index_row(GUILD_ID, "messaggi", log("Messaggio", user_id=5, channel_id=6), 1.0)
+    assert row[2:4] == (5, 6)
+    assert "ID Utente: 5" in row[7]
+    row = bot.index_row(GUILD_ID, "messaggi", log("Messaggio", description="<@!7> in <#8>"), 1.0)
+    assert row[2:4] == (7, 8)
+
+
+def test_search_filters_by_user_type_channel_days_and_text(tmp_path):
+    async def run():
+        index = make_index(tmp_path)
+        now = time.time()
+        index.pending.extend([
+            (GUILD_ID, "messaggi", log("Messaggio inviato", user_id=10, channel_id=20, description="ciao mondo"), now),
+            (GUILD_ID, "messaggi", log("Messaggio inviato", user_id=11, channel_id=21, description="buongiorno"), now),
+            (GUILD_ID, "ban_unban", log("Utente bannato", user_id=10), now - 3 * 86400),
+            (GUILD_ID, "messaggi", log("Messaggio vecchio", user_id=10), now - 30 * 86400),
+            (GUILD_ID + 1, "messaggi", log("Altro server", user_id=10), now)
+        ])
+        try:
+            async def titles(**filters):
+                total, rows = await index.search(query(**filters))
+                return total, sorted(row[2] for row in rows)
+
+            assert await titles(user_id=10) == (2, ["Messaggio inviato", "Utente bannato"])
+            assert await titles(log_type="ban_unban") == (1, ["Utente bannato"])
+            assert await titles(channel_id=21) == (1, ["Messaggio inviato"])
+            assert await titles(since_days=1) == (2, ["Messaggio inviato", "Messaggio inviato"])
+            assert await titles(since_days=60, user_id=10) == (3, ["Messaggio inviato", "Messaggio vecchio", "Utente bannato"])
+            assert await titles(text="mondo") == (1, ["Messaggio inviato"])
+            # Le parole sono termini tra virgolette in AND: la sintassi FTS dell'utente non viene interpretata
+            assert await titles(text='mondo" OR "buongiorno') == (0, [])
+            assert await titles(text="ciao buongiorno") == (0, [])
+        finally:
+            await index.close()
+
+    asyncio.run(run())
+
+
+def test_index_retention_prunes_rows_and_full_text(tmp_path):
+    async def run():
+        index = make_index(tmp_path, retention_days=7)
+        now = time.time()
+        index.pending.extend([
+            (GUILD_ID, "messaggi", log("Scaduto", description="parola"), now - 8 * 86400),
+            (GUILD_ID, "messaggi", log("Recente", description="parola"), now)
+        ])
+        await index.flush()
+        assert index.conn.execute("SELECT title FROM log_events").fetchall() == [("Recente",)]
+        assert index.conn.execute("SELECT COUNT(*) FROM log_events_fts").fetchone()[0] == 1
+        await index.close()
+
+    asyncio.run(run())
+
+
+def test_index_starts_one_size_flush_at_a_time(tmp_path):
+    async def run():
+        index = make_index(tmp_path, flush_size=3)
+        for i in range(10):
+            index.add(GUILD_ID, "messaggi", log(f"Log {i}"))
+        task = index.size_flush
+        assert task is not None
+        index.add(GUILD_ID, "messaggi", log("Log 10"))
+        assert index.size_flush is task
+        await index.close()
+        assert index.size_flush is None and index.flush_task.done()
+
+    asyncio.run(run())
+    index = make_index(tmp_path)
+    assert index.conn.execute("SELECT COUNT(*) FROM log_events").fetchone()[0] == 11
+    index.conn.close()
+    index.reader.close()
+
+
+class FakeResponse:
+    def __init__(self):
+        self.edited = None
+
+    async def edit_message(self, **kwargs):
+        self.edited = kwargs
+
+
+def test_search_pagination_boundaries(tmp_path, monkeypatch):
+    async def run():
+        index = make_index(tmp_path)
+        monkeypatch.setattr(bot, "log_index", index)
+        now = time.time()
+        total = bot.SEARCH_PAGE_SIZE * 2 + 3
+        index.pending.extend(
+            (GUILD_ID, "messaggi", log(f"Log {i}"), now - i) for i in range(total)
+        )
+        try:
+            found, rows = await index.search(query())
+            assert found == total and len(rows) == bot.SEARCH_PAGE_SIZE
+            assert rows[0][2] == "Log 0"
+            embed = bot.search_results_embed(query(), 0, found, rows)
+            assert embed.footer.text == f"Pagina 1/3 • {total} risultati"
+
+            view = bot.SearchLogsView(42, query(), found)
+            assert view.previous.disabled and not view.next.disabled
+            for expected_page, expected_rows in ((1, bot.SEARCH_PAGE_SIZE), (2, 3)):
+                response = FakeResponse()
+                view.page += 1
+                await view._show(type("Interaction", (), {"response": response})())
+                assert view.page == expected_page
+                embed = response.edited["embed"]
+                assert embed.footer.text.startswith(f"Pagina {expected_page + 1}/3")
+                assert embed.description.count("**Log ") == expected_rows
+            assert not view.previous.disabled and view.next.disabled
+
+            _, empty = await index.search(query(), 3)
+            assert empty == []
+        finally:
+            await index.close()
+
+    asyncio.run(run())
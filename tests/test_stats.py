@@ -0,0 +1,127 @@
+import asyncio
+
+import discord
+
+import bot
+
+GUILD_ID = 100
+VOICE_ID, AFK_ID, STAGE_ID = 301, 302, 303
+# Un istante allineato al giorno, così minuti, ore e giorni partono tutti da un bucket nuovo
+DAY = 86400 * 20000
+
+
+def totals(activity, period, now, kind=bot.STAT_MESSAGES):
+    return [row[kind] for row in activity.series(period, now)]
+
+
+def test_hits_land_in_every_ring():
+    activity = bot.GuildActivity()
+    activity.hit(bot.STAT_MESSAGES, 2, DAY)
+    activity.hit(bot.STAT_MESSAGES, 3, DAY + 59)
+    activity.hit(bot.STAT_BANS, 1, DAY + 60)
+    hour = totals(activity, "ora", DAY + 60)
+    assert len(hour) == 60 and hour[-2:] == [5, 0]
+    assert totals(activity, "ora", DAY + 60, bot.STAT_BANS)[-1] == 1
+    assert totals(activity, "giorno", DAY + 60)[-1] == 5
+    assert totals(activity, "mese", DAY + 60)[-1] == 5
+
+
+def test_minute_ring_rolls_over_into_hours_and_days():
+    activity = bot.GuildActivity()
+    activity.hit(bot.STAT_MESSAGES, 1, DAY)
+    # Un'ora dopo lo slot del minuto viene riusato e azzerato, mentre l'ora precedente resta nell'anello delle ore
+    later = DAY + 3600
+    activity.hit(bot.STAT_MESSAGES, 4, later)
+    assert totals(activity, "ora", later) == [0] * 59 + [4]
+    assert totals(activity, "giorno", later)[-2:] == [1, 4]
+    assert totals(activity, "mese", later)[-1] == 5
+    # 24 ore dopo anche l'anello delle ore si svuota, il mese tiene entrambi i giorni
+    tomorrow = DAY + 86400 + 3600
+    activity.hit(bot.STAT_MESSAGES, 7, tomorrow)
+    assert sum(totals(activity, "giorno", tomorrow)) == 7
+    assert totals(activity, "mese", tomorrow)[-2:] == [5, 7]
+    # Dopo 30 giorni il primo giorno esce dalla finestra
+    month = DAY + 86400 * 30
+    activity.hit(bot.STAT_MESSAGES, 1, month)
+    assert totals(activity, "mese", month) == [7] + [0] * 28 + [1]
+
+
+def test_clock_going_backwards_keeps_newer_buckets():
+    activity = bot.GuildActivity()
+    activity.hit(bot.STAT_MESSAGES, 1, DAY + 3600)
+    activity.hit(bot.STAT_MESSAGES, 1, DAY)
+    assert totals(activity, "ora", DAY + 3600)[-1] == 1
+
+
+def test_stats_survive_save_and_reload(tmp_path, monkeypatch):
+    path = str(tmp_path / "activity_stats.db")
+
+    async def run():
+        stats = bot.ActivityStats(path)
+        stats.open()
+        stats.hit(GUILD_ID, bot.STAT_MESSAGES, 3)
+        stats.hit(GUILD_ID, bot.STAT_JOINS)
+        await stats.close()
+        assert not stats.dirty
+
+        reloaded = bot.ActivityStats(path)
+        reloaded.open()
+        try:
+            now = int(bot.time.time())
+            activity = reloaded.guilds[GUILD_ID]
+            assert activity.to_bytes() == stats.guilds[GUILD_ID].to_bytes()
+            assert totals(activity, "giorno", now)[-1] == 3
+            assert totals(activity, "giorno", now, bot.STAT_JOINS)[-1] == 1
+        finally:
+            await reloaded.close()
+
+    monkeypatch.setattr(bot, "owns_guild", lambda guild_id: True)
+    asyncio.run(run())
+
+
+def test_corrupted_row_is_reset(tmp_path, monkeypatch):
+    path = str(tmp_path / "activity_stats.db")
+    messages = []
+    monkeypatch.setattr(bot, "owns_guild", lambda guild_id: True)
+    monkeypatch.setattr(bot, "ops_log", messages.append)
+    stats = bot.ActivityStats(path)
+    stats.open()
+    stats._write([(GUILD_ID, b"rotto")])
+    stats.conn.close()
+
+    reloaded = bot.ActivityStats(path)
+    reloaded.open()
+    reloaded.conn.close()
+    assert GUILD_ID not in reloaded.guilds
+    assert messages == [f"❌ Statistiche del server {GUILD_ID} non valide: azzerate"]
+
+
+def voice_guild():
+    def channel(channel_id, name, kind):
+        return {
+            "id": str(channel_id), "guild_id": str(GUILD_ID), "type": kind, "name": name, "position": 0,
+            "permission_overwrites": [], "parent_id": None, "bitrate": 64000, "user_limit": 0
+        }
+
+    data = {
+        "id": str(GUILD_ID), "name": "server", "owner_id": "1", "afk_channel_id": str(AFK_ID), "afk_timeout": 300,
+        "roles": [], "emojis": [], "stickers": [], "features": [], "member_count": 4,
+        "channels": [channel(VOICE_ID, "voce", 2), channel(AFK_ID, "afk", 2), channel(STAGE_ID, "palco", 13)]
+    }
+    guild = discord.Guild(data=data, state=bot.bot._connection)
+    for user_id, channel_id in ((1, VOICE_ID), (2, VOICE_ID), (3, AFK_ID), (4, STAGE_ID)):
+        guild._update_voice_state({
+            "user_id": str(user_id), "session_id": "s", "deaf": False, "mute": False, "self_deaf": False,
+            "self_mute": False, "self_video": False, "suppress": False
+        }, channel_id)
+    return guild
+
+
+def test_sample_voice_counts_connected_members_outside_afk(tmp_path, monkeypatch):
+    guild = voice_guild()
+    monkeypatch.setattr(bot.bot._connection, "_guilds", {GUILD_ID: guild})
+    stats = bot.ActivityStats(str(tmp_path / "activity_stats.db"))
+    stats.sample_voice()
+    now = int(bot.time.time())
+    assert totals(stats.guilds[GUILD_ID], "ora", now, bot.STAT_VOICE_MINUTES)[-1] == 3
+    assert stats.dirty == {GUILD_ID}
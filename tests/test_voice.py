@@ -0,0 +1,140 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import discord
+
+import bot
+
+GUILD_ID = 100
+VOICE_ID, OTHER_ID = 301, 302
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+
+class FakeMember:
+    def __init__(self, member_id, guild):
+        self.id = member_id
+        self.guild = guild
+
+    def __str__(self):
+        return f"utente{self.id}"
+
+
+def make_guild():
+    def channel(channel_id, name):
+        return {
+            "id": str(channel_id), "guild_id": str(GUILD_ID), "type": 2, "name": name, "position": 0,
+            "permission_overwrites": [], "parent_id": None, "bitrate": 64000, "user_limit": 0
+        }
+
+    return discord.Guild(data={
+        "id": str(GUILD_ID), "name": "server", "owner_id": "1", "roles": [], "emojis": [], "features": [],
+        "channels": [channel(VOICE_ID, "voce"), channel(OTHER_ID, "altro")]
+    }, state=bot.bot._connection)
+
+
+def state(channel_id=None):
+    return SimpleNamespace(channel=SimpleNamespace(id=channel_id) if channel_id else None)
+
+
+def setup(monkeypatch, guild):
+    clock = FakeClock()
+    sent = []
+
+    async def send_log(guild, log_type, embed, file=None):
+        sent.append((log_type, embed, file))
+
+    monkeypatch.setattr(bot, "time", clock)
+    monkeypatch.setattr(bot, "send_log", send_log)
+    monkeypatch.setattr(bot, "VOICE_FLUSH_INTERVAL", 3600)
+    monkeypatch.setattr(bot.bot._connection, "_guilds", {GUILD_ID: guild})
+    return clock, sent
+
+
+def fields_of(embed):
+    return {field.name: field.value for field in embed.fields}
+
+
+def test_voice_sessions_and_hourly_summary(monkeypatch):
+    guild = make_guild()
+    clock, sent = setup(monkeypatch, guild)
+    first, second = FakeMember(1, guild), FakeMember(2, guild)
+    start = clock.now
+
+    async def run():
+        tracker = bot.VoiceTracker()
+        tracker.update(first, state(), state(VOICE_ID))
+        clock.now += 10
+        tracker.update(second, state(), state(VOICE_ID))
+        clock.now += 60
+        tracker.update(first, state(VOICE_ID), state(OTHER_ID))
+        clock.now += 10
+        tracker.update(first, state(OTHER_ID), state(OTHER_ID))  # mute/deaf: stesso canale
+        clock.now += 50
+        tracker.update(first, state(OTHER_ID), state())
+        await tracker.flush()
+        assert len(sent) == 1  # il riepilogo orario non è ancora dovuto
+        clock.now = start + 3600
+        await tracker.flush()
+        # Chi è ancora in vocale passa al periodo successivo senza contare un nuovo ingresso
+        clock.now += 100
+        await tracker.close()
+
+    asyncio.run(run())
+    assert [(log_type, embed.title) for log_type, embed, _ in sent] == [
+        ("voice", "🔊 Sessioni vocali concluse"),
+        ("voice", "📊 Riepilogo attività vocale"),
+        ("voice", "📊 Riepilogo attività vocale")
+    ]
+    sessions = sent[0][1]
+    assert f"<@1> · <#{VOICE_ID}> → <#{OTHER_ID}> · <t:{int(start)}:t>–<t:{int(start) + 130}:t> · 2m 10s" == sessions.description
+    assert fields_of(sessions) == {"Sessioni": "1", "Durata totale": "2m 10s"}
+    assert sent[0][2] is None
+
+    summary = fields_of(sent[1][1])
+    assert list(summary) == ["voce", "altro"]
+    assert summary["voce"] == f"<#{VOICE_ID}>\n2 utenti · 2 ingressi\n1h 01m totali · picco 2"
+    assert summary["altro"] == f"<#{OTHER_ID}>\n1 utenti · 1 ingressi\n1m 00s totali · picco 1"
+    assert fields_of(sent[2][1]) == {"voce": f"<#{VOICE_ID}>\n1 utenti · 0 ingressi\n1m 40s totali · picco 1"}
+
+
+def test_seeded_sessions_overflow_into_attached_file(monkeypatch):
+    guild = make_guild()
+    for member_id in (3, 4):
+        guild._update_voice_state({
+            "user_id": str(member_id), "session_id": "s", "deaf": False, "mute": False, "self_deaf": False,
+            "self_mute": False, "self_video": False, "suppress": False
+        }, VOICE_ID)
+    clock, sent = setup(monkeypatch, guild)
+    monkeypatch.setattr(bot, "VOICE_RECORDS_PER_EMBED", 1)
+
+    async def run():
+        tracker = bot.VoiceTracker()
+        tracker.seed(guild)
+        clock.now += 90
+        for member_id in (3, 4):
+            tracker.update(FakeMember(member_id, guild), state(VOICE_ID), state())
+        await tracker.flush()
+        tracker.task.cancel()
+
+    asyncio.run(run())
+    (_, embed, file), = sent
+    assert "prima dell'avvio" in embed.description
+    assert embed.description.endswith("… altre 1 sessioni nel file allegato")
+    assert fields_of(embed)["Sessioni"] == "2"
+    records = [json.loads(line) for line in file.source.decode("utf-8").splitlines()]
+    assert [(record["user_id"], record["joined"], record["duration"]) for record in records] == [(3, None, 90), (4, None, 90)]